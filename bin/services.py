@@ -23,9 +23,60 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
 # Only add standard python modules here. When running under a virtualenv other modules are not
 # available at this point.
 import os
+import threading
 import urllib
 import cgi
 
+SETTINGS_FILE = "/etc/cobbler/settings"
+
+# Everything below is set up once per WSGI process and reused by the
+# requests it serves: the parsed settings (re-read only when the file
+# changes) and, per thread, a CobblerSvc with its XMLRPC connection.
+settings_lock = threading.Lock()
+settings_mtime = None
+settings_data = {}
+settings_generation = 0
+local = threading.local()
+
+
+def load_settings():
+    """
+    Return the parsed settings file and a number that changes every time
+    the file is re-read because its mtime changed.
+    """
+    global settings_mtime, settings_data, settings_generation
+    import yaml
+
+    mtime = os.stat(SETTINGS_FILE).st_mtime
+    settings_lock.acquire()
+    try:
+        if mtime != settings_mtime:
+            fd = open(SETTINGS_FILE)
+            data = fd.read()
+            fd.close()
+            settings_data = yaml.safe_load(data) or {}
+            settings_mtime = mtime
+            settings_generation += 1
+        return (settings_data, settings_generation)
+    finally:
+        settings_lock.release()
+
+
+def get_service():
+    """
+    Return the CobblerSvc of the current thread, creating it (and so its
+    XMLRPC connection) the first time and whenever the settings changed.
+    """
+    from cobbler.services import CobblerSvc
+
+    (ydata, generation) = load_settings()
+    if getattr(local, "generation", None) != generation:
+        remote_port = ydata.get("xmlrpc_port", 25151)
+        local.svc = CobblerSvc(server="http://127.0.0.1:%s" % remote_port)
+        local.svc.collection_mgr._settings.from_dict(ydata)
+        local.generation = generation
+    return local.svc
+
 
 def application(environ, start_response):
 
@@ -37,9 +88,6 @@ def application(environ, start_response):
         site.addsitedir(distutils.sysconfig.get_python_lib(prefix=environ['VIRTUALENV']))
         # Now all modules are available even under a virtualenv
 
-    import yaml
-    from cobbler.services import CobblerSvc
-
     my_uri = urllib.unquote(environ['REQUEST_URI'])
 
     form = {}
@@ -69,15 +117,9 @@ def application(environ, start_response):
     # it's always present in this context.
     form["REMOTE_ADDR"] = environ.get("REMOTE_ADDR", None)
 
-    # Read config for the XMLRPC port to connect to:
-    fd = open("/etc/cobbler/settings")
-    data = fd.read()
-    fd.close()
-    ydata = yaml.safe_load(data)
-    remote_port = ydata.get("xmlrpc_port", 25151)
-
-    # instantiate a CobblerWeb object
-    cw = CobblerSvc(server="http://127.0.0.1:%s" % remote_port)
+    # the CobblerSvc object of this thread, connected to the XMLRPC port
+    # from the settings file
+    cw = get_service()
 
     # check for a valid path/mode
     # handle invalid paths gracefully
@@ -10,6 +10,10 @@ xinetd, or as a stand-alone daemon.  If called via xinetd, it will run,
 handling requests, until it has been idle for at least 30 seconds, and
 will then exit.
 
+As a stand-alone daemon, --workers=N forks N processes sharing the port
+with SO_REUSEPORT, each with its own caches, under a supervisor that
+restarts the ones that die and logs their combined stats.
+
 This server queries cobbler for information about hosts that make requests,
 and will instantiate template files from the materialized hosts'
 'fetchable_files' attribute.
@@ -26,13 +30,23 @@ VERSION
     0.5
 
 TODO
-    Requirement: retransmit
-    Requirement: Ignore stale retrainsmits
     Security:    only return files that are o+r
     Security:    support hosts.allow/deny
     Security:    Make absolute path support optional, and default off
     Feature:     support blksize2 (blksize, limited to powers of 2)
-    Feature:     support utimeout (timeout, in ms)
+
+    Supports the rfc2347 options blksize, timeout, tsize, utimeout (the
+    timeout in microseconds) and the rfc7440 windowsize, which lets
+    clients ACK only every n-th DATA block.
+
+    With --multicast_group, plain files are also sent with the rfc2090
+    multicast option: the clients fetching the same file at the same
+    time share one stream of DATA to the group, one port per file.
+
+    Unanswered DATA and OACK packets are retransmitted with exponential
+    backoff, after a timeout adapted to the round trip time measured
+    (as for TCP, rfc6298) unless the client set one.  Duplicate ACKs
+    never trigger a resend (rfc1123 4.2.3.1, "Sorcerer's Apprentice").
 
 """
 
@@ -47,21 +61,26 @@ import optparse
 import re
 import socket
 import pwd
+import threading
 import traceback
 import logging
 import logging.handlers
 import xmlrpclib
+import json
+import signal
+import select
+import fcntl
 
-from collections import deque
+from collections import deque, OrderedDict
 from fnmatch import fnmatch
+from multiprocessing.pool import ThreadPool
 from cobbler.utils import local_get_cobbler_api_url, tftpboot_location
 
 import tornado.ioloop as ioloop
 import cobbler.templar
 import Cheetah      # need exception types
 
-from struct import pack, unpack
-from subprocess import Popen, PIPE, STDOUT
+from struct import pack, pack_into, unpack
 
 # Data/Defines
 TFTP_OPCODE_RRQ = 1
@@ -70,17 +89,29 @@ TFTP_OPCODE_ACK = 4
 TFTP_OPCODE_ERROR = 5
 TFTP_OPCODE_OACK = 6
 
-COBBLER_HANDLE = xmlrpclib.Server(local_get_cobbler_api_url())
+COBBLER_API_URL = local_get_cobbler_api_url()
+
+# what a text file is made of: printable ascii, any 8 bit character
+# (utf-8, latin-1) and the usual whitespace/formatting controls
+TEXT_CHARS = "".join(map(chr, [7, 8, 9, 10, 12, 13, 27] + range(0x20, 0x7f) + range(0x80, 0x100)))
 
 OPTIONS = {
     "port": "69",
     "timeout": 10,
     "min_timeout": 1,
     "max_timeout": 255,
+    "min_utimeout": 10000,
+    "max_utimeout": 255000000,
+    "rto": 1.0,             # retransmit timeout until the rtt is measured
+    "min_rto": 0.1,
+    "max_rto": 10.0,        # retransmit backoff limit
     "blksize": 512,         # that's the default, required
     "max_blksize": 1428,    # MTU - overhead
     "min_blksize": 512,     # the default is small enough already
-    "retries": 4,
+    "windowsize": 1,        # rfc7440, 1 is plain lock-step rfc1350
+    "max_windowsize": 64,
+    "min_windowsize": 1,
+    "retries": 4,           # retransmits before giving up
     "verbose": False,
     "debug": False,
     "idle": 0,              # how long to stick around: 0: unlimited
@@ -88,11 +119,23 @@ OPTIONS = {
     "cache": True,          # 'cache-time' = 300
     "cache-time": 5 * 300,
     "neg-cache-time": 10,
+    "lookup_threads": 8,    # threads for cobbler lookups, off the event loop
+    "system_map_interval": 5,  # seconds between system map refreshes, 0: off
+    "file_cache_size": 512,  # MB of files kept in memory for all transfers, larger ones are streamed
+    "render_cache_size": 4096,  # rendered templates and names kept
+    "workers": 1,           # processes sharing the port, standalone only
+    "stats_interval": 60,   # seconds between worker stats reports
+    "stats_file": "",       # prometheus text format stats, rewritten every stats_interval
+    "multicast_group": "",  # rfc2090 multicast transfers to this group, "": off
+    "multicast_port": 1758,  # first of the group ports, one per session
+    "multicast_sessions": 16,
+    "multicast_ttl": 1,
+    "multicast_interface": "",  # address of the interface to multicast on
     "active": 0,
     "prefix": tftpboot_location(),
     "logger": "stream",
-    "file_cmd": "/usr/bin/file",
     "user": "nobody",
+    "cobbler_url": COBBLER_API_URL,
     # the well known socket.  needs to be global for timeout
     # Using the options hash as a hackaround for python's
     # "create a new object at local scope by default" design.
@@ -112,6 +155,168 @@ ERRORS = [
 ]
 
 REQUESTS = None
+FILE_CACHE = None
+RENDER_CACHE = None
+LOOKUP_POOL = None
+SYSTEM_MAP = None
+# (client address, file name) of the RRQs waiting for their lookups
+PENDING_RRQS = set()
+METRICS = None
+
+# not in the socket module of python 2
+SO_REUSEPORT = getattr(socket, "SO_REUSEPORT", 15)
+
+THREAD_LOCAL = threading.local()
+
+
+def cobbler_handle():
+    """
+    Returns the XMLRPC connection to cobblerd of the calling thread;
+    lookups run in several threads and a ServerProxy is not thread safe.
+    """
+    if not hasattr(THREAD_LOCAL, "handle"):
+        THREAD_LOCAL.handle = xmlrpclib.Server(OPTIONS["cobbler_url"])
+    return THREAD_LOCAL.handle
+
+
+# name -> (type, help) of what the stats file shows
+METRIC_INFO = {
+    "tftpd_requests_total": ("counter", "Read requests accepted"),
+    "tftpd_active_requests": ("gauge", "Requests being looked up or transferred"),
+    "tftpd_transfers_completed_total": ("counter", "Transfers acknowledged to the last block"),
+    "tftpd_transfers_failed_total": ("counter", "Transfers that ended with an error or timed out"),
+    "tftpd_transfer_seconds": ("histogram", "Time from read request to the end of the transfer"),
+    "tftpd_sent_bytes_total": ("counter", "Bytes sent, retransmits included"),
+    "tftpd_retransmits_total": ("counter", "Packets sent again after a retransmit timeout"),
+    "tftpd_duplicate_acks_total": ("counter", "Duplicate or stale ACKs ignored"),
+    "tftpd_lookup_seconds": ("histogram", "Time taken to look a system up in cobblerd"),
+    "tftpd_render_seconds": ("histogram", "Time taken to render a template or file name"),
+    "tftpd_cache_hits_total": ("counter", "Lookups answered from a cache"),
+    "tftpd_cache_misses_total": ("counter", "Lookups a cache could not answer"),
+    "tftpd_file_cache_bytes": ("gauge", "Size of the files kept in memory"),
+    "tftpd_system_map_systems": ("gauge", "Systems in the system map"),
+}
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10)
+TRANSFER_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 300)
+
+
+class Metrics:
+    """
+    Counters and histograms of this process, updated from the event loop
+    and the lookup threads.  dump() returns them as a dict that can be
+    sent as JSON, merged with the dumps of other workers by
+    merge_metrics(), and written out in the Prometheus text format by
+    format_metrics().
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # sample ('name' or 'name{label="value"}') -> value
+        self.counters = {}
+        # name -> [buckets, count per bucket, sum, count]
+        self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        if labels:
+            name = "%s{%s}" % (name, ",".join(['%s="%s"' % kv for kv in sorted(labels.items())]))
+        self.lock.acquire()
+        self.counters[name] = self.counters.get(name, 0) + value
+        self.lock.release()
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS):
+        self.lock.acquire()
+        try:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = [buckets, [0] * len(buckets), 0.0, 0]
+            for (i, bound) in enumerate(buckets):
+                if value <= bound:
+                    histogram[1][i] += 1
+                    break
+            histogram[2] += value
+            histogram[3] += 1
+        finally:
+            self.lock.release()
+
+    def dump(self):
+        """Returns the metrics, the gauges read from the caches included."""
+        self.lock.acquire()
+        try:
+            counters = dict(self.counters)
+            histograms = dict([(k, [list(v[0]), list(v[1]), v[2], v[3]])
+                               for (k, v) in self.histograms.items()])
+        finally:
+            self.lock.release()
+
+        counters["tftpd_active_requests"] = OPTIONS["active"]
+        for (name, cache) in (("file", FILE_CACHE), ("render", RENDER_CACHE)):
+            if cache is not None:
+                counters['tftpd_cache_hits_total{cache="%s"}' % name] = cache.hits
+                counters['tftpd_cache_misses_total{cache="%s"}' % name] = cache.misses
+        if FILE_CACHE is not None:
+            counters["tftpd_file_cache_bytes"] = FILE_CACHE.size
+        if SYSTEM_MAP is not None:
+            counters["tftpd_system_map_systems"] = len(SYSTEM_MAP.index[0])
+        return {"counters": counters, "histograms": histograms}
+
+
+def merge_metrics(dumps):
+    """Adds up the Metrics.dump() of several workers."""
+    counters = {}
+    histograms = {}
+    for dump in dumps:
+        for (k, v) in dump["counters"].items():
+            counters[k] = counters.get(k, 0) + v
+        for (k, v) in dump["histograms"].items():
+            if k not in histograms:
+                histograms[k] = [v[0], list(v[1]), v[2], v[3]]
+            else:
+                histogram = histograms[k]
+                histogram[1] = [a + b for (a, b) in zip(histogram[1], v[1])]
+                histogram[2] += v[2]
+                histogram[3] += v[3]
+    return {"counters": counters, "histograms": histograms}
+
+
+def format_metrics(dump):
+    """Returns the Prometheus text format of a Metrics.dump()."""
+    samples = {}
+    for (sample, value) in sorted(dump["counters"].items()):
+        samples.setdefault(sample.split("{")[0], []).append("%s %s" % (sample, value))
+    for (name, (buckets, counts, total, count)) in dump["histograms"].items():
+        lines = samples.setdefault(name, [])
+        cumulative = 0
+        for (bound, n) in zip(buckets, counts):
+            cumulative += n
+            lines.append('%s_bucket{le="%s"} %d' % (name, bound, cumulative))
+        lines.append('%s_bucket{le="+Inf"} %d' % (name, count))
+        lines.append("%s_sum %f" % (name, total))
+        lines.append("%s_count %d" % (name, count))
+
+    out = []
+    for name in sorted(samples.keys()):
+        (kind, text) = METRIC_INFO.get(name, ("untyped", name))
+        out.append("# HELP %s %s." % (name, text))
+        out.append("# TYPE %s %s" % (name, kind))
+        out.extend(samples[name])
+    return "\n".join(out) + "\n"
+
+
+def write_metrics(dump):
+    """Replaces the stats file with dump, for the node_exporter textfile
+       collector or anything else that scrapes it."""
+    path = OPTIONS["stats_file"]
+    tmp = "%s.tmp.%d" % (path, os.getpid())
+    try:
+        fd = open(tmp, "w")
+        try:
+            fd.write(format_metrics(dump))
+        finally:
+            fd.close()
+        os.rename(tmp, path)
+    except (IOError, OSError), e:
+        logging.warn("Unable to write %s: %s" % (path, e))
 
 
 class RenderedFile:
@@ -125,9 +330,13 @@ class RenderedFile:
     def __init__(self, data=""):
         """
         Provide the string to be served out as an argument to the
-        constructor.  The data object needs to support slices.
+        constructor.  The data object needs to support the buffer
+        interface, like a string.
         """
+        if isinstance(data, unicode):
+            data = data.encode("utf-8")
         self.data = data
+        self.size = len(data)
         self.offset = 0
 
     def seek(self, bytes):
@@ -138,13 +347,315 @@ class RenderedFile:
         self.offset = bytes
 
     def read(self, size):
-        """Returns <size> bytes relative to the current offset."""
-        end = self.offset + size
-        return self.data[self.offset:end]
+        """Returns <size> bytes relative to the current offset, as a
+        buffer object which does not copy them."""
+        return buffer(self.data, self.offset, size)
 
     def fileno(self):
         return 0
 
+    def close(self):
+        pass
+
+
+class StreamedFile:
+    """
+    A file too large for the FileCache, read block by block from a file
+    object of its own, with the same interface as RenderedFile.
+    """
+
+    def __init__(self, fd, size):
+        self.fd = fd
+        self.size = size
+
+    def seek(self, bytes):
+        self.fd.seek(bytes)
+
+    def read(self, size):
+        return self.fd.read(size)
+
+    def close(self):
+        self.fd.close()
+
+
+class FileCache:
+    """
+    In-memory copies of the files being served, shared by every transfer
+    of the same file, so 200 clients pulling the same initrd do not each
+    read it from disk.  Entries are keyed by path and only reused while
+    the inode, mtime and size of the file are unchanged; the least
+    recently used ones are dropped once the total size of the cached
+    files exceeds max_size bytes.  Transfers in progress keep their own
+    reference to the contents, so dropping an entry never affects them.
+    Files larger than max_size are not read in, every transfer streams
+    them from a file object of its own.
+
+    Files are read outside the lock, so a cold initrd does not hold up
+    the other lookup threads.  Concurrent opens of a file being read
+    wait for, and share, that read.
+
+    The files are read rather than memory mapped: kernels and boot
+    loaders are copied over in place (cp, shutil.copyfile), and touching
+    a mapping of a file truncated that way kills the process with SIGBUS.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # (path, key) -> [threading.Event, data] of the files being read
+        self.loading = {}
+        # files are opened from the lookup threads
+        self.lock = threading.Lock()
+
+    def open(self, path):
+        """
+        Returns a RenderedFile for the contents of path, or a StreamedFile
+        if it is too large to cache.  Raises IOError or OSError if it can
+        not be read.
+        """
+        fd = open(path, 'rb')
+        try:
+            st = os.fstat(fd.fileno())
+            key = (st.st_dev, st.st_ino, st.st_mtime, st.st_size)
+
+            self.lock.acquire()
+            try:
+                entry = self.entries.pop(path, None)
+                if entry is not None:
+                    if entry[0] == key:
+                        self.hits += 1
+                        self.entries[path] = entry
+                        return RenderedFile(entry[1])
+                    # changed on disk
+                    self.size -= len(entry[1])
+
+                self.misses += 1
+                if st.st_size > self.max_size:
+                    stream = StreamedFile(fd, st.st_size)
+                    fd = None
+                    return stream
+
+                loading = self.loading.get((path, key))
+                owner = loading is None
+                if owner:
+                    loading = [threading.Event(), None]
+                    self.loading[(path, key)] = loading
+            finally:
+                self.lock.release()
+
+            if not owner:
+                loading[0].wait()
+                if loading[1] is not None:
+                    return RenderedFile(loading[1])
+                # the read failed there, try it here
+                return RenderedFile(fd.read())
+
+            data = None
+            try:
+                data = fd.read()
+            finally:
+                self.lock.acquire()
+                try:
+                    del self.loading[(path, key)]
+                    loading[1] = data
+                    if data is not None and path not in self.entries:
+                        self.entries[path] = (key, data)
+                        self.size += len(data)
+                        while self.size > self.max_size:
+                            (old_path, old_entry) = self.entries.popitem(last=False)
+                            self.size -= len(old_entry[1])
+                            logging.debug("dropped %s from the file cache" % old_path)
+                finally:
+                    self.lock.release()
+                loading[0].set()
+            return RenderedFile(data)
+        finally:
+            if fd is not None:
+                fd.close()
+
+
+class RenderCache:
+    """
+    Output of the templates rendered for each system, so pxelinux probing
+    the same names over and over, and retried or repeated fetches, do
+    not render them again.  Entries are keyed by what was rendered and
+    the name of the system, and only reused while the attributes of the
+    system are unchanged and, for template files, the inode, mtime and
+    size of the file too.  At most max_entries are kept, the least
+    recently used ones are dropped first.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        # path -> (inode, mtime, size key, is text)
+        self.text = {}
+        self.hits = 0
+        self.misses = 0
+        # templates are rendered from the lookup threads
+        self.lock = threading.Lock()
+
+    def render(self, key, attrs, stamp, render):
+        """
+        Returns the output of render(), or the cached output of an earlier
+        call with the same key, an equal attrs dict and the same stamp.
+        Nothing is cached if render() raises.
+        """
+        self.lock.acquire()
+        try:
+            entry = self.entries.pop(key, None)
+            if entry is not None and entry[0] == stamp and (entry[1] is attrs or entry[1] == attrs):
+                self.hits += 1
+                self.entries[key] = entry
+                return entry[2]
+            self.misses += 1
+        finally:
+            self.lock.release()
+
+        start = time.time()
+        data = render()
+        METRICS.observe("tftpd_render_seconds", time.time() - start)
+
+        self.lock.acquire()
+        try:
+            self.entries[key] = (stamp, attrs, data)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        finally:
+            self.lock.release()
+        return data
+
+    def is_text(self, path):
+        """
+        Returns whether the file at path looks like text, and so should be
+        rendered as a template: it has no NULs or control characters other
+        than the usual whitespace ones in its first block.  Raises OSError
+        if it can not be stat()ed.
+        """
+        st = os.stat(path)
+        key = (st.st_dev, st.st_ino, st.st_mtime, st.st_size)
+        entry = self.text.get(path)
+        if entry is not None and entry[0] == key:
+            return entry[1]
+
+        fd = open(path, "rb")
+        try:
+            block = fd.read(4096)
+        finally:
+            fd.close()
+        text = len(block) > 0 and not block.translate(None, TEXT_CHARS)
+        self.text[path] = (key, text)
+        return text
+
+
+class SystemMap:
+    """
+    Every system in cobbler, rendered, indexed by MAC and IP address, and
+    every distro, rendered, by name, so that requests are answered without
+    asking cobblerd anything.
+
+    The first refresh() loads all the systems.  Later ones follow
+    cobblerd's change feed (get_changes) and only fetch the systems saved
+    or removed since the previous refresh.  A changed distro, profile or
+    image may change any rendered system, so that triggers a full reload
+    (distros included), as does a restarted cobblerd or falling behind the
+    feed.  The indexes
+    are rebuilt aside and swapped in, lookups never wait for a refresh.
+    """
+
+    # most changes to apply per refresh, the rest follow on the next one
+    batch = 5000
+
+    def __init__(self):
+        # (name -> system, mac -> name, ip -> name)
+        self.index = ({}, {}, {})
+        # name -> distro
+        self.distros = {}
+        self.epoch = None
+        self.seq = 0
+        self.ready = False
+
+    def lookup(self, ip_address=None, mac_address=None):
+        """
+        Returns the rendered system with the given MAC address, or IP
+        address if no MAC address is given, or None.
+        """
+        (systems, by_mac, by_ip) = self.index
+        if mac_address is not None:
+            name = by_mac.get(mac_address.replace("-", ":").upper())
+        else:
+            name = by_ip.get(ip_address)
+        return systems.get(name)
+
+    def distro(self, name):
+        """
+        Returns the rendered distro with the given name, or None.
+        """
+        return self.distros.get(name)
+
+    def refresh(self):
+        """
+        Brings the map up to date with cobblerd.  Runs in a lookup thread.
+        """
+        handle = cobbler_handle()
+        feed = handle.get_changes(self.seq, self.batch)
+        changes = feed["changes"]
+        if feed["epoch"] == self.epoch and not feed["reset"] and not changes:
+            return
+
+        systems = self.index[0]
+        distros = self.distros
+        if (feed["epoch"] != self.epoch or feed["reset"] or
+                [c for c in changes if c["what"] in ("distro", "profile", "image")]):
+            names = handle.get_item_names("system")
+            systems = {}
+            distros = {}
+            for name in handle.get_item_names("distro"):
+                distro = handle.get_distro_as_rendered(name)
+                if "name" in distro:
+                    distros[name] = distro
+        else:
+            names = set([c["name"] for c in changes if c["what"] == "system"])
+            systems = systems.copy()
+
+        for name in names:
+            system = handle.get_system_as_rendered(name)
+            if "name" in system:
+                systems[name] = system
+            else:
+                # removed
+                systems.pop(name, None)
+
+        self.index = (systems,) + self.__addresses(systems)
+        self.distros = distros
+        self.epoch = feed["epoch"]
+        self.seq = feed["seq"]
+        self.ready = True
+        logging.info("System map: %d system(s), %d distro(s), fetched %d system(s)" % (
+            len(systems), len(distros), len(names)))
+
+    def __addresses(self, systems):
+        by_mac = {}
+        by_ip = {}
+        for (name, system) in systems.items():
+            for iface in system.get("interfaces", {}).values():
+                for (index, key) in ((by_mac, "mac_address"), (by_ip, "ip_address")):
+                    address = iface.get(key)
+                    if address in (None, "", "~"):
+                        continue
+                    if key == "mac_address":
+                        address = address.upper()
+                    if index.get(address, name) != name:
+                        # like find_system, refuse to pick one
+                        logging.warn("%s maps to multiple systems" % address)
+                        index[address] = None
+                    else:
+                        index[address] = name
+        return (by_mac, by_ip)
+
 
 class Packet:
     """
@@ -224,7 +735,12 @@ class DATAPacket(Packet):
         self.blk_num = blk_num
 
     def marshall(self):
-        return pack("!HH %ds" % (len(self.data)), TFTP_OPCODE_DATA, self.blk_num & 0xFFFF, str(self.data))
+        # the data is usually a buffer into a cached file, copy it
+        # straight into the packet
+        packet = bytearray(4 + len(self.data))
+        pack_into("!HH", packet, 0, TFTP_OPCODE_DATA, self.blk_num & 0xFFFF)
+        packet[4:] = self.data
+        return packet
 
 
 class ACKPacket(Packet):
@@ -262,10 +778,11 @@ class ERRORPacket(Packet):
         self.error_str = data[4:-1]
         logging.debug("ERROR %d: %s from %s" % (self.error_code, self.error_str, remote_addr))
 
-# FIXME: disabled as per pyflakes, not really sure about this one..
-#    def __init__(self, error_code, error_str):
-#        self.error_code = error_code
-#        self.error_str  = error_str
+    @classmethod
+    def create(cls, error_code, error_str):
+        """Returns a new ERROR packet to send"""
+        return cls(pack("!Hh %dsB" % len(error_str), TFTP_OPCODE_ERROR, error_code, error_str, 0),
+                   None, None)
 
     def is_error(self):
         return True
@@ -301,14 +818,60 @@ class XMLRPCSystem:
     Use XMLRPC to look up system attributes.  This is the recommended
     method.
 
-    The cache is controlled by the "cache" option and the "cache-time"
-    option
+    Once the SystemMap is loaded systems are looked up in it, and
+    cobblerd is not asked at all.  attrs is then the map's own dict,
+    shared by every request for the system, and must not be changed.  Until then, or without it, the cache
+    is controlled by the "cache" option and the "cache-time" option.
+
+    Lookups run in the lookup threads.  Concurrent lookups for the same
+    address are coalesced: the first one makes the XMLRPC calls and the
+    others wait for, and share, its result.
     """
     cache = {}
+    # (ip, mac) -> [threading.Event, result] of the lookups in progress
+    lookups = {}
+    lock = threading.Lock()
 
     def __init__(self, ip_address=None, mac_address=None):
+        if SYSTEM_MAP is not None and SYSTEM_MAP.ready:
+            self.system = SYSTEM_MAP.lookup(ip_address, mac_address)
+            if self.system is not None:
+                METRICS.inc("tftpd_cache_hits_total", cache="system_map")
+                self.attrs = self.system
+                self.name = self.attrs["name"]
+            else:
+                METRICS.inc("tftpd_cache_misses_total", cache="system_map")
+                self.attrs = dict()
+                self.name = str(ip_address)
+            return
+
+        key = (ip_address, mac_address)
+        XMLRPCSystem.lock.acquire()
+        lookup = XMLRPCSystem.lookups.get(key)
+        owner = lookup is None
+        if owner:
+            lookup = [threading.Event(), None]
+            XMLRPCSystem.lookups[key] = lookup
+        XMLRPCSystem.lock.release()
+
+        if owner:
+            try:
+                self._resolve(ip_address, mac_address)
+                lookup[1] = (self.system, self.attrs, self.name)
+            finally:
+                XMLRPCSystem.lock.acquire()
+                del XMLRPCSystem.lookups[key]
+                XMLRPCSystem.lock.release()
+                lookup[0].set()
+        else:
+            logging.debug("Waiting for lookup of %s,%s in progress" % key)
+            lookup[0].wait()
+            (self.system, self.attrs, self.name) = lookup[1] or (None, dict(), str(ip_address))
+
+    def _resolve(self, ip_address, mac_address):
         name = None
         resolve = True
+        start = time.time()
 
         # Try the cache.
         if ip_address in XMLRPCSystem.cache:
@@ -335,7 +898,7 @@ class XMLRPCSystem:
                 # Don't bother trying to find it.. until the neg-cache-time
                 # expires anyway
             else:
-                del XMLRPCSystem.cache[ip_address]
+                XMLRPCSystem.cache.pop(ip_address, None)
 
         # Not in the cache, try to find it.
         if resolve:
@@ -347,7 +910,7 @@ class XMLRPCSystem:
 
             try:
                 logging.debug("Searching for system %s" % repr(query))
-                systems = COBBLER_HANDLE.find_system(query)
+                systems = cobbler_handle().find_system(query)
                 if len(systems) > 1:
                     raise RuntimeError("Args mapped to multiple systems")
                 elif len(systems) == 0:
@@ -366,15 +929,14 @@ class XMLRPCSystem:
         if name is not None:
             logging.debug("Materializing system %s" % name)
             try:
-                self.system = COBBLER_HANDLE.get_system_as_rendered(name)
+                self.system = cobbler_handle().get_system_as_rendered(name)
                 self.attrs = self.system
                 self.name = self.attrs["name"]
             except:
                 (etype, eval,) = sys.exc_info()[:2]
                 logging.warn("Exception Materializing system %s (%s):%s" %
                              (name, eval, traceback.format_exc()))
-                if ip_address in XMLRPCSystem.cache:
-                    del XMLRPCSystem.cache[ip_address]
+                XMLRPCSystem.cache.pop(ip_address, None)
                 self.system = None
                 self.attrs = dict()
                 self.name = str(ip_address)
@@ -383,6 +945,13 @@ class XMLRPCSystem:
             self.attrs = dict()
             self.name = str(ip_address)
 
+        if resolve:
+            METRICS.inc("tftpd_cache_misses_total", cache="lookup")
+        else:
+            METRICS.inc("tftpd_cache_hits_total", cache="lookup")
+        if resolve or name is not None:
+            METRICS.observe("tftpd_lookup_seconds", time.time() - start)
+
         # fill the cache, negative entries too
         if OPTIONS["cache"] and resolve:
             logging.debug("Putting %s,%s into cache" % (name, ip_address))
@@ -407,6 +976,7 @@ class Request:
         self.req_options = rrq_packet.req_options
         self.options = dict()
         self.offset = 0
+        self.window_end = 0
         self.local_sock = local_sock
         self.state = TFTP_OPCODE_RRQ
         self.expand = False
@@ -430,7 +1000,43 @@ class Request:
             self.filename = None
 
         OPTIONS["active"] += 1
+        self.started = time.time()
+        # acknowledged to the last block
+        self.completed = False
+        # set for files that are not rendered for the system
+        self.shared_path = None
+        # the rfc2090 "multicast" option, as the client spelled it, and
+        # the options to OACK along with it
+        self.multicast = None
+        self.oack_options = None
+        self.done = False
+        # the lookup timeout, then the retransmit timer
+        self.timeout = None
+        # what we sent last, kept to retransmit it
+        self.sent = []
+        self.sent_time = 0
+        self.retransmits = 0
+        # whether an ACK of what we sent last would not tell its rtt,
+        # as it may answer an earlier copy (Karn's algorithm)
+        self.ambiguous = False
+        self.highest_sent = 0
+        # retransmit timeout, adapted to the measured rtt unless the
+        # client chose it
+        self.rto = OPTIONS["rto"]
+        self.adaptive = True
+        self.srtt = None
+        self.rttvar = None
+        # looked up by prepare(), in a lookup thread
+        self.system = None
+        self.file = None
+
+    def prepare(self):
+        """Looks up the requesting system and works out the first reply.
+           Runs in a lookup thread, so it may block on cobblerd without
+           holding up other transfers.
+        """
         self.system = XMLRPCSystem(self.remote_addr[0])
+        return self.reply()
 
 
     def _remap_strip_ip(self, filename):
@@ -485,7 +1091,10 @@ class Request:
         m = pattern.match(filename)
         if m:
             logging.debug("client requesting distro?")
-            p = COBBLER_HANDLE.get_distro_as_rendered(m.group(1))
+            if SYSTEM_MAP is not None and SYSTEM_MAP.ready:
+                p = SYSTEM_MAP.distro(m.group(1))
+            else:
+                p = cobbler_handle().get_distro_as_rendered(m.group(1))
             if p:
                 logging.debug("%s matched distro %s" % (filename, p["name"]))
                 if m.group(2) == os.path.basename(p["kernel"]):
@@ -537,8 +1146,7 @@ class Request:
             # Render the target, to expand things like "$kernel"
             if result is not None:
                 try:
-                    return self.templar.render(
-                        result, self.system.attrs, None).strip(), "template"
+                    return self._render_name(result, self.system.attrs).strip(), "template"
                 except Cheetah.Parser.ParseError, e:
                     logging.warn('Unable to expand name: %s(%s): %s' % (filename, result, e))
 
@@ -566,7 +1174,7 @@ class Request:
 
             # Render the key, to expand things like "$img_path"
             try:
-                expanded_k = self.templar.render(k, attrs, None)
+                expanded_k = self._render_name(k, attrs)
             except Cheetah.Parser.ParseError, e:
                 logging.warn('Unable to expand name: %s(%s): %s' % (filename, k, e))
                 continue
@@ -576,7 +1184,7 @@ class Request:
                 logging.debug('_remap_name: %s => %s' % (expanded_k, v))
 
                 try:
-                    return self.templar.render(v, attrs, None).strip(), "template"
+                    return self._render_name(v, attrs).strip(), "template"
                 except Cheetah.Parser.ParseError, e:
                     logging.warn('Unable to expand name: %s(%s): %s' % (filename, v, e))
 
@@ -617,14 +1225,31 @@ class Request:
         # last try: try profiles
         return self._remap_via_profiles(trimmed)
 
+    def _render_name(self, name, attrs):
+        # Templar.render adds template_universe to the dict it is given,
+        # keep attrs as it is for the cache to compare
+        return RENDER_CACHE.render(
+            ("name", name, self.system.name), attrs, None,
+            lambda: self.templar.render(name, dict(attrs), None))
+
     def _render_template(self):
+        def render():
+            # the attributes may be the system map's, shared by every
+            # request for the system: Templar.render changes what it gets
+            data = self.templar.render(open(self.filename, "r"), dict(self.system.attrs), None)
+            if isinstance(data, unicode):
+                data = data.encode("utf-8")
+            return data
+
         try:
-            return RenderedFile(self.templar.render(open(self.filename, "r"),
-                                self.system.attrs, None))
+            st = os.stat(self.filename)
+            return RenderedFile(RENDER_CACHE.render(
+                ("template", self.filename, self.system.name), self.system.attrs,
+                (st.st_dev, st.st_ino, st.st_mtime, st.st_size), render))
         except Cheetah.Parser.ParseError, e:
             logging.warn('Unable to expand template: %s: %s' % (self.filename, e))
             return None
-        except IOError, e:
+        except (IOError, OSError), e:
             logging.warn('Unable to expand template: %s: %s' % (self.filename, e))
             return None
 
@@ -640,24 +1265,25 @@ class Request:
         logging.debug('host %s getting %s: %s' %
                       (self.system.name, self.filename, self.type))
         if self.type == "template":
-            # TODO: Add file magic here
-            output = Popen([OPTIONS["file_cmd"], self.filename],
-                           stdout=PIPE, stderr=STDOUT,
-                           close_fds=True).communicate()[0]
-            if output.find(" text") >= 0:
+            try:
+                text = RENDER_CACHE.is_text(self.filename)
+            except (IOError, OSError):
+                # reported as not found below
+                text = False
+            if text:
                 self.file = self._render_template()
                 if self.file:
                     self.block_count = 0
-                    self.file_size = len(self.file.data)
+                    self.file_size = self.file.size
                     return
                 else:
                     logging.debug('Template failed to render.')
             else:
-                logging.debug('Not rendering binary file %s (%s).' % (self.filename, output))
+                logging.debug('Not rendering binary file %s.' % self.filename)
         elif self.type == "hash_value":
             self.file = RenderedFile(self.system.attrs[self.filename])
             self.block_count = 0
-            self.file_size = len(self.file.data)
+            self.file_size = self.file.size
             return
         else:
             logging.debug('Relative path')
@@ -670,15 +1296,18 @@ class Request:
                           (self.filename, self.remote_addr))
             # Templates are specified by an absolute path
             if self.type == "template":
-                self.file = open(self.filename, 'rb', 0)
+                path = self.filename
             else:
                 # TODO! restrict.  Chroot?
                 # We are sanitizing in the input, but a second line of defense
                 # wouldn't be a bad idea
-                self.file = open(OPTIONS["prefix"] + "/" + self.filename, 'rb', 0)
+                path = OPTIONS["prefix"] + "/" + self.filename
+            self.file = FILE_CACHE.open(path)
+            # the same for every client, so it can be multicast
+            self.shared_path = path
             self.block_count = 0
-            self.file_size = os.fstat(self.file.fileno()).st_size
-        except IOError:
+            self.file_size = self.file.size
+        except (IOError, OSError):
             logging.debug('%s requested %s: file not found.' %
                           (self.remote_addr, self.filename))
             self.state = TFTP_OPCODE_ERROR
@@ -687,11 +1316,14 @@ class Request:
         return
 
     def finish(self):
+        if self.done:
+            return
         io_loop = ioloop.IOLoop.instance()
         logging.debug("finishing req from %s for %s" %
                       (self.filename, self.remote_addr))
 
         self.state = 0
+        self.done = True
         try:
             io_loop.remove_handler(self.local_sock.fileno())
             logging.debug("closing fd %d" % self.local_sock.fileno())
@@ -703,6 +1335,15 @@ class Request:
             io_loop.remove_timeout(self.timeout)
             self.timeout = None
 
+        if self.file is not None:
+            self.file.close()
+
+        if self.completed:
+            METRICS.inc("tftpd_transfers_completed_total")
+            METRICS.observe("tftpd_transfer_seconds", time.time() - self.started, TRANSFER_BUCKETS)
+        else:
+            METRICS.inc("tftpd_transfers_failed_total")
+
         OPTIONS["active"] -= 1
         if (OPTIONS["idle"] > 0 and OPTIONS["active"] == 0 and OPTIONS["idle_timer"] is None):
             io_loop.stop()
@@ -713,30 +1354,100 @@ class Request:
         self.timeout = None
         self.finish()
 
+    def send(self, packets):
+        """Sends packets to the client, and retransmits them until it
+           answers, or we give up."""
+        send_packets(self.local_sock, packets, self.remote_addr)
+        self.sent = packets
+        self.sent_time = time.time()
+        self.retransmits = 0
+        if self.state == TFTP_OPCODE_DATA:
+            self.ambiguous = self.block_count < self.highest_sent
+            self.highest_sent = max(self.highest_sent, self.window_end)
+        else:
+            self.ambiguous = False
+        self._arm_retransmit()
+
+    def _arm_retransmit(self):
+        io_loop = ioloop.IOLoop.instance()
+        if self.timeout:
+            io_loop.remove_timeout(self.timeout)
+        delay = min(self.rto * (2 ** self.retransmits), max(OPTIONS["max_rto"], self.rto))
+        self.timeout = io_loop.add_timeout(time.time() + delay, self.handle_retransmit)
+
+    def handle_retransmit(self):
+        """Nothing heard from the client in time: send the last packets
+           again, backing off exponentially."""
+        self.timeout = None
+        if self.retransmits >= OPTIONS["retries"]:
+            logging.info('Giving up on transfer of %s to %s' % (self.filename, self.remote_addr))
+            self.finish()
+            return
+
+        self.retransmits += 1
+        METRICS.inc("tftpd_retransmits_total", len(self.sent))
+        self.ambiguous = True
+        logging.debug('Retransmit %d of %d packet(s) to %s' % (self.retransmits, len(self.sent), self.remote_addr))
+        send_packets(self.local_sock, self.sent, self.remote_addr)
+        self._arm_retransmit()
+
+    def _setup_rto(self):
+        """Uses the retransmit timeout the client asked for, if any."""
+        requested = [k.lower() for k in list(self.req_options)[::2]]
+        if "utimeout" in requested:
+            self.rto = self.options["utimeout"] / 1000000.0
+            self.adaptive = False
+        elif "timeout" in requested:
+            self.rto = float(self.options["timeout"])
+            self.adaptive = False
+
+    def _measure_rtt(self):
+        """The client answered what we sent last: update the retransmit
+           timeout as rfc6298 does."""
+        if not self.adaptive or self.ambiguous or self.retransmits:
+            return
+        rtt = time.time() - self.sent_time
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.rto = min(max(self.srtt + 4 * self.rttvar, OPTIONS["min_rto"]), OPTIONS["max_rto"])
+
     def handle_input(self, packet):
         """The client sent us a new packet.  Respond to it.
            RRQ is handled in the constructor sequence, basically.
-           This should handle everything else"""
-        # We got input, so didn't time out.  Refresh the timeout
-        io_loop = ioloop.IOLoop.instance()
-        io_loop.remove_timeout(self.timeout)
-        self.timeout = io_loop.add_timeout(time.time() + self.options["timeout"], lambda: self.handle_timeout())
-
+           This should handle everything else.
+           Returns False if the packet is to be ignored."""
         if packet.opcode == TFTP_OPCODE_ACK:
             if self.state == TFTP_OPCODE_DATA:
                 # Incremement offset.  They got the last bit
                 # the FFFF are to permit wrap.  It's OK for the block
                 # number to wrap, since it's one client (and not unicast),
                 # so the client can figure that out.
-                if ((packet.block_number & 0xFFFF) == ((self.block_count + 1) & 0xFFFF)):
-                    # Only update if they actually ack the packet we
-                    # sent, but we'll still resend the last packet either way
-                    self.block_count += 1
-
+                # With a window of several blocks in flight, the client
+                # acks the last block it got in order: everything up to
+                # there is done, and the next window starts right after
+                # it, which also resends whatever went missing.
+                acked = (packet.block_number - self.block_count) & 0xFFFF
+                if not 0 < acked <= self.window_end - self.block_count:
+                    # A duplicate (or stale) ACK.  Answering it would
+                    # send every block twice from now on, the
+                    # retransmit timer takes care of lost packets.
+                    logging.log(9, "Ignoring duplicate ACK %d from %s" % (packet.block_number, self.remote_addr))
+                    METRICS.inc("tftpd_duplicate_acks_total")
+                    return False
+
+                self._measure_rtt()
+                self.block_count += acked
                 self.state = TFTP_OPCODE_ACK
             elif self.state == TFTP_OPCODE_OACK:
                 # Ok, start feeding data
+                self._measure_rtt()
                 self.state = TFTP_OPCODE_ACK
+            else:
+                return False
 
         elif packet.opcode == TFTP_OPCODE_ERROR:
             logging.warn("Error from clients %s: %d:%s" %
@@ -747,41 +1458,56 @@ class Request:
             logging.warn("Unknown opcode from clients %s: %ds" %
                          (self.remote_addr, packet.opcode))
             self.state = 0
+        return True
 
     def reply(self):
-        """Given the current state, returns the next packet we should send
-        to the client"""
+        """Given the current state, returns the list of packets we should
+        send to the client next.  An empty list means we are done."""
         # Python doesn't have a switch statement (I presume on the theory
         # that needing one means you didn't set your classes up right)
         # so ... have a set of if/elif statements.
 
-        # Fast path: it's an ACK.  Feed more data
+        # Fast path: it's an ACK.  Feed the next window of data
         if self.state == TFTP_OPCODE_ACK:
-            offset = self.block_count * self.options["blksize"]
+            blksize = self.options["blksize"]
+            packets = []
+            for block in range(self.block_count, self.block_count + self.options["windowsize"]):
+                offset = block * blksize
 
-            if self.file_size < offset:
+                if self.file_size < offset:
+                    break
+
+                self.file.seek(offset)
+                data = self.file.read(blksize)
+
+                # Block Count starts at 1, so offset
+                logging.log(9, "DATA to %s/%d, block_count %d/%d, size %d(%d/%d)" % (
+                    self.remote_addr[0], self.remote_addr[1],
+                    block + 1, (block + 1) & 0xFFFF,
+                    len(data), offset + len(data), self.file_size))
+                packets.append(DATAPacket(data, block + 1))
+
+                if len(data) < blksize:
+                    # the last block
+                    break
+
+            if not packets:
                 # We're done.
                 logging.info('Transfer of %s to %s done' % (self.filename, self.remote_addr))
-                return None
-
-            self.file.seek(self.block_count * self.options["blksize"])
-            data = self.file.read(self.options["blksize"])
+                self.completed = True
+                return []
 
             self.state = TFTP_OPCODE_DATA
-            # Block Count starts at 1, so offset
-            logging.log(9, "DATA to %s/%d, block_count %d/%d, size %d(%d/%d)" % (
-                self.remote_addr[0], self.remote_addr[1],
-                self.block_count + 1, (self.block_count + 1) & 0xFFFF,
-                len(data), offset + len(data), self.file_size))
-            return DATAPacket(data, self.block_count + 1)
+            self.window_end = self.block_count + len(packets)
+            return packets
 
         if self.state == 0:
-            return None
+            return []
 
         if self.state == TFTP_OPCODE_ERROR:
             # Don't bother waiting.. this was the first request
             # a "resend" would go to the well known port
-            return ERRORPacket(self.error_code, self.error_str)
+            return [ERRORPacket.create(self.error_code, self.error_str)]
 
         if self.state == TFTP_OPCODE_RRQ and self.req_options:
             # They asked for various rfc2347 options.  Figure out
@@ -794,10 +1520,11 @@ class Request:
             if self.state == TFTP_OPCODE_ERROR:
                 # Don't bother waiting.. this was the first request
                 # a "resend" would go to the well known port
-                return ERRORPacket(self.error_code, self.error_str)
+                return [ERRORPacket.create(self.error_code, self.error_str)]
 
             # make sure we have defaults
-            self.options = dict(blksize=OPTIONS["blksize"], timeout=OPTIONS["timeout"])
+            self.options = dict(blksize=OPTIONS["blksize"], timeout=OPTIONS["timeout"],
+                                windowsize=OPTIONS["windowsize"])
 
             accepted_opts = []
             # Sorry for the excessive complexity here.
@@ -828,18 +1555,35 @@ class Request:
                     self.options[key.lower()] = value
                     accepted_opts.append(key)
                     accepted_opts.append(str(value))
+                elif key.lower() == "multicast":
+                    # the MulticastSession adds it to the OACK
+                    if OPTIONS["multicast_group"] and self.shared_path is not None:
+                        self.multicast = key
+                    else:
+                        logging.debug("Not multicasting %s" % self.filename)
                 else:
                     # ignore it, do not include in the OACK
                     logging.info("Unknown option requested %s" % (key))
 
+            if self.multicast:
+                # rfc2090 transfers are lock-step
+                self.options["windowsize"] = 1
+                for i in range(0, len(accepted_opts), 2):
+                    if str(accepted_opts[i]).lower() == "windowsize":
+                        del accepted_opts[i:i + 2]
+                        break
+                self.oack_options = accepted_opts
+
             logging.debug("Using Options: %s" % (repr(self.options)))
+            self._setup_rto()
 
-            return OACKPacket(accepted_opts)
+            return [OACKPacket(accepted_opts)]
 
         if self.state == TFTP_OPCODE_RRQ:
             # No options.  Fill in the defaults
             # and then recurse, pretending we just got the ACK to our OACK
-            self.options = dict(blksize=OPTIONS["blksize"], timeout=OPTIONS["timeout"])
+            self.options = dict(blksize=OPTIONS["blksize"], timeout=OPTIONS["timeout"],
+                                windowsize=OPTIONS["windowsize"])
 
             logging.debug("Using Options: %s" % (repr(self.options)))
 
@@ -847,22 +1591,215 @@ class Request:
 
             self._setup_xfer()
             if self.state == TFTP_OPCODE_ERROR:
-                return ERRORPacket(self.error_code, self.error_str)
+                return [ERRORPacket.create(self.error_code, self.error_str)]
 
             return self.reply()
 
         raise NotImplementedError("Unknown state %d" % (self.state))
 
+
+class MulticastSession:
+    """
+    An rfc2090 multicast transfer.  Clients asking for the same file
+    (and block size) with the "multicast" option share one stream of
+    DATA packets sent to the group, so a rack booting at once reads
+    the initrd off the wire once instead of once per client.
+
+    One client at a time, the master, ACKs the blocks in lock-step;
+    the others only listen and pick up the blocks they miss when their
+    turn comes.  Once the master has it all, the next client becomes
+    master and ACKs the last block it has in order, and the stream
+    goes on from there, starting over at the beginning if need be.
+
+    Each client keeps its own transient port for its ACKs, the DATA
+    goes out of the master's.
+    """
+    sessions = {}   # (path, blksize) -> session
+    ports = set()   # group ports in use
+
+    def __init__(self, request, port):
+        self.key = (request.shared_path, request.options["blksize"])
+        self.port = port
+        self.group = (OPTIONS["multicast_group"], port)
+        self.filename = request.filename
+        self.blksize = request.options["blksize"]
+        # the last block is the short one, and may be empty
+        self.last_block = request.file_size / self.blksize + 1
+        self.clients = OrderedDict()  # remote address -> Request
+        self.master = None
+        # block numbers here do not wrap
+        self.block_count = 0    # the last block the master ACKed
+        self.highest_sent = 0
+        self.sent = None        # (packets, address) to retransmit
+        self.retransmits = 0
+        self.timeout = None
+
+    @classmethod
+    def join(cls, request):
+        """Adds the request to the session for its file, starting a
+           session if there is none.  Returns False if all the group
+           ports are in use.
+        """
+        key = (request.shared_path, request.options["blksize"])
+        session = cls.sessions.get(key)
+        if session is None:
+            first = OPTIONS["multicast_port"]
+            free = [p for p in range(first, first + OPTIONS["multicast_sessions"])
+                    if p not in cls.ports]
+            if not free:
+                logging.info("No multicast port free for %s" % request.filename)
+                return False
+            session = cls(request, free[0])
+            cls.sessions[key] = session
+            cls.ports.add(session.port)
+            logging.info("Multicasting %s to %s:%d" % (session.filename, session.group[0], session.port))
+        session.add(request)
+        return True
+
+    def oack(self, request, master):
+        return OACKPacket(request.oack_options + [
+            request.multicast, "%s,%d,%d" % (self.group[0], self.port, master)])
+
+    def add(self, request):
+        sock = request.local_sock
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, OPTIONS["multicast_ttl"])
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        if OPTIONS["multicast_interface"]:
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF,
+                            socket.inet_aton(OPTIONS["multicast_interface"]))
+        io_loop = ioloop.IOLoop.instance()
+        io_loop.add_handler(sock.fileno(), partial(handle_multicast, self, request), io_loop.READ)
+
+        self.clients[request.remote_addr] = request
+        logging.debug("%s joins the multicast of %s, %d clients" % (
+            request.remote_addr, self.filename, len(self.clients)))
+        if self.master is None:
+            self.make_master(request)
+        else:
+            # it listens until its turn comes
+            send_packets(sock, [self.oack(request, 0)], request.remote_addr)
+
+    def make_master(self, request):
+        self.master = request
+        request.state = TFTP_OPCODE_OACK
+        self.send([self.oack(request, 1)], request.remote_addr)
+
+    def remove(self, request):
+        """Takes the client out of the session, handing the stream to
+           the next one if it was the master."""
+        del self.clients[request.remote_addr]
+        if request is self.master:
+            self.master = None
+            if self.timeout:
+                ioloop.IOLoop.instance().remove_timeout(self.timeout)
+                self.timeout = None
+        request.finish()
+
+        if self.master is None:
+            if self.clients:
+                self.make_master(self.clients.values()[0])
+            else:
+                logging.info("Multicast of %s done" % self.filename)
+                del MulticastSession.sessions[self.key]
+                MulticastSession.ports.discard(self.port)
+
+    def send(self, packets, address):
+        send_packets(self.master.local_sock, packets, address)
+        self.sent = (packets, address)
+        self.retransmits = 0
+        # the master's ACKs time the stream, as in a unicast transfer
+        self.master.sent_time = time.time()
+        self.master.ambiguous = False
+        self._arm_retransmit()
+
+    def _arm_retransmit(self):
+        io_loop = ioloop.IOLoop.instance()
+        if self.timeout:
+            io_loop.remove_timeout(self.timeout)
+        rto = self.master.rto
+        delay = min(rto * (2 ** self.retransmits), max(OPTIONS["max_rto"], rto))
+        self.timeout = io_loop.add_timeout(time.time() + delay, self.handle_retransmit)
+
+    def handle_retransmit(self):
+        self.timeout = None
+        if self.retransmits >= OPTIONS["retries"]:
+            logging.info('Giving up on multicast of %s to %s' % (self.filename, self.master.remote_addr))
+            self.remove(self.master)
+            return
+
+        self.retransmits += 1
+        METRICS.inc("tftpd_retransmits_total", len(self.sent[0]))
+        self.master.ambiguous = True
+        send_packets(self.master.local_sock, self.sent[0], self.sent[1])
+        self._arm_retransmit()
+
+    def handle_input(self, request, packet):
+        """A packet from one of the clients."""
+        if packet.opcode == TFTP_OPCODE_ERROR:
+            # how a client that has had enough leaves
+            logging.debug("%s leaves the multicast of %s: %d:%s" % (
+                request.remote_addr, self.filename, packet.error_code, packet.error_str))
+            self.remove(request)
+            return
+        if packet.opcode != TFTP_OPCODE_ACK:
+            logging.warn("Unknown opcode from clients %s: %d" % (request.remote_addr, packet.opcode))
+            self.remove(request)
+            return
+
+        if request is not self.master:
+            if packet.block_number == self.last_block & 0xFFFF:
+                # got it all without waiting for its turn
+                request.completed = True
+                logging.info('Transfer of %s to %s done' % (self.filename, request.remote_addr))
+                self.remove(request)
+            return
+
+        if request.state == TFTP_OPCODE_OACK:
+            # the first ACK of a new master: the last block it has in
+            # order, which it has heard at most highest_sent blocks in
+            block = self.highest_sent - ((self.highest_sent - packet.block_number) & 0xFFFF)
+            if block < 0:
+                block = packet.block_number
+            self.block_count = min(block, self.last_block)
+            request.state = TFTP_OPCODE_DATA
+            request._measure_rtt()
+        else:
+            # lock-step, but the master may also jump ahead to the
+            # blocks it heard while listening
+            ahead = (packet.block_number - self.block_count) & 0xFFFF
+            if ahead == 0 or self.block_count + ahead > self.last_block:
+                logging.log(9, "Ignoring duplicate ACK %d from %s" % (packet.block_number, request.remote_addr))
+                METRICS.inc("tftpd_duplicate_acks_total")
+                return
+            request._measure_rtt()
+            self.block_count += ahead
+
+        if self.block_count >= self.last_block:
+            request.completed = True
+            logging.info('Transfer of %s to %s done' % (self.filename, request.remote_addr))
+            self.remove(request)
+            return
+
+        offset = self.block_count * self.blksize
+        # each client has the file open, it may be streamed from disk
+        self.master.file.seek(offset)
+        data = self.master.file.read(self.blksize)
+        self.highest_sent = self.block_count + 1
+        logging.log(9, "DATA to %s:%d, block %d/%d" % (
+            self.group[0], self.port, self.highest_sent, self.last_block))
+        self.send([DATAPacket(data, self.highest_sent)], self.group)
+
+
 REQ_NAME = 0
 REQ_CLASS = 1
 REQUESTS = [
-    ["INVALID", None],     # 0
-    ["RRQ", RRQPacket],    # 1
-    ["WRQ", None],         # 2
-    ["DATA", None],        # 3
-    ["ACK", ACKPacket],    # 4
-    ["ERROR", None],       # 5
-    ["OACK", OACKPacket]   # 6
+    ["INVALID", None],          # 0
+    ["RRQ", RRQPacket],         # 1
+    ["WRQ", None],              # 2
+    ["DATA", None],             # 3
+    ["ACK", ACKPacket],         # 4
+    ["ERROR", ERRORPacket],     # 5
+    ["OACK", OACKPacket]        # 6
 ]
 
 
@@ -875,15 +1812,14 @@ def read_packet(data, local_sock, remote_addr):
     opcode, = unpack("!H", data[0:2])
     if opcode < 1 or opcode > 6:
         logging.warn("Unknown request id %d from %s" % (opcode, remote_addr))
-        local_sock.sendto(ERRORPacket(0, "Unknown request").marshall(), remote_addr)
+        local_sock.sendto(ERRORPacket.create(0, "Unknown request").marshall(), remote_addr)
         return None
 
     if REQUESTS[opcode][REQ_CLASS] is None:
-        if opcode != TFTP_OPCODE_ERROR:
-                logging.warn("Unsupported request %d(%s) from %s" %
-                             (opcode, REQUESTS[opcode][REQ_NAME], remote_addr))
+        logging.warn("Unsupported request %d(%s) from %s" %
+                     (opcode, REQUESTS[opcode][REQ_NAME], remote_addr))
         local_sock.sendto(
-            ERRORPacket(2, "Unsupported request").marshall(), remote_addr)
+            ERRORPacket.create(2, "Unsupported request").marshall(), remote_addr)
         return None
 
     try:
@@ -914,6 +1850,25 @@ def partial(func, *args, **keywords):
     return newfunc
 
 
+def send_packets(sock, packets, address):
+    """Send a list of packets to address.  A window of DATA packets can
+       fill up the socket buffer; the client will then ask for whatever
+       did not make it out.
+    """
+    sent = 0
+    try:
+        for packet in packets:
+            try:
+                sent += sock.sendto(packet.marshall(), address)
+            except socket.error, e:
+                if e[0] in (errno.EWOULDBLOCK, errno.EAGAIN):
+                    logging.debug("send buffer full, dropping rest of window to %s" % str(address))
+                    return
+                raise
+    finally:
+        METRICS.inc("tftpd_sent_bytes_total", sent)
+
+
 def handle_request(request, fd, events):
     """Used as the IO handler for subsequent requests.  Followup
        packets for a given request are sent to a different port, because
@@ -941,26 +1896,116 @@ def handle_request(request, fd, events):
                     request.finish()
                     continue
 
-                request.handle_input(packet)
-                reply = request.reply()
-
-                if reply:
-                    request.local_sock.sendto(reply.marshall(), address)
+                if not request.handle_input(packet):
+                    continue
+                replies = request.reply()
 
-                if not reply or reply is ERRORPacket:
+                if not replies or replies[-1].is_error():
+                    send_packets(request.local_sock, replies, address)
                     request.finish()
+                else:
+                    request.send(replies)
             else:
                 raise NotImplementedError("Input from unexpected source")
     finally:
-        # Reset the timer
-        if OPTIONS["idle"] > 0:
-            io_loop = ioloop.IOLoop.instance()
+        reset_idle_timer()
+
+
+def handle_multicast(session, request, fd, events):
+    """The IO handler for the transient port of a client in a multicast
+       session: hands its packets to the MulticastSession.
+    """
+    try:
+        while not request.done:
             try:
-                io_loop.remove_timeout(OPTIONS["idle_timer"])
-            except:
-                pass
-            OPTIONS["idle_timer"] = io_loop.add_timeout(
-                time.time() + OPTIONS["idle"], lambda: idle_out())
+                data, address = request.local_sock.recvfrom(request.options["blksize"])
+            except socket.error, e:
+                if e[0] in (errno.EWOULDBLOCK, errno.EAGAIN):
+                    return
+                else:
+                    raise
+
+            if address != request.remote_addr:
+                raise NotImplementedError("Input from unexpected source")
+            packet = read_packet(data, request.local_sock, address)
+            if packet is None:
+                session.remove(request)
+            else:
+                session.handle_input(request, packet)
+    finally:
+        reset_idle_timer()
+
+
+def reset_idle_timer():
+    if OPTIONS["idle"] > 0:
+        io_loop = ioloop.IOLoop.instance()
+        try:
+            io_loop.remove_timeout(OPTIONS["idle_timer"])
+        except:
+            pass
+        OPTIONS["idle_timer"] = io_loop.add_timeout(
+            time.time() + OPTIONS["idle"], lambda: idle_out())
+
+
+def prepare_request(request, key):
+    """Runs in a lookup thread: resolves the system making the request,
+       which may take a few XMLRPC calls, and hands the first reply back
+       to the event loop.
+    """
+    try:
+        replies = request.prepare()
+    except:
+        logging.warn("Exception preparing request for %s from %s: %s" %
+                     (request.filename, request.remote_addr, traceback.format_exc()))
+        replies = []
+    ioloop.IOLoop.instance().add_callback(partial(start_request, request, key, replies))
+
+
+def start_request(request, key, replies):
+    """Back on the event loop: starts serving a prepared request."""
+    PENDING_RRQS.discard(key)
+    if request.done:
+        # timed out while we were looking it up
+        if request.file is not None:
+            request.file.close()
+        return
+
+    io_loop = ioloop.IOLoop.instance()
+    if request.multicast and replies and not replies[-1].is_error():
+        if MulticastSession.join(request):
+            io_loop.remove_timeout(request.timeout)
+            request.timeout = None
+            return
+        # no group port free, send it the plain way
+
+    io_loop.add_handler(
+        request.local_sock.fileno(),
+        partial(handle_request, request),
+        io_loop.READ)
+
+    if not replies or replies[-1].is_error():
+        send_packets(request.local_sock, replies, request.remote_addr)
+        request.finish()
+    else:
+        # replaces the lookup timeout
+        request.send(replies)
+
+
+def refresh_system_map():
+    """Runs in a lookup thread: refreshes the system map, then has the
+       event loop schedule the next refresh.
+    """
+    try:
+        SYSTEM_MAP.refresh()
+    except:
+        logging.warn("Exception refreshing the system map: %s" % traceback.format_exc())
+    ioloop.IOLoop.instance().add_callback(schedule_system_map_refresh)
+
+
+def schedule_system_map_refresh():
+    ioloop.IOLoop.instance().add_timeout(
+        time.time() + OPTIONS["system_map_interval"],
+        lambda: LOOKUP_POOL.apply_async(refresh_system_map))
 
 
 def idle_out():
@@ -995,13 +2040,22 @@ def new_req(sock, templar, fd, events):
             break
 
         packet = read_packet(data, sock, address)
+        if packet is not None and packet.is_error():
+            # a late ERROR for a transfer, errors are not answered
+            continue
         # this is the new_request handler.  (packet had better be an RRQ
         # request)
         if packet is None or packet.opcode != TFTP_OPCODE_RRQ:
             sock.sendto(
-                ERRORPacket(2, "Unsupported initial request").marshall(), address)
+                ERRORPacket.create(2, "Unsupported initial request").marshall(), address)
             break
 
+        key = (address, packet.filename)
+        if key in PENDING_RRQS:
+            # the client got impatient while we look it up
+            logging.debug("Ignoring repeated RRQ for %s from %s" % (packet.filename, address))
+            continue
+
         # Create the new transient port for this request
         new_address = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, 0)
         new_address.bind(("", 0))  # random port: XXX control?
@@ -1009,26 +2063,233 @@ def new_req(sock, templar, fd, events):
         new_address.setblocking(0)
         packet.local_sock = new_address
 
-        # Create the request object to handle this request, and bind it
-        # to IO from the transient port
+        # Create the request object to handle this request, and have
+        # a lookup thread find out what to do with it.  It is bound to
+        # IO from the transient port once that is known.
         request = Request(packet, new_address, templar)
-        io_loop.add_handler(
-            new_address.fileno(),
-            partial(handle_request, request),
-            io_loop.READ)
-        request.timeout = io_loop.add_timeout(time.time() + OPTIONS["timeout"], lambda: request.handle_timeout())
+        request.timeout = io_loop.add_timeout(time.time() + OPTIONS["timeout"], request.handle_timeout)
+        PENDING_RRQS.add(key)
+        METRICS.inc("tftpd_requests_total")
+        LOOKUP_POOL.apply_async(prepare_request, (request, key))
+
+    # After the while loop.  Re-add the idle timer
+    if OPTIONS["idle"] > 0:
+        OPTIONS["idle_timer"] = io_loop.add_timeout(time.time() + OPTIONS["idle"], lambda: idle_out())
 
-        # Ask the request what to do now..
-        reply = request.reply()
-        if reply:
-            new_address.sendto(reply.marshall(), address)
 
-        if not reply or reply.is_error():
-            request.finish()
+def report_stats(stats_fd):
+    """Sends the metrics of this worker to the supervisor, as a line of
+       JSON, every stats_interval seconds.  Or, running alone, writes
+       them to the stats file if there is one.
+    """
+    if stats_fd is None:
+        write_metrics(METRICS.dump())
+        ioloop.IOLoop.instance().add_timeout(
+            time.time() + OPTIONS["stats_interval"], lambda: report_stats(stats_fd))
+        return
 
-    # After the while loop.  Re-add the idle timer
+    try:
+        # well under PIPE_BUF, so written whole or not at all
+        os.write(stats_fd, json.dumps(METRICS.dump()) + "\n")
+    except OSError, e:
+        if e.errno == errno.EPIPE:
+            logging.warn("Supervisor gone, exiting")
+            ioloop.IOLoop.instance().stop()
+            return
+        # the supervisor is behind, it will get the next report
+        if e.errno not in (errno.EWOULDBLOCK, errno.EAGAIN):
+            raise
+    ioloop.IOLoop.instance().add_timeout(
+        time.time() + OPTIONS["stats_interval"], lambda: report_stats(stats_fd))
+
+
+def bind_socket(reuse_port=False):
+    """Returns a socket bound to the well-known port, or None if we
+       are not allowed to bind to it.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, 0)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
+    try:
+        sock.bind(("", OPTIONS["port"]))
+    except socket.error, e:
+        if e[0] in (errno.EPERM, errno.EACCES):
+            print "Unable to bind to port %d" % OPTIONS["port"]
+            sock.close()
+            return None
+        else:
+            raise
+    return sock
+
+
+def drop_privileges():
+    if os.getuid() == 0:
+        uid = pwd.getpwnam(OPTIONS["user"])[2]
+        os.setreuid(uid, uid)
+
+
+def serve(sock, stats_fd=None):
+    """Serves requests arriving on sock until idle, or interrupted."""
+    OPTIONS["sock"] = sock
+    OPTIONS["sock"].setblocking(0)
+
+    global FILE_CACHE, RENDER_CACHE, LOOKUP_POOL, SYSTEM_MAP, METRICS
+    METRICS = Metrics()
+    FILE_CACHE = FileCache(OPTIONS["file_cache_size"] * 1024 * 1024)
+    RENDER_CACHE = RenderCache(OPTIONS["render_cache_size"])
+    LOOKUP_POOL = ThreadPool(OPTIONS["lookup_threads"])
+    if OPTIONS["system_map_interval"] > 0:
+        SYSTEM_MAP = SystemMap()
+        LOOKUP_POOL.apply_async(refresh_system_map)
+
+    # This takes a while, so do it after we open the port, so we
+    # don't drop the packet that spawned us
+    templar = cobbler.templar.Templar(None)
+
+    io_loop = ioloop.IOLoop.instance()
+    io_loop.add_handler(OPTIONS["sock"].fileno(), partial(new_req, OPTIONS["sock"], templar), io_loop.READ)
+    # Shove the timeout into OPTIONS, because it's there
     if OPTIONS["idle"] > 0:
         OPTIONS["idle_timer"] = io_loop.add_timeout(time.time() + OPTIONS["idle"], lambda: idle_out())
+    if stats_fd is not None or OPTIONS["stats_file"]:
+        report_stats(stats_fd)
+
+    logging.info('Starting Eventloop')
+    try:
+        try:
+            io_loop.start()
+        except KeyboardInterrupt:
+            # Someone hit ^C
+            logging.info('Exiting')
+    finally:
+        OPTIONS["sock"].close()
+    return 0
+
+
+def start_worker(socks, index, pipes):
+    """Forks a worker serving socks[index].  Returns its pid and the read
+       end of the pipe it reports its stats on.
+
+       The worker closes the other sockets and the read ends of the stats
+       pipes of the other workers, so none of them outlives its worker,
+       or the supervisor, through it.
+    """
+    (rfd, wfd) = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        status = 1
+        try:
+            os.close(rfd)
+            for other in pipes:
+                os.close(other)
+            for (other, sock) in enumerate(socks):
+                if other != index:
+                    sock.close()
+            fcntl.fcntl(wfd, fcntl.F_SETFL, fcntl.fcntl(wfd, fcntl.F_GETFL) | os.O_NONBLOCK)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            # each worker multicasts on ports of its own
+            OPTIONS["multicast_port"] += index * OPTIONS["multicast_sessions"]
+            status = serve(socks[index], wfd)
+        except:
+            logging.error("Worker %d failed: %s" % (os.getpid(), traceback.format_exc()))
+        os._exit(status)
+    os.close(wfd)
+    logging.info("Started worker %d" % pid)
+    return (pid, rfd)
+
+
+def supervise(socks):
+    """Runs a worker per socket, restarts the ones that die and logs
+       the sum of their stats every stats_interval seconds, to the
+       stats file if there is one.
+
+       The sockets all share the well-known port with SO_REUSEPORT.
+       They stay open here, so the requests the kernel hands to the
+       socket of a dead worker queue up for its replacement.
+    """
+    workers = {}    # pid -> socket index
+    pipes = {}      # stats pipe -> socket index
+    buffers = {}    # stats pipe -> partial line
+    stats = {}      # socket index -> last metrics reported
+    # the counters of the workers that died, so the sums never go back
+    retired = {"counters": {}, "histograms": {}}
+    started = {}    # socket index -> start time of its worker
+
+    def start(index):
+        (pid, rfd) = start_worker(socks, index, pipes.keys())
+        workers[pid] = index
+        pipes[rfd] = index
+        buffers[rfd] = ""
+        started[index] = time.time()
+
+    def terminate(signum, frame):
+        raise KeyboardInterrupt()
+
+    signal.signal(signal.SIGTERM, terminate)
+    for index in range(len(socks)):
+        start(index)
+
+    next_report = time.time() + OPTIONS["stats_interval"]
+    try:
+        while True:
+            try:
+                (readable, _, _) = select.select(pipes.keys(), [], [], 1)
+            except select.error, e:
+                if e[0] != errno.EINTR:
+                    raise
+                readable = []
+            for rfd in readable:
+                data = os.read(rfd, 4096)
+                if not data:
+                    # that worker is gone
+                    os.close(rfd)
+                    del pipes[rfd]
+                    del buffers[rfd]
+                    continue
+                lines = (buffers[rfd] + data).split("\n")
+                buffers[rfd] = lines.pop()
+                for line in lines:
+                    stats[pipes[rfd]] = json.loads(line)
+
+            while workers:
+                (pid, status) = os.waitpid(-1, os.WNOHANG)
+                if pid == 0:
+                    break
+                index = workers.pop(pid)
+                logging.warn("Worker %d exited with status %d" % (pid, status))
+                last = stats.pop(index, None)
+                if last is not None:
+                    for name in last["counters"].keys():
+                        if METRIC_INFO.get(name.split("{")[0], ("gauge",))[0] == "gauge":
+                            del last["counters"][name]
+                    retired = merge_metrics([retired, last])
+                # do not spin if it dies right away
+                if time.time() - started[index] < 1:
+                    time.sleep(1)
+                start(index)
+
+            if time.time() >= next_report:
+                next_report = time.time() + OPTIONS["stats_interval"]
+                totals = merge_metrics([retired] + stats.values())
+                counters = totals["counters"]
+                logging.info("Workers: %d requests: %d active: %d completed: %d failed: %d" % (
+                    len(workers), counters.get("tftpd_requests_total", 0),
+                    counters.get("tftpd_active_requests", 0),
+                    counters.get("tftpd_transfers_completed_total", 0),
+                    counters.get("tftpd_transfers_failed_total", 0)))
+                if OPTIONS["stats_file"]:
+                    write_metrics(totals)
+    except KeyboardInterrupt:
+        logging.info('Exiting')
+        for pid in workers.keys():
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        for pid in workers.keys():
+            os.waitpid(pid, 0)
+    return 0
 
 
 def main():
@@ -1037,6 +2298,8 @@ def main():
     if stat.S_ISSOCK(mode):
         OPTIONS["idle"] = 30
         OPTIONS["logger"] = "syslog"
+        # not worth loading every system for a few requests
+        OPTIONS["system_map_interval"] = 0
 
     # setup option parsing
     opt_help = dict(
@@ -1044,10 +2307,23 @@ def main():
         idle=dict(type="int", help="How long to wait for input"),
         timeout=dict(type="int", help="How long to wait for a given request"),
         max_blksize=dict(type="int", help="The maximum block size to permit"),
+        max_windowsize=dict(type="int", help="The maximum rfc7440 window size to permit"),
+        file_cache_size=dict(type="int", help="MB of file contents to share between transfers"),
+        lookup_threads=dict(type="int", help="Number of threads looking up systems in cobbler"),
+        system_map_interval=dict(type="int", help="Seconds between system map refreshes, 0 to look up every request"),
+        workers=dict(type="int", help="Number of processes serving the port (not under xinetd)"),
+        stats_interval=dict(type="int", help="Seconds between logging the stats of the workers, or writing the stats file"),
+        stats_file=dict(type="string", help="File the stats are written to in the Prometheus text format"),
+        multicast_group=dict(type="string", help="Multicast group for rfc2090 transfers, off if empty"),
+        multicast_port=dict(type="int", help="First port of the multicast sessions [1758]"),
+        multicast_sessions=dict(type="int", help="Number of multicast sessions (and ports) at most"),
+        multicast_ttl=dict(type="int", help="TTL of the multicast packets"),
+        multicast_interface=dict(type="string", help="Address of the interface to multicast on"),
         prefix=dict(type="string", help="Where files are stored by default [" + OPTIONS["prefix"] + "]"),
         logger=dict(type="string", help="How to log"),
-        file_cmd=dict(type="string", help="The location of the 'file' command"),
+        render_cache_size=dict(type="int", help="Number of rendered templates and file names to keep"),
         user=dict(type="string", help="The user to run as [nobody]"),
+        cobbler_url=dict(type="string", help="The XMLRPC API of cobblerd [" + OPTIONS["cobbler_url"] + "]"),
     )
 
     parser = optparse.OptionParser(
@@ -1104,45 +2380,27 @@ def main():
         logging.getLogger().setLevel(logging.WARN)
 
     if stat.S_ISSOCK(mode):
-        OPTIONS["sock"] = socket.fromfd(sys.stdin.fileno(), socket.AF_INET, socket.SOCK_DGRAM, 0)
-    else:
-        OPTIONS["sock"] = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, 0)
-        OPTIONS["sock"].setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        try:
-            OPTIONS["sock"].bind(("", OPTIONS["port"]))
-        except socket.error, e:
-            if e[0] in (errno.EPERM, errno.EACCES):
-                print "Unable to bind to port %d" % OPTIONS["port"]
+        sock = socket.fromfd(sys.stdin.fileno(), socket.AF_INET, socket.SOCK_DGRAM, 0)
+        drop_privileges()
+        return serve(sock)
+
+    if OPTIONS["workers"] > 1:
+        # bind them all before dropping privileges, even the ones
+        # restarted workers get
+        socks = []
+        for i in range(OPTIONS["workers"]):
+            sock = bind_socket(reuse_port=True)
+            if sock is None:
                 return -1
-            else:
-                raise
-
-    OPTIONS["sock"].setblocking(0)
-
-    if os.getuid() == 0:
-        uid = pwd.getpwnam(OPTIONS["user"])[2]
-        os.setreuid(uid, uid)
-
-    # This takes a while, so do it after we open the port, so we
-    # don't drop the packet that spawned us
-    templar = cobbler.templar.Templar(None)
-
-    io_loop = ioloop.IOLoop.instance()
-    io_loop.add_handler(OPTIONS["sock"].fileno(), partial(new_req, OPTIONS["sock"], templar), io_loop.READ)
-    # Shove the timeout into OPTIONS, because it's there
-    if OPTIONS["idle"] > 0:
-        OPTIONS["idle_timer"] = io_loop.add_timeout(time.time() + OPTIONS["idle"], lambda: idle_out())
-
-    logging.info('Starting Eventloop')
-    try:
-        try:
-            io_loop.start()
-        except KeyboardInterrupt:
-            # Someone hit ^C
-            logging.info('Exiting')
-    finally:
-        OPTIONS["sock"].close()
-    return 0
+            socks.append(sock)
+        drop_privileges()
+        return supervise(socks)
+
+    sock = bind_socket()
+    if sock is None:
+        return -1
+    drop_privileges()
+    return serve(sock)
 
 if __name__ == "__main__":
     sys.exit(main())
@@ -130,6 +130,11 @@ class CobblerLiteSync:
             self.sync.tftpgen.make_pxe_menu()
         return True
 
+    def add_profiles(self, names):
+        for name in names:
+            self.add_single_profile(name, rebuild_menu=False)
+        self.sync.tftpgen.make_pxe_menu()
+
     def remove_single_profile(self, name, rebuild_menu=True):
         # delete profiles/$name file in webdir
         utils.rmfile(os.path.join(self.settings.webdir, "profiles", name))
@@ -154,6 +159,20 @@ class CobblerLiteSync:
         # write the PXE files for the system
         self.tftpd.add_single_system(system)
 
+    def add_systems(self, names):
+        """
+        add_single_system() for several systems, regenerating the
+        DHCP and DNS host lists only once.
+        """
+        if self.settings.manage_dhcp:
+            self.sync.dhcp.regen_ethers()
+        if self.settings.manage_dns:
+            self.sync.dns.regen_hosts()
+        for name in names:
+            system = self.systems.find(name=name)
+            if system is not None:
+                self.tftpd.add_single_system(system)
+
     def remove_single_system(self, name):
         bootloc = utils.tftpboot_location()
         system_record = self.systems.find(name=name)
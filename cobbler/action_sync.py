@@ -23,6 +23,7 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
 
 import glob
 import os
+import simplejson
 import time
 
 from cexceptions import CX
@@ -33,6 +34,14 @@ import tftpgen
 import utils
 from utils import _
 
+# record of the objects written out by the last successful sync, used by
+# run_incremental() to find out what has changed since
+SYNC_STATE_FILE = "/var/lib/cobbler/sync_state.json"
+
+# configuration that the outputs of a sync depend on besides the objects:
+# settings, PXE/DHCP/DNS templates and the autoinstall templates/snippets
+CONFIG_DIRS = ["/etc/cobbler"]
+
 
 class CobblerSync:
     """
@@ -142,6 +151,208 @@ class CobblerSync:
         utils.run_triggers(self.api, None, "/var/lib/cobbler/triggers/sync/post/*", logger=self.logger)
         utils.run_triggers(self.api, None, "/var/lib/cobbler/triggers/change/*", logger=self.logger)
 
+        self.log_template_cache_stats()
+        self.write_sync_state(self.get_sync_state())
+
+    def run_incremental(self):
+        """
+        Only regenerate the outputs of objects which were added, modified or
+        removed since the last successful sync, instead of wiping and
+        rebuilding the whole tree.  Falls back to a full sync if there is no
+        record of a previous one.
+        """
+        old_state = self.read_sync_state()
+        if old_state is None:
+            self.logger.info("no record of a previous sync, running a full sync")
+            return self.run()
+        if old_state.pop("config_mtime", None) != self.get_config_mtime():
+            self.logger.info("settings or templates changed since the last sync, running a full sync")
+            return self.run()
+
+        if not os.path.exists(self.bootloc):
+            utils.die(self.logger, "cannot find directory: %s" % self.bootloc)
+
+        self.logger.info("running pre-sync triggers")
+        utils.run_triggers(self.api, None, "/var/lib/cobbler/triggers/sync/pre/*")
+
+        self.distros = self.collection_mgr.distros()
+        self.profiles = self.collection_mgr.profiles()
+        self.systems = self.collection_mgr.systems()
+        self.settings = self.collection_mgr.settings()
+        self.repos = self.collection_mgr.repos()
+        self.images = self.collection_mgr.images()
+
+        self.make_tftpboot()
+
+        new_state = self.get_sync_state()
+        config_mtime = new_state.pop("config_mtime")
+        changed = {}
+        removed = {}
+        for what in new_state.keys():
+            old = old_state.get(what, {})
+            new = new_state[what]
+            changed[what] = [x for x in new.keys() if x not in old or
+                             (old[x]["uid"], old[x]["mtime"]) != (new[x]["uid"], new[x]["mtime"])]
+            removed[what] = [x for x in old.keys() if x not in new]
+
+        # outputs of removed objects
+        for name in removed["system"]:
+            self.remove_system_files(old_state["system"][name]["files"])
+        for name in removed["profile"]:
+            utils.rmfile(os.path.join(self.settings.webdir, "profiles", name), logger=self.logger)
+            utils.rmtree(os.path.join(self.settings.webdir, "autoinstalls", name), logger=self.logger)
+        for name in removed["distro"]:
+            utils.rmtree(os.path.join(self.settings.webdir, "images", name), logger=self.logger)
+            utils.rmtree(os.path.join(self.bootloc, "images", name), logger=self.logger)
+            utils.rmfile(os.path.join(self.settings.webdir, "links", name), logger=self.logger)
+        for name in removed["image"]:
+            utils.rmfile(os.path.join(self.bootloc, "images2", name), logger=self.logger)
+
+        # anything below a changed object inherits from it and must be
+        # regenerated as well
+        systems = set(changed["system"])
+        for what, collection in (("distro", self.distros), ("profile", self.profiles), ("image", self.images)):
+            for name in changed[what]:
+                for kid in collection.find(name=name).get_descendants():
+                    if kid.COLLECTION_TYPE == "system":
+                        systems.add(kid.name)
+
+        for name in changed["distro"]:
+            d = self.distros.find(name=name)
+            try:
+                self.logger.info("copying files for distro: %s" % d.name)
+                self.tftpgen.copy_single_distro_files(d, self.settings.webdir, True)
+                self.tftpd.add_single_distro(d)
+                self.tftpgen.write_templates(d, write_file=True, overwrite=True)
+            except CX, e:
+                self.logger.error(e.value)
+        for name in changed["image"]:
+            self.tftpgen.copy_single_image_files(self.images.find(name=name))
+        # interfaces may have been renamed or changed their MAC/IP.  Remove
+        # all the stale files before writing any, a MAC that moved from one
+        # system to another must end up with the file of its new system.
+        stale = set()
+        for name in systems:
+            if name in old_state["system"]:
+                stale |= set(old_state["system"][name]["files"])
+        for name in new_state["system"]:
+            stale -= set(new_state["system"][name]["files"])
+        self.remove_system_files(stale)
+        for name in sorted(systems):
+            self.tftpd.add_single_system(self.systems.find(name=name))
+
+        if changed["distro"] or changed["profile"] or changed["image"] or \
+                removed["distro"] or removed["profile"] or removed["image"]:
+            self.tftpgen.make_pxe_menu()
+
+        anything_changed = False
+        for what in ("distro", "profile", "image", "system"):
+            if changed[what] or removed[what]:
+                anything_changed = True
+        if anything_changed:
+            if self.settings.manage_dhcp:
+                self.write_dhcp()
+            if self.settings.manage_dns:
+                self.logger.info("rendering DNS files")
+                self.dns.regen_hosts()
+                self.dns.write_dns_files()
+
+        # rsync.conf has a module per repo and per distro
+        if self.settings.manage_rsync and (changed["repo"] or removed["repo"] or
+                                           changed["distro"] or removed["distro"]):
+            self.logger.info("rendering Rsync files")
+            self.rsync_gen()
+
+        self.logger.info("running post-sync triggers")
+        utils.run_triggers(self.api, None, "/var/lib/cobbler/triggers/sync/post/*", logger=self.logger)
+        utils.run_triggers(self.api, None, "/var/lib/cobbler/triggers/change/*", logger=self.logger)
+
+        self.log_template_cache_stats()
+        new_state["config_mtime"] = config_mtime
+        self.write_sync_state(new_state)
+
+    def log_template_cache_stats(self):
+        stats = self.templar.cache_stats()
+        self.logger.info("compiled template cache: %(hits)d hits, %(misses)d misses, %(size)d templates" % stats)
+
+    def get_system_files(self, system):
+        """
+        Return the paths (relative to the tftpboot directory) of the boot
+        loader files that can be generated for a system.
+        """
+        files = []
+        for name in system.interfaces.keys():
+            f1 = utils.get_config_filename(system, interface=name)
+            if f1 is None:
+                continue
+            files.append(os.path.join("pxelinux.cfg", f1))
+            files.append(os.path.join("grub", f1.upper()))
+            files.append(os.path.join("boot/grub", "grub.cfg-" + f1.lower()))
+            files.append(os.path.join("etc", f1.lower()))
+            files.append(os.path.join("ppc", f1.lower()))
+        return files
+
+    def remove_system_files(self, files):
+        for f in files:
+            path = os.path.join(self.bootloc, f)
+            if os.path.lexists(path):
+                utils.rmfile(path, logger=self.logger)
+
+    def get_sync_state(self):
+        """
+        Return the uid and mtime of every object whose outputs are written
+        by a sync, by object type and name.
+        """
+        state = {}
+        for (what, collection) in (("distro", self.collection_mgr.distros()),
+                                   ("profile", self.collection_mgr.profiles()),
+                                   ("image", self.collection_mgr.images()),
+                                   ("system", self.collection_mgr.systems()),
+                                   ("repo", self.collection_mgr.repos())):
+            state[what] = {}
+            for obj in collection:
+                state[what][obj.name] = {"uid": obj.uid, "mtime": obj.mtime}
+                if what == "system":
+                    state[what][obj.name]["files"] = self.get_system_files(obj)
+        state["config_mtime"] = self.get_config_mtime()
+        return state
+
+    def get_config_mtime(self):
+        """
+        Return the newest mtime of the files and directories below
+        CONFIG_DIRS and the autoinstall template and snippet directories,
+        so that editing, adding or removing any of them is noticed.
+        """
+        newest = 0
+        dirs = CONFIG_DIRS + [self.settings.autoinstall_templates_dir, self.settings.autoinstall_snippets_dir]
+        for top in dirs:
+            for (root, subdirs, files) in os.walk(top):
+                for name in [root] + [os.path.join(root, f) for f in files]:
+                    try:
+                        newest = max(newest, os.stat(name).st_mtime)
+                    except OSError:
+                        # removed in the meantime
+                        pass
+        return newest
+
+    def read_sync_state(self):
+        """
+        Return the state recorded by the last successful sync, or None.
+        """
+        if not os.path.exists(SYNC_STATE_FILE):
+            return None
+        try:
+            fd = open(SYNC_STATE_FILE)
+            state = simplejson.load(fd)
+            fd.close()
+        except (IOError, ValueError):
+            self.logger.warning("unable to read %s" % SYNC_STATE_FILE)
+            return None
+        return state
+
+    def write_sync_state(self, state):
+        utils.atomic_write(SYNC_STATE_FILE, simplejson.dumps(state))
+
 
     def make_tftpboot(self):
         """
@@ -459,6 +459,15 @@ class CobblerAPI:
         self.log("add_item(%s)" % what, [ref.name])
         self.get_items(what).add(ref, check_for_duplicate_names=check_for_duplicate_names, save=save, logger=logger)
 
+    def add_items(self, what, refs, check_for_duplicate_names=False, logger=None):
+        """
+        Adds and saves several objects of one type at once, with a single
+        write to disk and a single lite sync.  Returns a list with, for
+        each object, None if it was added or the CX that kept it out.
+        """
+        self.log("add_items(%s)" % what, [len(refs)])
+        return self.get_items(what).add_many(refs, check_for_duplicate_names=check_for_duplicate_names, logger=logger)
+
     def add_distro(self, ref, check_for_duplicate_names=False, save=True, logger=None):
         self.add_item("distro", ref, check_for_duplicate_names=check_for_duplicate_names, save=save, logger=logger)
 
@@ -570,6 +579,15 @@ class CobblerAPI:
     def get_files_since(self, mtime, collapse=False):
         return self.__since(mtime, self.files, collapse=collapse)
 
+    def get_changes(self, since_seq, limit=0, timeout=0):
+        """
+        Returns the objects saved or removed after the change numbered
+        since_seq, see changefeed.ChangeFeed.get.  Unlike the get_*_since
+        functions this also reports deletions, and does not scan the
+        collections.
+        """
+        return self._collection_mgr.changes.get(since_seq, limit=limit, timeout=timeout)
+
     # ==========================================================================
 
     def get_signatures(self):
@@ -732,16 +750,21 @@ class CobblerAPI:
 
     # ==========================================================================
 
-    def sync(self, verbose=False, logger=None):
+    def sync(self, verbose=False, logger=None, incremental=False):
         """
         Take the values currently written to the configuration files in
         /etc, and /var, and build out the information tree found in
         /tftpboot.  Any operations done in the API that have not been
         saved with serialize() will NOT be synchronized with this command.
+        With incremental set, only the objects changed since the last sync
+        are written out.
         """
         self.log("sync")
         sync = self.get_sync(verbose=verbose, logger=logger)
-        sync.run()
+        if incremental:
+            sync.run_incremental()
+        else:
+            sync.run()
 
     # ==========================================================================
 
@@ -0,0 +1,124 @@
+"""
+Feed of changes made to cobbler objects, for clients that keep a copy of
+cobbler's data (tftpd, replicas, CMDBs) up to date without rescanning it.
+
+Copyright 2006-2009, Red Hat, Inc and Others
+Michael DeHaan <michael.dehaan AT gmail>
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+02110-1301  USA
+"""
+
+from collections import deque
+from itertools import islice
+from threading import Condition
+import time
+
+# longest time a caller may block waiting for a change
+MAX_WAIT = 300
+
+
+class ChangeFeed:
+    """
+    Numbers every saved or removed object with a sequence number that only
+    goes up, and keeps the most recent changes in a ring buffer.
+
+    The sequence starts over when cobblerd restarts, so every result
+    carries an epoch that changes along with it.  A client that sees a new
+    epoch, or gets reset back because it fell behind the ring buffer, has
+    to reload everything it keeps.
+    """
+
+    def __init__(self, size=10000):
+        self.epoch = "%f" % time.time()
+        self.seq = 0
+        self.changes = deque(maxlen=size)
+        self.cond = Condition()
+
+    def set_size(self, size):
+        """
+        Change the number of changes kept, keeping the most recent ones.
+        """
+        self.cond.acquire()
+        try:
+            if size != self.changes.maxlen:
+                self.changes = deque(self.changes, maxlen=size)
+        finally:
+            self.cond.release()
+
+    def record(self, what, op, items):
+        """
+        Record that items of the given collection type were saved
+        (op "save", covering adds and edits) or removed (op "remove").
+        """
+        self.cond.acquire()
+        try:
+            for item in items:
+                self.seq += 1
+                self.changes.append({
+                    "seq": self.seq,
+                    "what": what,
+                    "name": item.name,
+                    "op": op,
+                    "mtime": item.mtime,
+                })
+            self.cond.notifyAll()
+        finally:
+            self.cond.release()
+
+    def get(self, since_seq, limit=0, timeout=0):
+        """
+        Returns a dict with the changes made after since_seq, oldest first
+        and at most limit of them if limit is positive:
+
+            epoch   -- see the class documentation
+            seq     -- the sequence number to pass on the next call
+            changes -- list of dicts with seq, what, name, op and mtime
+            reset   -- True if the changes since since_seq are no longer
+                       known, changes is then empty
+
+        With a timeout, waits up to that many seconds for a change if there
+        is none yet.
+        """
+        since_seq = int(since_seq)
+        limit = int(limit)
+        timeout = min(float(timeout), MAX_WAIT)
+        self.cond.acquire()
+        try:
+            if timeout > 0 and since_seq == self.seq:
+                deadline = time.time() + timeout
+                while since_seq == self.seq:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+
+            result = {"epoch": self.epoch, "seq": self.seq, "changes": [], "reset": False}
+            if since_seq == self.seq:
+                return result
+            oldest = self.seq - len(self.changes)
+            if since_seq < oldest or since_seq > self.seq:
+                result["reset"] = True
+                return result
+
+            # the buffer holds the sequence numbers oldest+1 .. self.seq
+            stop = None
+            if limit > 0 and self.seq - since_seq > limit:
+                stop = since_seq - oldest + limit
+                result["seq"] = since_seq + limit
+            result["changes"] = list(islice(self.changes, since_seq - oldest, stop))
+            return result
+        finally:
+            self.cond.release()
@@ -618,8 +618,9 @@ class CobblerCLI:
                 print "No configuration problems found.  All systems go."
 
         elif action_name == "sync":
-            (options, args) = self.parser.parse_args()
             self.parser.add_option("--verbose", dest="verbose", action="store_true", help="run sync with more output")
+            self.parser.add_option("--incremental", dest="incremental", action="store_true", help="only regenerate files for objects changed since the last sync")
+            (options, args) = self.parser.parse_args()
             task_id = self.start_task("sync", options)
         elif action_name == "report":
             (options, args) = self.parser.parse_args()
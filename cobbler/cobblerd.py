@@ -79,7 +79,9 @@ def log(logger, msg):
 def do_xmlrpc_rw(cobbler_api, settings, port):
 
     xinterface = remote.ProxiedXMLRPCInterface(cobbler_api, remote.CobblerXMLRPCInterface)
-    server = remote.CobblerXMLRPCServer(('127.0.0.1', port))
+    server = remote.CobblerXMLRPCServer(
+        ('127.0.0.1', port), workers=settings.xmlrpc_workers, slow_workers=settings.xmlrpc_slow_workers,
+        wait_workers=settings.xmlrpc_wait_workers, queue_size=settings.xmlrpc_queue_size)
     server.logRequests = 0      # don't print stuff
     xinterface.logger.debug("XMLRPC running on %s" % port)
     server.register_instance(xinterface)
@@ -22,7 +22,7 @@ import exceptions
 import utils
 import time
 import os
-from threading import Lock
+from threading import Lock, RLock
 
 from cobbler import action_litesync
 from cobbler import item_system
@@ -43,21 +43,41 @@ class Collection:
     Base class for any serializable list of things.
     """
 
+    # fields which are kept in hash indexes (value -> set of object names) so
+    # that find() does not have to scan the whole collection for exact matches.
+    # Subclasses list the fields that are commonly searched on.
+    INDEXED_FIELDS = []
+
+    # fields stored per network interface rather than on the object itself
+    INTERFACE_FIELDS = ["mac_address", "ip_address", "dns_name"]
+
+    # when set, from_list() only keeps the raw records handed over by the
+    # serializer (and indexes them) and objects are built on first access.
+    LAZY_LOAD = False
+
     def __init__(self, collection_mgr):
         """
         Constructor.
         """
         self.collection_mgr = collection_mgr
         self.listing = {}
+        self.unloaded = {}
+        self.indexes = {}
+        self.indexed_values = {}
+        self.name_order = None
+        for field in self.INDEXED_FIELDS:
+            self.indexes[field] = {}
         self.api = self.collection_mgr.api
         self.lite_sync = None
         self.lock = Lock()
+        self.load_lock = RLock()
 
 
     def __iter__(self):
         """
         Iterator for the collection.  Allows list comprehensions, etc.
         """
+        self.load_all()
         for a in self.listing.values():
             yield a
 
@@ -66,7 +86,7 @@ class Collection:
         """
         Returns size of the collection.
         """
-        return len(self.listing.values())
+        return len(self.listing) + len(self.unloaded)
 
 
     def factory_produce(self, collection_mgr, seed_data):
@@ -96,7 +116,56 @@ class Collection:
         """
         Return object with name in the collection
         """
-        return self.listing.get(name.lower(), None)
+        name = name.lower()
+        obj = self.listing.get(name, None)
+        if obj is None and name in self.unloaded:
+            obj = self.load(name)
+        return obj
+
+
+    def load(self, name):
+        """
+        Build the object for a record that has not been deserialized yet
+        (see LAZY_LOAD) and add it to the collection.
+        """
+        name = name.lower()
+        self.load_lock.acquire()
+        try:
+            obj = self.listing.get(name, None)
+            if obj is None:
+                item_dict = self.unloaded.get(name, None)
+                if item_dict is None:
+                    return None
+                obj = self.factory_produce(self.collection_mgr, item_dict)
+                self.add(obj)
+            return obj
+        finally:
+            self.load_lock.release()
+
+
+    def load_all(self):
+        """
+        Build the objects for all records that have not been deserialized yet.
+        """
+        while self.unloaded:
+            for name in self.unloaded.keys():
+                self.load(name)
+
+
+    def load_matching(self, field, value):
+        """
+        Build the objects for the not yet deserialized records whose indexed
+        field has the given value.  Used by parents to find their children.
+        """
+        if not self.unloaded:
+            return
+        self.lock.acquire()
+        try:
+            names = [x for x in self.indexes[field].get(value.lower(), []) if x in self.unloaded]
+        finally:
+            self.lock.release()
+        for name in names:
+            self.load(name)
 
 
     def find(self, name=None, return_list=False, no_errors=False, **kargs):
@@ -120,16 +189,23 @@ class Collection:
 
         # performance: if the only key is name we can skip the whole loop
         if len(kargs) == 1 and "name" in kargs and not return_list:
-            return self.listing.get(kargs["name"].lower(), None)
+            return self.get(kargs["name"])
 
         self.lock.acquire()
         try:
-            for (name, obj) in self.listing.iteritems():
-                if obj.find_match(kargs, no_errors=no_errors):
-                    matches.append(obj)
+            candidates = self.__index_candidates(kargs)
+            if candidates is None:
+                candidates = self.listing.keys() + self.unloaded.keys()
+            else:
+                candidates = sorted(candidates)
         finally:
             self.lock.release()
 
+        for name in candidates:
+            obj = self.get(name)
+            if obj is not None and obj.find_match(kargs, no_errors=no_errors):
+                matches.append(obj)
+
         if not return_list:
             if len(matches) == 0:
                 return None
@@ -158,6 +234,132 @@ class Collection:
     }
 
 
+    def __index_candidates(self, kargs):
+        """
+        Use the secondary indexes to narrow down the objects that can possibly
+        match the given search criteria.  Returns a set of object names, or
+        None if no criteria can be answered from an index, in which case the
+        caller has to scan the whole collection.  Wildcard and negated searches
+        always fall back to scanning.  Candidates still need to be checked with
+        find_match(), the indexes only reflect the state as of the last add().
+        Must be called with the collection lock held.
+        """
+        candidates = None
+        for (key, value) in kargs.iteritems():
+            if key == "name":
+                if not isinstance(value, basestring) or self.__is_pattern(value):
+                    continue
+                found = set()
+                if value.lower() in self.listing or value.lower() in self.unloaded:
+                    found.add(value.lower())
+            elif key in self.indexes:
+                if not isinstance(value, basestring) or self.__is_pattern(value):
+                    continue
+                found = self.indexes[key].get(value.lower(), set())
+            else:
+                continue
+            if candidates is None:
+                candidates = set(found)
+            else:
+                candidates &= found
+            if not candidates:
+                break
+        return candidates
+
+
+    def __is_pattern(self, value):
+        """
+        Is a search value something other than a plain exact match?
+        """
+        if value == "" or value.startswith("~"):
+            return True
+        for c in "*?[":
+            if c in value:
+                return True
+        return False
+
+
+    def __get_index_values(self, _dict, field):
+        """
+        Return the (lowercased) values of field from an object's attributes or
+        a raw record, looking into every network interface for interface-level
+        fields.
+        """
+        values = []
+        if field in self.INTERFACE_FIELDS and "interfaces" in _dict:
+            for intf in _dict["interfaces"].itervalues():
+                values.append(intf.get(field, None))
+        else:
+            values.append(_dict.get(field, None))
+        return [v.lower() for v in values if isinstance(v, basestring) and v != ""]
+
+
+    def add_to_indexes(self, ref):
+        """
+        Record the indexed field values of an object.  Any values previously
+        recorded under the same name are dropped first.
+        Must be called with the collection lock held.
+        """
+        self.__add_to_indexes(ref.name, ref.__dict__)
+
+
+    def __add_to_indexes(self, name, _dict):
+        name = name.lower()
+        if name not in self.indexed_values:
+            # a new object, see sorted_names()
+            self.name_order = None
+        self.__remove_from_indexes(name)
+        recorded = {}
+        for field in self.INDEXED_FIELDS:
+            values = self.__get_index_values(_dict, field)
+            for value in values:
+                self.indexes[field].setdefault(value, set()).add(name)
+            recorded[field] = values
+        self.indexed_values[name] = recorded
+
+
+    def remove_from_indexes(self, name):
+        """
+        Forget the indexed field values recorded for the object name.
+        Must be called with the collection lock held.
+        """
+        if self.__remove_from_indexes(name):
+            self.name_order = None
+
+
+    def __remove_from_indexes(self, name):
+        recorded = self.indexed_values.pop(name.lower(), None)
+        if recorded is None:
+            return False
+        for (field, values) in recorded.iteritems():
+            index = self.indexes[field]
+            for value in values:
+                names = index.get(value)
+                if names is None:
+                    continue
+                names.discard(name.lower())
+                if not names:
+                    del index[value]
+        return True
+
+
+    def sorted_names(self):
+        """
+        Return the (lowercased) names of all objects in the collection in
+        sorted order, including the ones that have not been deserialized yet.
+        The list is cached until an object is added or removed, so callers
+        that page through the collection do not have to sort it every time.
+        Callers must not modify the returned list.
+        """
+        self.lock.acquire()
+        try:
+            if self.name_order is None:
+                self.name_order = sorted(self.indexed_values.keys())
+            return self.name_order
+        finally:
+            self.lock.release()
+
+
     def __rekey(self, _dict):
         """
         Find calls from the command line ("cobbler system find")
@@ -179,6 +381,7 @@ class Collection:
         """
         Serialize the collection
         """
+        self.load_all()
         _list = [x.to_dict() for x in self.listing.values()]
         return _list
 
@@ -187,8 +390,16 @@ class Collection:
         if _list is None:
             return
         for item_dict in _list:
-            item = self.factory_produce(self.collection_mgr, item_dict)
-            self.add(item)
+            if self.LAZY_LOAD:
+                self.lock.acquire()
+                try:
+                    self.unloaded[item_dict["name"].lower()] = item_dict
+                    self.__add_to_indexes(item_dict["name"], item_dict)
+                finally:
+                    self.lock.release()
+            else:
+                item = self.factory_produce(self.collection_mgr, item_dict)
+                self.add(item)
 
 
     def copy(self, ref, newname, logger=None):
@@ -262,6 +473,7 @@ class Collection:
                     if d.kernel.find(path) == 0:
                         d.set_kernel(d.kernel.replace(path, newpath))
                         d.set_initrd(d.initrd.replace(path, newpath))
+                        d.mtime = time.time()
                         self.collection_mgr.serialize_item(self, d)
 
         # now descend to any direct ancestors and point them at the new object allowing
@@ -348,8 +560,11 @@ class Collection:
         self.lock.acquire()
         try:
             self.listing[ref.name.lower()] = ref
+            self.unloaded.pop(ref.name.lower(), None)
+            self.add_to_indexes(ref)
         finally:
             self.lock.release()
+        utils.invalidate_blender_cache(ref)
 
         # perform filesystem operations
         if save:
@@ -358,30 +573,7 @@ class Collection:
             self.collection_mgr.serialize_item(self, ref)
 
             if with_sync:
-                if isinstance(ref, item_system.System):
-                    # we don't need openvz containers to be network bootable
-                    if ref.virt_type == "openvz":
-                        ref.netboot_enabled = False
-                    self.lite_sync.add_single_system(ref.name)
-                elif isinstance(ref, item_profile.Profile):
-                    # we don't need openvz containers to be network bootable
-                    if ref.virt_type == "openvz":
-                        ref.enable_menu = 0
-                    self.lite_sync.add_single_profile(ref.name)
-                elif isinstance(ref, item_distro.Distro):
-                    self.lite_sync.add_single_distro(ref.name)
-                elif isinstance(ref, item_image.Image):
-                    self.lite_sync.add_single_image(ref.name)
-                elif isinstance(ref, item_repo.Repo):
-                    pass
-                elif isinstance(ref, item_mgmtclass.Mgmtclass):
-                    pass
-                elif isinstance(ref, item_package.Package):
-                    pass
-                elif isinstance(ref, item_file.File):
-                    pass
-                else:
-                    print _("Internal error. Object type not recognized: %s") % type(ref)
+                self.__lite_sync([ref])
             if not with_sync and quick_pxe_update:
                 if isinstance(ref, item_system.System):
                     self.lite_sync.update_system_netboot_status(ref.name)
@@ -396,6 +588,117 @@ class Collection:
         if parent is not None:
             parent.children[ref.name] = ref
 
+    def add_many(self, refs, check_for_duplicate_names=False, logger=None):
+        """
+        Add and save several objects at once.
+
+        Each object goes through the same checks and add triggers as
+        with add(ref, save=True), but they are all written to disk in
+        one go under a single lock, and the lite sync and the change
+        triggers run once for the whole batch.
+
+        Returns a list with an entry per ref: None if it was added, or
+        the error that kept it out.
+        """
+        if self.lite_sync is None:
+            self.lite_sync = action_litesync.CobblerLiteSync(self.collection_mgr, logger=logger)
+
+        results = []
+        added = []
+        now = time.time()
+        for ref in refs:
+            try:
+                if ref is None:
+                    raise CX("Unable to add a None object")
+                if ref.name is None:
+                    raise CX("Unable to add an object without a name")
+                ref.check_if_valid()
+                if ref.COLLECTION_TYPE != self.collection_type():
+                    raise CX(_("API error: storing wrong data type in collection"))
+                # also catches duplicates within the batch, the earlier
+                # ones are in the listing by now
+                self.__duplication_checks(ref, check_for_duplicate_names, False)
+                utils.run_triggers(self.api, ref, "/var/lib/cobbler/triggers/add/%s/pre/*" % self.collection_type())
+            except CX, e:
+                results.append(e)
+                continue
+
+            if ref.uid == '':
+                ref.uid = self.collection_mgr.generate_uid()
+            if ref.ctime == 0:
+                ref.ctime = now
+            ref.mtime = now
+
+            self.lock.acquire()
+            try:
+                self.listing[ref.name.lower()] = ref
+                self.unloaded.pop(ref.name.lower(), None)
+                self.add_to_indexes(ref)
+            finally:
+                self.lock.release()
+            utils.invalidate_blender_cache(ref)
+            results.append(None)
+            added.append(ref)
+
+        if not added:
+            return results
+
+        self.collection_mgr.serialize_items(self, added)
+        self.__lite_sync(added)
+
+        for ref in added:
+            utils.run_triggers(self.api, ref, "/var/lib/cobbler/triggers/add/%s/post/*" % self.collection_type(), [], logger)
+        utils.run_triggers(self.api, None, "/var/lib/cobbler/triggers/change/*", [], logger)
+
+        for ref in added:
+            parent = ref.get_parent()
+            if parent is not None:
+                parent.children[ref.name] = ref
+
+        return results
+
+    def __lite_sync(self, refs):
+        """
+        Write out the tftp and web files of just added objects.
+        Systems share one regeneration of the DHCP/DNS host lists
+        and profiles a single rebuild of the PXE menu.
+        """
+        systems = []
+        profiles = []
+        for ref in refs:
+            if isinstance(ref, item_system.System):
+                # we don't need openvz containers to be network bootable
+                if ref.virt_type == "openvz":
+                    ref.netboot_enabled = False
+                systems.append(ref.name)
+            elif isinstance(ref, item_profile.Profile):
+                # we don't need openvz containers to be network bootable
+                if ref.virt_type == "openvz":
+                    ref.enable_menu = 0
+                profiles.append(ref.name)
+            elif isinstance(ref, item_distro.Distro):
+                self.lite_sync.add_single_distro(ref.name)
+            elif isinstance(ref, item_image.Image):
+                self.lite_sync.add_single_image(ref.name)
+            elif isinstance(ref, item_repo.Repo):
+                pass
+            elif isinstance(ref, item_mgmtclass.Mgmtclass):
+                pass
+            elif isinstance(ref, item_package.Package):
+                pass
+            elif isinstance(ref, item_file.File):
+                pass
+            else:
+                print _("Internal error. Object type not recognized: %s") % type(ref)
+        if len(systems) == 1:
+            self.lite_sync.add_single_system(systems[0])
+        elif systems:
+            self.lite_sync.add_systems(systems)
+        if len(profiles) == 1:
+            self.lite_sync.add_single_profile(profiles[0])
+        elif profiles:
+            self.lite_sync.add_profiles(profiles)
+
 
     def __duplication_checks(self, ref, check_for_duplicate_names, check_for_duplicate_netinfo):
         """
@@ -467,6 +770,7 @@ class Collection:
         would be better off reading the JSON in the collections files
         directly.
         """
+        self.load_all()
         values = self.listing.values()[:]   # copy the values
         values.sort()                       # sort the copy (2.3 fix)
         results = []
@@ -54,9 +54,8 @@ class Distros(collection.Collection):
 
         # first see if any Groups use this distro
         if not recursive:
-            for v in self.collection_mgr.profiles():
-                if v.distro and v.distro.lower() == name:
-                    raise CX(_("removal would orphan profile: %s") % v.name)
+            for v in self.collection_mgr.profiles().find(distro=name, return_list=True):
+                raise CX(_("removal would orphan profile: %s") % v.name)
 
         obj = self.find(name=name)
 
@@ -76,8 +75,10 @@ class Distros(collection.Collection):
             self.lock.acquire()
             try:
                 del self.listing[name]
+                self.remove_from_indexes(name)
             finally:
                 self.lock.release()
+            utils.invalidate_blender_cache(obj)
 
             self.collection_mgr.serialize_delete(self, obj)
 
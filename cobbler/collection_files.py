@@ -57,8 +57,10 @@ class Files(collection.Collection):
             self.lock.acquire()
             try:
                 del self.listing[name]
+                self.remove_from_indexes(name)
             finally:
                 self.lock.release()
+            utils.invalidate_blender_cache(obj)
             self.collection_mgr.serialize_delete(self, obj)
 
             if with_delete:
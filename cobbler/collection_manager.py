@@ -26,6 +26,7 @@ import time
 import weakref
 
 from cexceptions import CX
+import changefeed
 import collection_distros as distros
 import collection_files as files
 import collection_images as images
@@ -36,6 +37,7 @@ import collection_repos as repos
 import collection_systems as systems
 import settings
 import serializer
+import utils
 
 
 class CollectionManager:
@@ -69,6 +71,7 @@ class CollectionManager:
         self._packages = packages.Packages(weakref.proxy(self))
         self._files = files.Files(weakref.proxy(self))
         self._settings = settings.Settings()         # not a true collection
+        self.changes = changefeed.ChangeFeed()
 
     def generate_uid(self):
         """
@@ -159,7 +162,24 @@ class CollectionManager:
         @param Item item collection item
         """
 
-        return serializer.serialize_item(collection, item)
+        rc = serializer.serialize_item(collection, item)
+        utils.invalidate_blender_cache(item)
+        self.changes.record(collection.collection_type(), "save", [item])
+        return rc
+
+    def serialize_items(self, collection, items):
+        """
+        Save several items of a collection to disk at once
+
+        @param Collection collection Collection
+        @param list items collection items
+        """
+
+        rc = serializer.serialize_items(collection, items)
+        for item in items:
+            utils.invalidate_blender_cache(item)
+        self.changes.record(collection.collection_type(), "save", items)
+        return rc
 
     def serialize_delete(self, collection, item):
         """
@@ -169,7 +189,10 @@ class CollectionManager:
         @param Item item collection item
         """
 
-        return serializer.serialize_delete(collection, item)
+        rc = serializer.serialize_delete(collection, item)
+        utils.invalidate_blender_cache(item)
+        self.changes.record(collection.collection_type(), "remove", [item])
+        return rc
 
     def deserialize(self):
         """
@@ -193,6 +216,7 @@ class CollectionManager:
                 serializer.deserialize(collection)
             except Exception as e:
                 raise CX("serializer: error loading collection %s: %s. Check /etc/cobbler/modules.conf" % (collection.collection_type(), e))
+        self.changes.set_size(self._settings.change_feed_size)
 
     def get_items(self, collection_type):
         if collection_type == "distro":
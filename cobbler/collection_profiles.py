@@ -32,6 +32,8 @@ class Profiles(collection.Collection):
     template file.
     """
 
+    INDEXED_FIELDS = ["distro", "parent"]
+
     def collection_type(self):
         return "profile"
 
@@ -50,9 +52,8 @@ class Profiles(collection.Collection):
         """
         name = name.lower()
         if not recursive:
-            for v in self.collection_mgr.systems():
-                if v.profile is not None and v.profile.lower() == name:
-                    raise CX(_("removal would orphan system: %s") % v.name)
+            for v in self.collection_mgr.systems().find(profile=name, return_list=True):
+                raise CX(_("removal would orphan system: %s") % v.name)
 
         obj = self.find(name=name)
         if obj is not None:
@@ -70,8 +71,10 @@ class Profiles(collection.Collection):
             self.lock.acquire()
             try:
                 del self.listing[name]
+                self.remove_from_indexes(name)
             finally:
                 self.lock.release()
+            utils.invalidate_blender_cache(obj)
             self.collection_mgr.serialize_delete(self, obj)
             if with_delete:
                 if with_triggers:
@@ -32,6 +32,9 @@ class Systems(collection.Collection):
     they belong to.
     """
 
+    INDEXED_FIELDS = ["mac_address", "ip_address", "dns_name", "hostname", "profile", "image"]
+    LAZY_LOAD = True
+
     def collection_type(self):
         return "system"
 
@@ -62,8 +65,10 @@ class Systems(collection.Collection):
             self.lock.acquire()
             try:
                 del self.listing[name]
+                self.remove_from_indexes(name)
             finally:
                 self.lock.release()
+            utils.invalidate_blender_cache(obj)
             self.collection_mgr.serialize_delete(self, obj)
             if with_delete:
                 if with_triggers:
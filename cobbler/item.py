@@ -200,8 +200,12 @@ class Item(object):
         utils.from_dict_from_fields(self, _dict, self.get_fields())
 
 
-    def to_dict(self):
-        return utils.to_dict_from_fields(self, self.get_fields())
+    def to_dict(self, only=None):
+        """
+        Return the fields of this object as a dict.  If only is a list of
+        field names, the dict is limited to those fields.
+        """
+        return utils.to_dict_from_fields(self, self.get_fields(), only=only)
 
 
     def to_string(self):
@@ -220,6 +224,10 @@ class Item(object):
         """
         Get direct children of this object.
         """
+        # systems which have not been deserialized yet only register with
+        # their parent once they are loaded, see Collection.LAZY_LOAD
+        if self.COLLECTION_TYPE in ("profile", "image"):
+            self.collection_mgr.systems().load_matching(self.COLLECTION_TYPE, self.name)
         keys = self.children.keys()
         if sorted:
             keys.sort()
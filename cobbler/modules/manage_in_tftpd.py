@@ -21,6 +21,7 @@ import glob
 import os.path
 import shutil
 import tftpgen
+import time
 
 from cexceptions import CX
 import clogger
@@ -165,9 +166,12 @@ class InTftpdManager:
         """
         self.tftpgen.verbose = verbose
         self.logger.info("copying bootloaders")
+        start = time.time()
         self.tftpgen.copy_bootloaders()
+        self.logger.info("copied bootloaders in %.2fs" % (time.time() - start))
 
         self.logger.info("copying distros to tftpboot")
+        start = time.time()
 
         # Adding in the exception handling to not blow up if files have
         # been moved (or the path references an NFS directory that's no longer
@@ -178,18 +182,23 @@ class InTftpdManager:
                 self.tftpgen.copy_single_distro_files(d, self.bootloc, False)
             except CX, e:
                 self.logger.error(e.value)
+        self.logger.info("copied distros in %.2fs" % (time.time() - start))
 
         self.logger.info("copying images")
+        start = time.time()
         self.tftpgen.copy_images()
+        self.logger.info("copied images in %.2fs" % (time.time() - start))
 
         # the actual pxelinux.cfg files, for each interface
         self.logger.info("generating PXE configuration files")
         menu_items = self.tftpgen.get_menu_items()['pxe']
-        for x in self.systems:
-            self.tftpgen.write_all_system_files(x, menu_items)
+        workers = self.collection_mgr.settings().sync_workers
+        self.tftpgen.write_all_systems_files(list(self.systems), menu_items, workers)
 
         self.logger.info("generating PXE menu structure")
+        start = time.time()
         self.tftpgen.make_pxe_menu()
+        self.logger.info("generated PXE menu structure in %.2fs" % (time.time() - start))
 
 
 def get_manager(collection_mgr, logger):
@@ -0,0 +1,362 @@
+"""
+Cobbler's snapshot/journal based object serializer.
+Stores each collection as a single JSON snapshot file plus an append-only
+journal of changes made since that snapshot was written, in
+/var/lib/cobbler/collections/distros.json, distros.journal, etc
+
+Loading a collection is one sequential read of the snapshot followed by a
+replay of the journal.  Saving an item appends (and fsyncs) one line to the
+journal; once the journal grows large enough relative to the snapshot both
+are folded into a new snapshot, which is written to a temporary file and
+renamed into place.
+
+To convert an existing installation using serializer_file, stop cobblerd
+and run this module as a script:
+
+    python /usr/lib/python2.7/site-packages/cobbler/modules/serializer_snapshot.py
+
+then set serializer_snapshot for every collection type in the [serializers]
+section of /etc/cobbler/modules.conf:
+
+    [serializers]
+    distro = serializer_snapshot
+    repo = serializer_snapshot
+    ...
+
+as listed in COLLECTION_TYPES.
+
+Copyright 2006-2009, Red Hat, Inc and Others
+Michael DeHaan <michael.dehaan AT gmail>
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+02110-1301  USA
+"""
+
+import distutils.sysconfig
+import exceptions
+import glob
+import os
+import simplejson
+import sys
+import yaml
+
+plib = distutils.sysconfig.get_python_lib()
+mod_path = "%s/cobbler" % plib
+sys.path.insert(0, mod_path)
+
+COLLECTIONS_DIR = "/var/lib/cobbler/collections"
+COLLECTION_TYPES = ["distro", "repo", "profile", "image", "system", "mgmtclass", "package", "file"]
+
+# the journal is folded into a new snapshot once it is larger than
+# COMPACT_RATIO times the snapshot, but never before it reaches COMPACT_MIN_SIZE
+COMPACT_RATIO = 0.5
+COMPACT_MIN_SIZE = 1024 * 1024
+
+
+def register():
+    """
+    The mandatory cobbler module registration hook.
+    """
+    return "serializer"
+
+
+def what():
+    """
+    Module identification function
+    """
+    return "serializer/snapshot"
+
+
+def __base_filename(collection_type):
+    # FIXME: Need a better way to support collections/items
+    # appending an 's' does not work in all cases
+    if collection_type in ['mgmtclass']:
+        return "%s/%ses" % (COLLECTIONS_DIR, collection_type)
+    else:
+        return "%s/%ss" % (COLLECTIONS_DIR, collection_type)
+
+
+def __snapshot_filename(collection_type):
+    return "%s.json" % __base_filename(collection_type)
+
+
+def __journal_filename(collection_type):
+    return "%s.journal" % __base_filename(collection_type)
+
+
+def __fsync_dir(dirname):
+    fd = os.open(dirname, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def __write_atomic(filename, data):
+    """
+    Replace filename with data without ever leaving a partially written
+    file behind, even if the machine crashes half way.
+    """
+    tmpname = "%s.tmp.%d" % (filename, os.getpid())
+    fd = open(tmpname, "w")
+    try:
+        fd.write(data)
+        fd.flush()
+        os.fsync(fd.fileno())
+    finally:
+        fd.close()
+    os.rename(tmpname, filename)
+    __fsync_dir(os.path.dirname(filename))
+
+
+def __append_journal(collection_type, record):
+    """
+    Append a single change record to the journal of a collection.
+    """
+    __append_journal_records(collection_type, [record])
+
+
+def __append_journal_records(collection_type, records):
+    """
+    Append change records to the journal of a collection, with a
+    single write and fsync.
+    """
+    data = "".join([simplejson.dumps(record, encoding="utf-8") + "\n" for record in records])
+    fd = open(__journal_filename(collection_type), "a+")
+    try:
+        # terminate a torn last record so it does not swallow this one
+        fd.seek(0, os.SEEK_END)
+        if fd.tell() > 0:
+            fd.seek(-1, os.SEEK_END)
+            if fd.read(1) != "\n":
+                data = "\n" + data
+            fd.seek(0, os.SEEK_END)
+        fd.write(data)
+        fd.flush()
+        os.fsync(fd.fileno())
+    finally:
+        fd.close()
+
+
+def __load_records(collection_type):
+    """
+    Read the snapshot and replay the journal of a collection.
+
+    @param str collection_type collection type
+    @return dict item name -> item dict
+    """
+    records = {}
+    snapshot = __snapshot_filename(collection_type)
+    if os.path.exists(snapshot):
+        fd = open(snapshot)
+        try:
+            for _dict in simplejson.load(fd, encoding="utf-8"):
+                records[_dict["name"]] = _dict
+        finally:
+            fd.close()
+
+    journal = __journal_filename(collection_type)
+    if os.path.exists(journal):
+        fd = open(journal)
+        try:
+            for line in fd:
+                try:
+                    record = simplejson.loads(line, encoding="utf-8")
+                except ValueError:
+                    # a torn write at the end of the journal, the change it
+                    # describes was never acknowledged so it can be skipped
+                    continue
+                if record["op"] == "save":
+                    records[record["name"]] = record["item"]
+                elif record["op"] == "delete":
+                    records.pop(record["name"], None)
+        finally:
+            fd.close()
+
+    return records
+
+
+def __write_snapshot(collection_type, items):
+    """
+    Write a new snapshot for a collection and drop its journal.
+
+    @param str collection_type collection type
+    @param list items item dicts
+    """
+    data = simplejson.dumps(items, encoding="utf-8")
+    __write_atomic(__snapshot_filename(collection_type), data)
+    journal = __journal_filename(collection_type)
+    if os.path.exists(journal):
+        os.remove(journal)
+
+
+def __maybe_compact(collection_type):
+    """
+    Fold the journal into a new snapshot once it has grown large enough.
+    """
+    journal = __journal_filename(collection_type)
+    snapshot = __snapshot_filename(collection_type)
+    if not os.path.exists(journal):
+        return
+    journal_size = os.path.getsize(journal)
+    if journal_size < COMPACT_MIN_SIZE:
+        return
+    snapshot_size = 0
+    if os.path.exists(snapshot):
+        snapshot_size = os.path.getsize(snapshot)
+    if journal_size < snapshot_size * COMPACT_RATIO:
+        return
+    compact(collection_type)
+
+
+def compact(collection_type):
+    """
+    Rewrite the snapshot of a collection with all journaled changes applied.
+
+    @param str collection_type collection type
+    """
+    records = __load_records(collection_type)
+    __write_snapshot(collection_type, records.values())
+
+
+def serialize_item(collection, item):
+    """
+    Save a collection item to the collection journal
+
+    @param Collection collection collection
+    @param Item item collection item
+    """
+
+    if item.name is None or item.name == "":
+        raise exceptions.RuntimeError("name unset for item!")
+
+    ctype = collection.collection_type()
+    __append_journal(ctype, {"op": "save", "name": item.name, "item": item.to_dict()})
+    __maybe_compact(ctype)
+
+
+def serialize_items(collection, items):
+    """
+    Save several items of a collection to the collection journal
+
+    @param Collection collection collection
+    @param list items collection items
+    """
+
+    for item in items:
+        if item.name is None or item.name == "":
+            raise exceptions.RuntimeError("name unset for item!")
+
+    ctype = collection.collection_type()
+    __append_journal_records(ctype, [{"op": "save", "name": item.name, "item": item.to_dict()} for item in items])
+    __maybe_compact(ctype)
+
+
+def serialize_delete(collection, item):
+    """
+    Record the deletion of a collection item in the collection journal
+
+    @param Collection collection collection
+    @param Item item collection item
+    """
+
+    ctype = collection.collection_type()
+    __append_journal(ctype, {"op": "delete", "name": item.name})
+    __maybe_compact(ctype)
+
+
+def serialize(collection):
+    """
+    Save a collection as a new snapshot
+
+    @param Collection collection collection
+    """
+
+    # do not serialize settings
+    ctype = collection.collection_type()
+    if ctype != "settings":
+        __write_snapshot(ctype, collection.to_list())
+
+
+def deserialize_raw(collection_type):
+
+    # FIXME: code to load settings file should not be replicated in all
+    #   serializer subclasses
+    if collection_type == "settings":
+        fd = open("/etc/cobbler/settings")
+        _dict = yaml.safe_load(fd.read())
+        fd.close()
+
+        # include support
+        for ival in _dict.get("include", []):
+            for ifile in glob.glob(ival):
+                with open(ifile, 'r') as fd:
+                    _dict.update(yaml.safe_load(fd.read()))
+
+        return _dict
+    else:
+        return __load_records(collection_type).values()
+
+
+def deserialize(collection, topological=True):
+    """
+    Load a collection from its snapshot and journal
+
+    @param Collection collection collection
+    @param bool topological
+    """
+
+    datastruct = deserialize_raw(collection.collection_type())
+    if topological and type(datastruct) == list:
+        datastruct.sort(__depth_cmp)
+    if type(datastruct) == dict:
+        collection.from_dict(datastruct)
+    elif type(datastruct) == list:
+        collection.from_list(datastruct)
+
+
+def __depth_cmp(item1, item2):
+    d1 = item1.get("depth", 1)
+    d2 = item2.get("depth", 1)
+    return cmp(d1, d2)
+
+
+def migrate_from_file(collection_types=COLLECTION_TYPES):
+    """
+    Build snapshots from the one-file-per-object layout used by serializer_file.
+    The per-object files are left in place.
+
+    @param list collection_types collection types to migrate
+    @return dict collection type -> number of migrated items
+    """
+    counts = {}
+    for ctype in collection_types:
+        items = []
+        for f in sorted(glob.glob("%s/*.json" % __base_filename(ctype))):
+            fd = open(f)
+            try:
+                items.append(simplejson.loads(fd.read(), encoding="utf-8"))
+            finally:
+                fd.close()
+        __write_snapshot(ctype, items)
+        counts[ctype] = len(items)
+    return counts
+
+
+if __name__ == "__main__":
+    for (ctype, count) in sorted(migrate_from_file().items()):
+        print "migrated %d %s object(s)" % (count, ctype)
+
+# EOF
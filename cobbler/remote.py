@@ -21,13 +21,18 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
 import base64
 import errno
 import fcntl
+import heapq
 import os
+import Queue
 import random
+import re
+import select
 import SimpleXMLRPCServer
-from SocketServer import ThreadingMixIn
+import socket
 import stat
 import string
-from threading import Thread
+import StringIO
+from threading import Lock, Thread
 import time
 
 from cobbler import autoinstall_manager
@@ -48,6 +53,16 @@ from cobbler.cexceptions import CX
 
 EVENT_TIMEOUT = 7 * 24 * 60 * 60        # 1 week
 CACHE_TIMEOUT = 10 * 60                 # 10 minutes
+EXPIRY_SWEEP_INTERVAL = 30              # seconds between expiry sweeps
+
+# XMLRPC calls that are answered on their own worker lanes, so that they
+# cannot hold up the many cheap calls made while systems install
+SLOW_METHODS = [
+    "check", "generate_autoinstall", "generate_bootcfg", "generate_gpxe",
+    "generate_script", "get_status", "run_install_triggers", "sync",
+    "sync_dhcp", "xapi_object_edit_bulk",
+]
+WAIT_METHODS = ["wait_for_changes"]
 
 # task codes
 EVENT_RUNNING = "running"
@@ -111,11 +126,18 @@ class CobblerXMLRPCInterface:
         self.object_cache = {}
         self.timestamp = self.api.last_modified_time()
         self.events = {}
+        # min-heap of (deadline, kind, key) entries for the token, object
+        # and event caches, swept by a background thread
+        self.expiry_heap = []
+        self.expiry_lock = Lock()
         self.shared_secret = utils.get_shared_secret()
         random.seed(time.time())
         self.translator = utils.Translator(keep=string.printable)
         self.tftpgen = tftpgen.TFTPGen(api._collection_mgr, self.logger)
         self.autoinstall_mgr = autoinstall_manager.AutoInstallationManager(api._collection_mgr)
+        sweeper = Thread(target=self.__expiry_loop)
+        sweeper.setDaemon(True)
+        sweeper.start()
 
     def check(self, token):
         """
@@ -178,7 +200,8 @@ class CobblerXMLRPCInterface:
 
     def background_sync(self, options, token):
         def runner(self):
-            self.remote.api.sync(self.options.get("verbose", False), logger=self.logger)
+            self.remote.api.sync(self.options.get("verbose", False), logger=self.logger,
+                                 incremental=self.options.get("incremental", False))
         return self.__start_task(runner, token, "sync", "Sync", options)
 
     def background_hardlink(self, options, token):
@@ -272,22 +295,22 @@ class CobblerXMLRPCInterface:
         has not seen yet.  If left unset, it will return /all/ events.
         """
         # return only the events the user has not seen
-        self.events_filtered = {}
-        for (k, x) in self.events.iteritems():
+        events_filtered = {}
+        for (k, x) in self.events.items():
             if for_user in x[3]:
                 pass
             else:
-                self.events_filtered[k] = x
+                events_filtered[k] = x
 
         # mark as read so user will not get events again
         if for_user is not None and for_user != "":
-            for (k, x) in self.events.iteritems():
+            for (k, x) in self.events.items():
                 if for_user in x[3]:
                     pass
                 else:
-                    self.events[k][3].append(for_user)
+                    x[3].append(for_user)
 
-        return self.events_filtered
+        return events_filtered
 
     def get_event_log(self, event_id):
         """
@@ -314,6 +337,7 @@ class CobblerXMLRPCInterface:
         event_id = self.__generate_event_id("event")
         event_id = str(event_id)
         self.events[event_id] = [float(time.time()), str(name), EVENT_INFO, []]
+        self.__schedule_expiry("event", event_id)
 
     def __start_task(self, thr_obj_fn, token, role_name, name, args, on_done=None):
         """
@@ -330,6 +354,7 @@ class CobblerXMLRPCInterface:
         event_id = self.__generate_event_id(role_name)          # use short form for logfile suffix
         event_id = str(event_id)
         self.events[event_id] = [float(time.time()), str(name), EVENT_RUNNING, []]
+        self.__schedule_expiry("event", event_id)
 
         self._log("start_task(%s); event_id(%s)" % (name, event_id))
         logatron = clogger.Logger("/var/log/cobbler/tasks/%s.log" % event_id)
@@ -345,9 +370,10 @@ class CobblerXMLRPCInterface:
 
     def _set_task_state(self, thread_obj, event_id, new_state):
         event_id = str(event_id)
-        if event_id in self.events:
-            self.events[event_id][2] = new_state
-            self.events[event_id][3] = []           # clear the list of who has read it
+        event = self.events.get(event_id)
+        if event is not None:
+            event[2] = new_state
+            event[3] = []           # clear the list of who has read it
         if thread_obj is not None:
             if new_state == EVENT_COMPLETE:
                 thread_obj.logger.info("### TASK COMPLETE ###")
@@ -356,10 +382,10 @@ class CobblerXMLRPCInterface:
 
     def get_task_status(self, event_id):
         event_id = str(event_id)
-        if event_id in self.events:
-            return self.events[event_id]
-        else:
+        event = self.events.get(event_id)
+        if event is None:
             raise CX("no event with that id")
+        return event
 
     def __sorter(self, a, b):
         """
@@ -393,10 +419,10 @@ class CobblerXMLRPCInterface:
         Given a token returned from login, return the username
         that logged in with it.
         """
-        if token not in self.token_cache:
+        entry = self.token_cache.get(token)
+        if entry is None:
             raise CX("invalid token: %s" % token)
-        else:
-            return self.token_cache[token][1]
+        return entry[1]
 
     def _log(self, msg, user=None, token=None, name=None, object_id=None, attribute=None, debug=False, error=False):
         """
@@ -511,6 +537,83 @@ class CobblerXMLRPCInterface:
             'items_per_page_list': [10, 20, 50, 100, 200, 500],
         })
 
+    def __page_bounds(self, page, results_per_page):
+        """
+        Helper function to turn the page and results_per_page arguments of
+        the get_<what>s calls into an (offset, limit) pair.  Without a
+        usable results_per_page, everything is returned.
+        """
+        try:
+            results_per_page = int(results_per_page)
+        except:
+            return (None, None)
+        if results_per_page <= 0:
+            return (None, None)
+        try:
+            page = max(int(page), 1)
+        except:
+            page = 1
+        return ((page - 1) * results_per_page, results_per_page)
+
+    def __window(self, data, offset=None, limit=None):
+        """
+        Helper function to return the part of a list selected by offset and
+        limit.  A missing or non-positive limit means no limit.
+        """
+        try:
+            offset = max(int(offset), 0)
+        except:
+            offset = 0
+        try:
+            limit = int(limit)
+        except:
+            limit = 0
+        if limit <= 0:
+            return data[offset:]
+        return data[offset:offset + limit]
+
+    def __fields(self, fields):
+        """
+        Helper function to normalize a field projection; an empty list
+        or None selects all fields.
+        """
+        if not fields:
+            return None
+        if isinstance(fields, basestring):
+            return [fields]
+        return fields
+
+    def __find_sorted(self, what, criteria=None, sort_field=None):
+        """
+        Helper function to return the objects matching criteria in the order
+        given by sort_field, see __sort.  When all objects are listed by
+        name, the collection's cached name order is returned instead, so
+        that nothing needs to be loaded or sorted before the list is cut
+        down; pass the result through __load_items.
+        """
+        if not criteria and sort_field in (None, "name", "!name"):
+            names = self.api.get_items(what).sorted_names()
+            if sort_field == "!name":
+                names = names[::-1]
+            return names
+        items = self.api.find_items(what, criteria=criteria)
+        return self.__sort(items, sort_field)
+
+    def __load_items(self, what, data):
+        """
+        Helper function to turn a list of objects and/or object names into
+        a list of objects.  Names of objects removed in the meantime are
+        skipped.
+        """
+        collection = self.api.get_items(what)
+        items = []
+        for x in data:
+            if isinstance(x, basestring):
+                x = collection.get(x)
+            if x is not None:
+                items.append(x)
+        return items
+
     def __get_object(self, object_id):
         """
         Helper function. Given an object id, return the actual object.
@@ -559,14 +662,18 @@ class CobblerXMLRPCInterface:
     def get_file(self, name, flatten=False, token=None, **rest):
         return self.get_item("file", name, flatten=flatten)
 
-    def get_items(self, what):
+    def get_items(self, what, fields=None, offset=None, limit=None):
         """
-        Returns a list of dicts.
+        Returns a list of dicts, sorted by name.
         what is the name of a cobbler object type, as described for get_item.
-        Individual list elements are the same for get_item.
+        Individual list elements are the same for get_item, limited to the
+        given fields if a list of field names is passed.
+        offset and limit select a part of the list; they are applied before
+        any object is loaded or serialized.
         """
+        names = self.__window(self.api.get_items(what).sorted_names(), offset, limit)
         # FIXME: is the xmlrpc_hacks method still required ?
-        item = [x.to_dict() for x in self.api.get_items(what)]
+        item = [x.to_dict(only=self.__fields(fields)) for x in self.__load_items(what, names)]
         return self.xmlrpc_hacks(item)
 
     def get_item_names(self, what):
@@ -576,31 +683,31 @@ class CobblerXMLRPCInterface:
         """
         return [x.name for x in self.api.get_items(what)]
 
-    def get_distros(self, page=None, results_per_page=None, token=None, **rest):
-        return self.get_items("distro")
+    def get_distros(self, page=None, results_per_page=None, token=None, fields=None, **rest):
+        return self.get_items("distro", fields, *self.__page_bounds(page, results_per_page))
 
-    def get_profiles(self, page=None, results_per_page=None, token=None, **rest):
-        return self.get_items("profile")
+    def get_profiles(self, page=None, results_per_page=None, token=None, fields=None, **rest):
+        return self.get_items("profile", fields, *self.__page_bounds(page, results_per_page))
 
-    def get_systems(self, page=None, results_per_page=None, token=None, **rest):
-        return self.get_items("system")
+    def get_systems(self, page=None, results_per_page=None, token=None, fields=None, **rest):
+        return self.get_items("system", fields, *self.__page_bounds(page, results_per_page))
 
-    def get_repos(self, page=None, results_per_page=None, token=None, **rest):
-        return self.get_items("repo")
+    def get_repos(self, page=None, results_per_page=None, token=None, fields=None, **rest):
+        return self.get_items("repo", fields, *self.__page_bounds(page, results_per_page))
 
-    def get_images(self, page=None, results_per_page=None, token=None, **rest):
-        return self.get_items("image")
+    def get_images(self, page=None, results_per_page=None, token=None, fields=None, **rest):
+        return self.get_items("image", fields, *self.__page_bounds(page, results_per_page))
 
-    def get_mgmtclasses(self, page=None, results_per_page=None, token=None, **rest):
-        return self.get_items("mgmtclass")
+    def get_mgmtclasses(self, page=None, results_per_page=None, token=None, fields=None, **rest):
+        return self.get_items("mgmtclass", fields, *self.__page_bounds(page, results_per_page))
 
-    def get_packages(self, page=None, results_per_page=None, token=None, **rest):
-        return self.get_items("package")
+    def get_packages(self, page=None, results_per_page=None, token=None, fields=None, **rest):
+        return self.get_items("package", fields, *self.__page_bounds(page, results_per_page))
 
-    def get_files(self, page=None, results_per_page=None, token=None, **rest):
-        return self.get_items("file")
+    def get_files(self, page=None, results_per_page=None, token=None, fields=None, **rest):
+        return self.get_items("file", fields, *self.__page_bounds(page, results_per_page))
 
-    def find_items(self, what, criteria=None, sort_field=None, expand=True):
+    def find_items(self, what, criteria=None, sort_field=None, expand=True, fields=None, offset=None, limit=None):
         """
         Returns a list of dicts.
         Works like get_items but also accepts criteria as a dict to search on.
@@ -608,12 +715,12 @@ class CobblerXMLRPCInterface:
         Wildcards work as described by 'pydoc fnmatch'.
         """
         self._log("find_items(%s); criteria(%s); sort(%s)" % (what, criteria, sort_field))
-        items = self.api.find_items(what, criteria=criteria)
-        items = self.__sort(items, sort_field)
+        items = self.__find_sorted(what, criteria, sort_field)
+        items = self.__load_items(what, self.__window(items, offset, limit))
         if not expand:
             items = [x.name for x in items]
         else:
-            items = [x.to_dict() for x in items]
+            items = [x.to_dict(only=self.__fields(fields)) for x in items]
         return self.xmlrpc_hacks(items)
 
     def find_distro(self, criteria={}, expand=False, token=None, **rest):
@@ -640,17 +747,16 @@ class CobblerXMLRPCInterface:
     def find_file(self, criteria={}, expand=False, token=None, **rest):
         return self.find_items("file", criteria, expand=expand)
 
-    def find_items_paged(self, what, criteria=None, sort_field=None, page=None, items_per_page=None, token=None):
+    def find_items_paged(self, what, criteria=None, sort_field=None, page=None, items_per_page=None, token=None, fields=None):
         """
         Returns a list of dicts as with find_items but additionally supports
         returning just a portion of the total list, for instance in supporting
         a web app that wants to show a limited amount of items per page.
         """
         self._log("find_items_paged(%s); criteria(%s); sort(%s)" % (what, criteria, sort_field), token=token)
-        items = self.api.find_items(what, criteria=criteria)
-        items = self.__sort(items, sort_field)
+        items = self.__find_sorted(what, criteria, sort_field)
         (items, pageinfo) = self.__paginate(items, page, items_per_page)
-        items = [x.to_dict() for x in items]
+        items = [x.to_dict(only=self.__fields(fields)) for x in self.__load_items(what, items)]
         return self.xmlrpc_hacks({
             'items': items,
             'pageinfo': pageinfo
@@ -835,6 +941,7 @@ class CobblerXMLRPCInterface:
             raise CX("internal error, collection name is %s" % what)
         key = "___NEW___%s::%s" % (what, self.__get_random(25))
         self.object_cache[key] = (time.time(), d)
+        self.__schedule_expiry("object", key)
         return key
 
     def new_distro(self, token):
@@ -935,6 +1042,20 @@ class CobblerXMLRPCInterface:
 
         Ex: xapi_object_edit("distro","el5","add",{"kernel":"/tmp/foo","initrd":"/tmp/foo"},token)
         """
+        handle = self.__xapi_object_apply(object_type, object_name, edit_type, attributes, token)
+        if handle is None:
+            # removed
+            return True
+
+        # FIXME: use the bypass flag or not?
+        self.save_item(object_type, handle, token)
+        return True
+
+    def __xapi_object_apply(self, object_type, object_name, edit_type, attributes, token):
+        """
+        Everything xapi_object_edit() does, short of saving the object.
+        Returns the handle of the object to save, or None if it was removed.
+        """
         if object_name.strip() == "":
             raise CX("xapi_object_edit() called without an object name")
 
@@ -1025,11 +1146,64 @@ class CobblerXMLRPCInterface:
                     raise CX("Can't delete this profile there are %s subprofiles and 'recursive' is set to 'False'" % childs)
 
             self.remove_item(object_type, object_name, token, recursive=recursive)
-            return True
+            return None
 
-        # FIXME: use the bypass flag or not?
-        self.save_item(object_type, handle, token)
-        return True
+        return handle
+
+    def xapi_object_edit_bulk(self, edits, token):
+        """
+        Extended API:  Several xapi_object_edit() calls in one.
+
+        edits - a list of [object_type, object_name, edit_type, attributes]
+
+        Runs of 'add' and 'edit' calls on objects of the same type are all
+        applied, then saved together: with a single write to disk, lite sync
+        and run of the change triggers for the lot.  The other edit types are
+        made one at a time, in order.
+
+        Returns a list with the result of each edit: True, or the error
+        message for the edits that failed, and were not saved.
+
+        Ex: xapi_object_edit_bulk([["system","a","add",{"profile":"el5"}],
+                                   ["system","b","add",{"profile":"el5"}]],token)
+        """
+        self._log("xapi_object_edit_bulk(%d)" % len(edits), token=token)
+        results = [None] * len(edits)
+        batch = []          # (index, object) waiting to be saved
+        batch_type = None
+        batch_names = set()
+        for (index, (object_type, object_name, edit_type, attributes)) in enumerate(edits):
+            # an edit has to see the objects saved before it
+            if batch and (object_type != batch_type or edit_type not in ["add", "edit"] or
+                          object_name in batch_names):
+                self.__xapi_save_batch(batch_type, batch, results)
+                batch = []
+                batch_names = set()
+            try:
+                if edit_type not in ["add", "edit"]:
+                    results[index] = self.xapi_object_edit(object_type, object_name, edit_type, attributes, token)
+                    continue
+                handle = self.__xapi_object_apply(object_type, object_name, edit_type, attributes, token)
+                obj = self.__get_object(handle)
+                self.check_access(token, "save_%s" % object_type, obj)
+            except Exception, e:
+                results[index] = str(getattr(e, "value", e))
+                continue
+            batch.append((index, obj))
+            batch_type = object_type
+            batch_names.add(object_name)
+
+        if batch:
+            self.__xapi_save_batch(batch_type, batch, results)
+        return results
+
+    def __xapi_save_batch(self, object_type, batch, results):
+        errors = self.api.add_items(object_type, [obj for (index, obj) in batch])
+        for ((index, obj), error) in zip(batch, errors):
+            if error is None:
+                results[index] = True
+            else:
+                results[index] = str(getattr(error, "value", error))
 
     def save_item(self, what, object_id, token, editmode="bypass"):
         """
@@ -1513,6 +1687,30 @@ class CobblerXMLRPCInterface:
         data = self.api.get_files_since(mtime, collapse=True)
         return self.xmlrpc_hacks(data)
 
+    def get_changes(self, since_seq, limit=0):
+        """
+        Return the objects saved or removed after the change numbered
+        since_seq, as a dict:
+
+            epoch   -- changes when cobblerd restarts
+            seq     -- pass this as since_seq on the next call
+            changes -- list of dicts with seq, what, name, op and mtime,
+                       where op is "save" or "remove"
+            reset   -- True if the changes are no longer known
+
+        Start with since_seq 0.  If the epoch differs from the previous
+        call or reset is True, reload everything.  limit, if positive,
+        caps the number of changes returned.
+        """
+        return self.api.get_changes(since_seq, limit)
+
+    def wait_for_changes(self, since_seq, limit=0, timeout=60):
+        """
+        Like get_changes, but if nothing changed after since_seq yet,
+        waits up to timeout seconds for a change before returning.
+        """
+        return self.api.get_changes(since_seq, limit, timeout)
+
     def get_repos_compatible_with_profile(self, profile=None, token=None, **rest):
         """
         Get repos that can be used with a given profile name
@@ -1548,16 +1746,31 @@ class CobblerXMLRPCInterface:
 
     # this is used by the puppet external nodes feature
     def find_system_by_dns_name(self, dns_name):
-        # FIXME: implement using api.py's find API
-        # and expose generic finds for other methods
         # WARNING: this function is /not/ expected to stay in cobbler long term
-        systems = self.get_systems()
-        for x in systems:
-            for y in x["interfaces"]:
-                if x["interfaces"][y]["dns_name"] == dns_name:
-                    name = x["name"]
-                    return self.get_system_for_koan(name)
-        return {}
+        system = self.api.find_system(dns_name=dns_name)
+        if system is None:
+            return {}
+        return self.get_system_for_koan(system.name)
+
+    def find_system_names_by_address(self, mac_address=None, ip_address=None, token=None, **rest):
+        """
+        Return the names of the systems with an interface with the given MAC
+        address or, if there are none, with the given IP address.  Used to
+        autodetect which system is asking for its automatic installation file.
+
+        @param str mac_address MAC address
+        @param str ip_address IP address
+        @param str token authentication token
+        @return list system names
+        """
+        self._log("find_system_names_by_address(%s,%s)" % (mac_address, ip_address), token=token)
+        for (field, value) in (("mac_address", mac_address), ("ip_address", ip_address)):
+            if not value:
+                continue
+            systems = self.api.find_system(return_list=True, no_errors=True, **{field: value})
+            if systems:
+                return [x.name for x in systems]
+        return []
 
     def get_distro_as_rendered(self, name, token=None, **rest):
         """
@@ -1740,29 +1953,64 @@ class CobblerXMLRPCInterface:
         """
         b64 = self.__get_random(25)
         self.token_cache[b64] = (time.time(), user)
+        self.__schedule_expiry("token", b64)
         return b64
 
-    def __invalidate_expired_tokens(self):
+    def __expiry_cache(self, kind):
         """
-        Deletes any login tokens that might have expired.
-        Also removes expired events
+        Returns the cache and timeout (in seconds) for an expiry kind.
         """
-        timenow = time.time()
-        for token in self.token_cache.keys():
-            (tokentime, user) = self.token_cache[token]
-            if (timenow > tokentime + self.api.settings().auth_token_expiration):
-                self._log("expiring token", token=token, debug=True)
-                del self.token_cache[token]
-        # and also expired objects
-        for oid in self.object_cache.keys():
-            (tokentime, entry) = self.object_cache[oid]
-            if (timenow > tokentime + CACHE_TIMEOUT):
-                del self.object_cache[oid]
-        for tid in self.events.keys():
-            (eventtime, name, status, who) = self.events[tid]
-            if (timenow > eventtime + EVENT_TIMEOUT):
-                del self.events[tid]
-            # logfile cleanup should be dealt w/ by logrotate
+        if kind == "token":
+            return (self.token_cache, self.api.settings().auth_token_expiration)
+        elif kind == "object":
+            return (self.object_cache, CACHE_TIMEOUT)
+        else:
+            return (self.events, EVENT_TIMEOUT)
+
+    def __schedule_expiry(self, kind, key):
+        """
+        Queues a cache entry for removal once its timeout has passed.
+        """
+        (cache, timeout) = self.__expiry_cache(kind)
+        with self.expiry_lock:
+            heapq.heappush(self.expiry_heap, (cache[key][0] + timeout, kind, key))
+
+    def _expire_cached(self, timenow=None):
+        """
+        Deletes any login tokens, cached new objects and events that
+        have expired.  Only the entries at the top of the expiry heap
+        are looked at; a token that has been used since it was queued
+        is queued again with its new deadline.
+        """
+        if timenow is None:
+            timenow = time.time()
+        with self.expiry_lock:
+            while self.expiry_heap and self.expiry_heap[0][0] <= timenow:
+                (deadline, kind, key) = heapq.heappop(self.expiry_heap)
+                (cache, timeout) = self.__expiry_cache(kind)
+                entry = cache.get(key)
+                if entry is None:
+                    # logged out, or already removed
+                    continue
+                deadline = entry[0] + timeout
+                if deadline > timenow:
+                    heapq.heappush(self.expiry_heap, (deadline, kind, key))
+                    continue
+                if kind == "token":
+                    self._log("expiring token", token=key, debug=True)
+                cache.pop(key, None)
+                # logfile cleanup should be dealt w/ by logrotate
+
+    def __expiry_loop(self):
+        """
+        Body of the background thread that sweeps expired cache entries.
+        """
+        while True:
+            time.sleep(EXPIRY_SWEEP_INTERVAL)
+            try:
+                self._expire_cached()
+            except:
+                utils.log_exc(self.logger)
 
     def __validate_user(self, input_user, input_password):
         """
@@ -1786,14 +2034,20 @@ class CobblerXMLRPCInterface:
         access control should call this before doing anything
         else.
         """
-        self.__invalidate_expired_tokens()
-
-        if token in self.token_cache:
-            user = self.get_user_from_token(token)
+        entry = self.token_cache.get(token)
+        timenow = time.time()
+        if entry is not None and timenow > entry[0] + self.api.settings().auth_token_expiration:
+            # expired, but not swept yet
+            self._log("expiring token", token=token, debug=True)
+            self.token_cache.pop(token, None)
+            entry = None
+
+        if entry is not None:
+            user = entry[1]
             if user == "<system>":
                 # system token is only valid over Unix socket
                 return False
-            self.token_cache[token] = (time.time(), user)       # update to prevent timeout
+            self.token_cache[token] = (timenow, user)       # update to prevent timeout
             return True
         else:
             self._log("invalid token", token=token)
@@ -1885,10 +2139,7 @@ class CobblerXMLRPCInterface:
         Retires a token ahead of the timeout.
         """
         self._log("logout", token=token)
-        if token in self.token_cache:
-            del self.token_cache[token]
-            return True
-        return False
+        return self.token_cache.pop(token, None) is not None
 
     def token_check(self, token):
         """
@@ -2036,10 +2287,269 @@ class CobblerXMLRPCInterface:
 # *********************************************************************************
 
 
-class CobblerXMLRPCServer(ThreadingMixIn, SimpleXMLRPCServer.SimpleXMLRPCServer):
-    def __init__(self, args):
+class CobblerXMLRPCRequestHandler(SimpleXMLRPCServer.SimpleXMLRPCRequestHandler):
+    # keep connections open between calls, so long lived clients such as the
+    # /cblr/svc WSGI application do not reconnect for every request
+    protocol_version = "HTTP/1.1"
+    # but drop them once they have been idle for this many seconds
+    timeout = 60
+
+    def handle(self):
+        """
+        Handle a single request.  In between requests the server watches
+        kept alive connections itself, see CobblerXMLRPCServer.
+        """
+        self.lane = None
+        self.deferred = None
+        self.close_connection = 1
+        self.handle_one_request()
+
+    def decode_request_content(self, data):
+        """
+        Called by do_POST with the request body.  Calls for another lane
+        than the one the request arrived on are put aside, see run_deferred.
+        """
+        if self.lane is not None:
+            return SimpleXMLRPCServer.SimpleXMLRPCRequestHandler.decode_request_content(self, data)
+        decoded = SimpleXMLRPCServer.SimpleXMLRPCRequestHandler.decode_request_content(self, data)
+        if decoded is None:
+            return None
+        lane = self.server.get_lane(decoded)
+        if lane == "fast":
+            return decoded
+        # no response yet, do_POST returns right away
+        self.lane = lane
+        self.deferred = data
+        return None
+
+    def run_deferred(self):
+        """
+        Dispatch a request that was put aside by decode_request_content
+        and send the response.  Runs on the worker lane of the call.
+        """
+        self.rfile.close()
+        self.rfile = StringIO.StringIO(self.deferred)
+        self.deferred = None
+        try:
+            self.do_POST()
+            self.wfile.flush()
+        finally:
+            self.finish()
+
+    def finish(self):
+        if self.deferred is None:
+            SimpleXMLRPCServer.SimpleXMLRPCRequestHandler.finish(self)
+
+
+class WorkerLane:
+    """
+    A fixed number of threads running jobs from a bounded queue.
+    """
+    def __init__(self, name, workers, queue_size):
+        self.name = name
+        self.workers = workers
+        self.queue = Queue.Queue(queue_size)
+        self.lock = Lock()
+        self.busy = 0
+        self.handled = 0
+        self.rejected = 0
+        self.wait_time = 0.0
+        self.run_time = 0.0
+        for i in range(workers):
+            worker = Thread(target=self.__work, name="xmlrpc-%s-%d" % (name, i))
+            worker.setDaemon(True)
+            worker.start()
+
+    def submit(self, job, *args):
+        """
+        Queue a job, returns False if the queue is full.
+        """
+        try:
+            self.queue.put_nowait((time.time(), job, args))
+            return True
+        except Queue.Full:
+            with self.lock:
+                self.rejected += 1
+            return False
+
+    def __work(self):
+        while True:
+            (queued, job, args) = self.queue.get()
+            started = time.time()
+            with self.lock:
+                self.busy += 1
+            try:
+                job(*args)
+            finally:
+                with self.lock:
+                    self.busy -= 1
+                    self.handled += 1
+                    self.wait_time += started - queued
+                    self.run_time += time.time() - started
+
+    def stats(self):
+        """
+        Returns the current queue depth and busy workers, and the number of
+        jobs handled and rejected and the seconds they spent queued and
+        running since startup.
+        """
+        with self.lock:
+            return {
+                "workers": self.workers,
+                "busy": self.busy,
+                "queued": self.queue.qsize(),
+                "queue_size": self.queue.maxsize,
+                "handled": self.handled,
+                "rejected": self.rejected,
+                "wait_seconds": self.wait_time,
+                "run_seconds": self.run_time,
+            }
+
+
+class CobblerXMLRPCServer(SimpleXMLRPCServer.SimpleXMLRPCServer):
+    """
+    XMLRPC server answering requests on fixed pools of worker threads.
+
+    Every request is read on the "fast" lane, which answers everything
+    except the SLOW_METHODS and WAIT_METHODS.  Those are passed on to the
+    "slow" and "wait" lanes.  Each lane has a bounded queue, and a request
+    that finds it full is answered with 503 Service Unavailable.  Kept
+    alive connections do not hold a worker while they are idle, the
+    serve_forever loop watches them and queues them again once the next
+    request comes in.  get_xmlrpc_stats() returns the lane statistics.
+    """
+    def __init__(self, args, workers=16, slow_workers=4, wait_workers=8, queue_size=128):
         self.allow_reuse_address = True
-        SimpleXMLRPCServer.SimpleXMLRPCServer.__init__(self, args)
+        SimpleXMLRPCServer.SimpleXMLRPCServer.__init__(self, args, requestHandler=CobblerXMLRPCRequestHandler)
+        # idle kept alive connection -> (client address, idle since)
+        self.idle = {}
+        self.idle_lock = Lock()
+        (self.wakeup_r, self.wakeup_w) = os.pipe()
+        self.lanes = {
+            "fast": WorkerLane("fast", workers, queue_size),
+            "slow": WorkerLane("slow", slow_workers, queue_size),
+            "wait": WorkerLane("wait", wait_workers, queue_size),
+        }
+        self.method_re = re.compile(r"<methodName>\s*([^<\s]*)\s*</methodName>")
+        self.register_function(self.get_xmlrpc_stats)
+
+    def get_lane(self, data):
+        """
+        Returns the lane for an XMLRPC request body.
+        """
+        match = self.method_re.search(data)
+        if match is not None:
+            if match.group(1) in SLOW_METHODS:
+                return "slow"
+            if match.group(1) in WAIT_METHODS:
+                return "wait"
+        return "fast"
+
+    def get_xmlrpc_stats(self):
+        """
+        Returns the statistics of each lane, see WorkerLane.stats.
+        """
+        stats = {}
+        for (name, lane) in self.lanes.items():
+            stats[name] = lane.stats()
+        with self.idle_lock:
+            stats["idle_connections"] = len(self.idle)
+        return stats
+
+    def serve_forever(self, poll_interval=0.5):
+        """
+        Accept new connections and watch the idle kept alive ones, queueing
+        each connection on the fast lane as soon as a request comes in.
+        """
+        while True:
+            poller = select.poll()
+            poller.register(self.fileno(), select.POLLIN)
+            poller.register(self.wakeup_r, select.POLLIN)
+            with self.idle_lock:
+                idle = dict([(conn.fileno(), conn) for conn in self.idle])
+            for fd in idle:
+                poller.register(fd, select.POLLIN)
+            try:
+                events = poller.poll(poll_interval * 1000)
+            except select.error, e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+
+            for (fd, event) in events:
+                if fd == self.fileno():
+                    self._handle_request_noblock()
+                elif fd == self.wakeup_r:
+                    os.read(self.wakeup_r, 4096)
+                else:
+                    with self.idle_lock:
+                        entry = self.idle.pop(idle[fd], None)
+                    if entry is not None:
+                        self.process_request(idle[fd], entry[0])
+            self.__expire_idle()
+
+    def process_request(self, request, client_address):
+        """
+        Queue a connection with a request waiting on it.
+        """
+        if not self.lanes["fast"].submit(self.__handle, request, client_address):
+            self.__reject(request)
+
+    def __handle(self, request, client_address):
+        try:
+            handler = self.RequestHandlerClass(request, client_address, self)
+        except:
+            self.handle_error(request, client_address)
+            self.shutdown_request(request)
+            return
+        if handler.deferred is not None:
+            if self.lanes[handler.lane].submit(self.__handle_deferred, handler):
+                return
+            handler.deferred = None
+            try:
+                handler.send_error(503, "Too many %s requests" % handler.lane)
+                handler.finish()
+            except socket.error:
+                handler.close_connection = 1
+        self.__done(handler)
+
+    def __handle_deferred(self, handler):
+        try:
+            handler.run_deferred()
+        except:
+            self.handle_error(handler.request, handler.client_address)
+            handler.close_connection = 1
+        self.__done(handler)
+
+    def __done(self, handler):
+        """
+        Close the connection of a handled request, or watch it for the
+        next request if it is kept alive.
+        """
+        if handler.close_connection:
+            self.shutdown_request(handler.request)
+            return
+        with self.idle_lock:
+            self.idle[handler.request] = (handler.client_address, time.time())
+        os.write(self.wakeup_w, "x")
+
+    def __reject(self, request):
+        try:
+            request.sendall("HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+        except socket.error:
+            pass
+        self.shutdown_request(request)
+
+    def __expire_idle(self):
+        expired = []
+        deadline = time.time() - self.RequestHandlerClass.timeout
+        with self.idle_lock:
+            for (conn, (client_address, since)) in self.idle.items():
+                if since < deadline:
+                    expired.append(conn)
+                    del self.idle[conn]
+        for conn in expired:
+            self.shutdown_request(conn)
 
 # *********************************************************************************
 
@@ -98,6 +98,27 @@ def serialize_item(collection, item):
     __release_lock(with_changes=True)
 
 
+def serialize_items(collection, items):
+    """
+    Save several items of a collection to disk, taking the lock and
+    marking the collections changed once for all of them.  Storage
+    modules without a serialize_items() of their own save the items
+    one by one.
+
+    @param Collection collection collection
+    @param list items collection items
+    """
+
+    __grab_lock()
+    storage_module = __get_storage_module(collection.collection_type())
+    if hasattr(storage_module, "serialize_items"):
+        storage_module.serialize_items(collection, items)
+    else:
+        for item in items:
+            storage_module.serialize_item(collection, item)
+    __release_lock(with_changes=True)
+
+
 def serialize_delete(collection, item):
     """
     Delete a collection item from disk
@@ -23,7 +23,6 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
 
 import simplejson
 import time
-import urlgrabber
 import xmlrpclib
 import yaml
 import collection_manager
@@ -183,65 +182,45 @@ class CobblerSvc(object):
 
     def autodetect(self, **rest):
         self.__xmlrpc_setup()
-        systems = self.remote.get_systems()
 
         # if kssendmac was in the kernel options line, see
         # if a system can be found matching the MAC address.  This
-        # is more specific than an IP match.
+        # is more specific than an IP match, and cobblerd only falls
+        # back to the IP address if the MAC does not match.
 
         macinput = rest["REMOTE_MAC"]
         if macinput is not None:
             # FIXME: will not key off other NICs, problem?
             mac = macinput.split()[1].strip()
         else:
-            mac = "None"
+            mac = ""
 
-        ip = rest["REMOTE_ADDR"]
+        ip = rest["REMOTE_ADDR"] or ""
 
-        candidates = []
-
-        for x in systems:
-            for y in x["interfaces"]:
-                if x["interfaces"][y]["mac_address"].lower() == mac.lower():
-                    candidates.append(x)
-
-        if len(candidates) == 0:
-            for x in systems:
-                for y in x["interfaces"]:
-                    if x["interfaces"][y]["ip_address"] == ip:
-                        candidates.append(x)
+        candidates = self.remote.find_system_names_by_address(mac, ip)
 
         if len(candidates) == 0:
             return "FAILED: no match (%s,%s)" % (ip, macinput)
         elif len(candidates) > 1:
             return "FAILED: multiple matches"
         elif len(candidates) == 1:
-            return candidates[0]["name"]
+            return candidates[0]
 
     def look(self, **rest):
         # debug only
         return repr(rest)
 
     def find_autoinstall(self, system=None, profile=None, **rest):
-        self.__xmlrpc_setup()
-
-        serverseg = "http//%s" % self.collection_mgr._settings.server
-
-        name = "?"
-        if system is not None:
-            url = "%s/cblr/svc/op/autoinstall/system/%s" % (serverseg, name)
-        elif profile is not None:
-            url = "%s/cblr/svc/op/autoinstall/profile/%s" % (serverseg, name)
-        else:
+        if system is None and profile is None:
             name = self.autodetect(**rest)
             if name.startswith("FAILED"):
                 return "# autodetection %s" % name
-            url = "%s/cblr/svc/op/autoinstall/system/%s" % (serverseg, name)
+            system = name
 
-        try:
-            return urlgrabber.urlread(url)
-        except:
-            return "# automatic installation file retrieval failed (%s)" % url
+        # generate the file right here instead of fetching it back from
+        # our own autoinstall URL
+        return self.autoinstall(profile=profile, system=system,
+                                REMOTE_ADDR=rest.get("REMOTE_ADDR"), REMOTE_MAC=rest.get("REMOTE_MAC"))
 
     def puppet(self, hostname=None, **rest):
         self.__xmlrpc_setup()
@@ -53,6 +53,7 @@ DEFAULTS = {
     "build_reporting_smtp_server": ["localhost", "str"],
     "build_reporting_subject": ["", "str"],
     "buildisodir": ["/var/cache/cobbler/buildiso", "str"],
+    "change_feed_size": [10000, "int"],
     "cheetah_import_whitelist": [["re", "random", "time"], "list"],
     "client_use_https": [0, "bool"],
     "client_use_localhost": [0, "bool"],
@@ -124,10 +125,15 @@ DEFAULTS = {
     "sign_puppet_certs_automatically": [0, "bool"],
     "signature_path": ["/var/lib/cobbler/distro_signatures.json", "str"],
     "signature_url": ["http://www.cobblerd.org/signatures/latest.json", "str"],
+    "sync_workers": [1, "int"],
     "virt_auto_boot": [0, "bool"],
     "webdir": ["/var/www/cobbler", "str"],
     "webdir_whitelist": [".link_cache", "aux", "distro_mirror", "images", "links", "localmirror", "pub", "rendered", "repo_mirror", "repo_profile", "repo_system", "svc", "web", "webui"],
     "xmlrpc_port": [25151, "int"],
+    "xmlrpc_queue_size": [128, "int"],
+    "xmlrpc_slow_workers": [4, "int"],
+    "xmlrpc_wait_workers": [8, "int"],
+    "xmlrpc_workers": [16, "int"],
     "yum_distro_priority": [1, "int"],
     "yum_post_install_mirror": [1, "bool"],
     "yumdownloader_flags": ["--resolve", "str"],
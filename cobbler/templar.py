@@ -22,11 +22,10 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
 02110-1301  USA
 """
 
-import Cheetah
-import functools
 import os
 import os.path
 import pprint
+import re
 import string
 
 jinja2_available = False
@@ -40,10 +39,28 @@ except:
 from cexceptions import CX
 import clogger
 from template_api import Template
+import template_api
 import utils
 
-major, minor, release = Cheetah.Version.split('.')[0:3]
-fix_cheetah_class = int(major) >= 2 and int(minor) >= 4 and int(release) >= 2
+# the "@@variable@@" tokens which render() replaces by their search table value
+AT_VAR_RE = re.compile(r"@@([^@]+)@@")
+
+
+def substitute_at_vars(data, search_table):
+    """
+    Replace every "@@key@@" in data for which key is a string key of
+    search_table by str() of its value, in a single pass over data.
+    Unknown keys are left alone.
+    """
+    if "@@" not in data:
+        return data
+
+    def replacer(match):
+        key = match.group(1)
+        if key in search_table:
+            return str(search_table[key])
+        return match.group(0)
+    return AT_VAR_RE.sub(replacer, data)
 
 
 class Templar:
@@ -129,9 +146,7 @@ class Templar:
             repstr = server
         search_table["http_server"] = repstr
 
-        for x in search_table.keys():
-            if type(x) == str:
-                data_out = data_out.replace("@@%s@@" % str(x), str(search_table[str(x)]))
+        data_out = substitute_at_vars(data_out, search_table)
 
         # remove leading newlines which apparently breaks AutoYAST ?
         if data_out.startswith("\n"):
@@ -140,9 +155,7 @@ class Templar:
         # if requested, write the data out to a file
         if out_path is not None:
             utils.mkdir(os.path.dirname(out_path))
-            fd = open(out_path, "w+")
-            fd.write(data_out)
-            fd.close()
+            utils.atomic_write(out_path, data_out)
 
         return data_out
 
@@ -194,12 +207,12 @@ class Templar:
             "template_universe": table_copy
         })
 
-        # now do full templating scan, where we will also templatify the snippet insertions
-        t = Template(source=raw_data, searchList=[search_table], compilerSettings={'useStackFrame': False})
-
-        if fix_cheetah_class:
-            t.SNIPPET = functools.partial(t.SNIPPET, t)
-            t.read_snippet = functools.partial(t.read_snippet, t)
+        # now do full templating scan, where we will also templatify the snippet insertions.
+        # The template is compiled into a class once and instantiated per render; as the
+        # instance is of a real Template subclass, SNIPPET and read_snippet are bound
+        # methods and need no fixing up.
+        template_class = Template.compile(source=raw_data, compilerSettings={'useStackFrame': False})
+        t = template_class(searchList=[search_table])
 
         try:
             data_out = t.respond()
@@ -214,6 +227,12 @@ class Templar:
         return data_out
 
 
+    def cache_stats(self):
+        """
+        Return the hit and miss counters of the compiled template cache.
+        """
+        return template_api.compile_cache_stats()
+
     def render_jinja2(self, raw_data, search_table, subject=None):
         """
         Render data_input back into a file.
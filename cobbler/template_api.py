@@ -23,8 +23,10 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
 """
 
 import Cheetah.Template
+import hashlib
 import os.path
 import re
+import threading
 
 from cexceptions import FileNotFoundException
 import utils
@@ -70,6 +72,38 @@ BuiltinTemplate = Cheetah.Template.Template.compile(source="\n".join([
 
 MacrosTemplate = Cheetah.Template.Template.compile(file=CHEETAH_MACROS_FILE)
 
+# Template classes compiled from source, by a hash of the source and the
+# compiler settings.  Snippets are included at render time by their contents,
+# so a changed template or snippet simply compiles to a new entry.
+COMPILE_CACHE = {}
+COMPILE_CACHE_MAX = 1000
+COMPILE_CACHE_STATS = {"hits": 0, "misses": 0}
+COMPILE_CACHE_LOCK = threading.Lock()
+
+
+def compile_cache_stats():
+    """
+    Return the number of compiled template cache hits and misses and the
+    number of cached templates.
+    """
+    COMPILE_CACHE_LOCK.acquire()
+    try:
+        stats = COMPILE_CACHE_STATS.copy()
+        stats["size"] = len(COMPILE_CACHE)
+    finally:
+        COMPILE_CACHE_LOCK.release()
+    return stats
+
+
+def clear_compile_cache():
+    COMPILE_CACHE_LOCK.acquire()
+    try:
+        COMPILE_CACHE.clear()
+        COMPILE_CACHE_STATS["hits"] = 0
+        COMPILE_CACHE_STATS["misses"] = 0
+    finally:
+        COMPILE_CACHE_LOCK.release()
+
 
 class Template(BuiltinTemplate, MacrosTemplate):
 
@@ -92,8 +126,41 @@ class Template(BuiltinTemplate, MacrosTemplate):
         """
         Compile a cheetah template with cobbler modifications. Modifications
         include SNIPPET:: syntax replacement and inclusion of cobbler builtin
-        methods.
+        methods.  Templates compiled from a source string (this includes
+        snippets pulled in by SNIPPET) are compiled once per process.
         """
+        key = None
+        if not args and kwargs.get("file") is None and \
+                isinstance(kwargs.get("source"), basestring) and \
+                set(kwargs.keys()) <= set(["source", "file", "compilerSettings"]):
+            settings = sorted((kwargs.get("compilerSettings") or {}).items())
+            source = kwargs["source"]
+            if isinstance(source, unicode):
+                source = source.encode("utf-8")
+            key = hashlib.sha1(repr(settings) + "\0" + source).hexdigest()
+            COMPILE_CACHE_LOCK.acquire()
+            try:
+                if key in COMPILE_CACHE:
+                    COMPILE_CACHE_STATS["hits"] += 1
+                    return COMPILE_CACHE[key]
+                COMPILE_CACHE_STATS["misses"] += 1
+            finally:
+                COMPILE_CACHE_LOCK.release()
+
+        template_class = klass.__compile(*args, **kwargs)
+
+        if key is not None:
+            COMPILE_CACHE_LOCK.acquire()
+            try:
+                if len(COMPILE_CACHE) >= COMPILE_CACHE_MAX:
+                    COMPILE_CACHE.clear()
+                COMPILE_CACHE[key] = template_class
+            finally:
+                COMPILE_CACHE_LOCK.release()
+        return template_class
+    compile = classmethod(compile)
+
+    def __compile(klass, *args, **kwargs):
         def replacer(match):
             return "$SNIPPET('%s')" % match.group(1)
 
@@ -127,7 +194,7 @@ class Template(BuiltinTemplate, MacrosTemplate):
 
         # Now let Cheetah do the actual compilation
         return Cheetah.Template.Template.compile(*args, **kwargs)
-    compile = classmethod(compile)
+    __compile = classmethod(__compile)
 
 
     def read_snippet(self, file):
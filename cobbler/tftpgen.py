@@ -21,15 +21,20 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
 02110-1301  USA
 """
 
+import multiprocessing
 import os
 import os.path
 import re
 import shutil
 import socket
 import string
+import threading
+import time
 
 from cexceptions import CX
+import clogger
 import templar
+import template_api
 import utils
 
 
@@ -280,6 +285,78 @@ class TFTPGen:
                 if grub_path:
                     utils.rmfile(grub_path)
 
+    def write_all_systems_files(self, systems, menu_items, workers=1):
+        """
+        Write the boot loader files for a list of systems.  With more than
+        one worker the systems are split across forked processes, each of
+        which renders its share exactly as write_all_system_files() does, so
+        the output is the same as that of the serial loop.
+        """
+        systems = sorted(systems, key=lambda s: s.name)
+        start = time.time()
+        if workers <= 1 or len(systems) < 2:
+            for system in systems:
+                self.write_all_system_files(system, menu_items)
+        else:
+            workers = min(workers, len(systems))
+            pool = []
+            for i in range(workers):
+                (reader, writer) = multiprocessing.Pipe(False)
+                proc = multiprocessing.Process(target=self.__system_files_worker,
+                                               args=(i, systems[i::workers], menu_items, writer))
+                proc.start()
+                writer.close()
+                pool.append((proc, reader))
+
+            errors = []
+            for (proc, reader) in pool:
+                try:
+                    errors.extend(reader.recv())
+                except EOFError:
+                    errors.append("worker %s died without reporting its results" % proc.pid)
+                reader.close()
+                proc.join()
+            if errors:
+                for error in errors:
+                    self.logger.error(error)
+                raise CX(errors[0])
+        self.logger.info("wrote boot loader files for %d systems in %.2fs (%d worker(s))"
+                         % (len(systems), time.time() - start, max(workers, 1)))
+
+    def __system_files_worker(self, worker, systems, menu_items, conn):
+        """
+        Body of a process forked by write_all_systems_files().  Errors are
+        sent back to the parent instead of being raised.
+        """
+        # the fork may have happened while another thread of cobblerd held
+        # one of these locks, which would then never be released here
+        utils.BLENDER_CACHE_LOCK = threading.Lock()
+        template_api.COMPILE_CACHE_LOCK = threading.Lock()
+        for collection in (self.collection_mgr.distros(), self.collection_mgr.profiles(),
+                           self.collection_mgr.systems(), self.collection_mgr.images(),
+                           self.collection_mgr.repos(), self.collection_mgr.mgmtclasses(),
+                           self.collection_mgr.packages(), self.collection_mgr.files()):
+            collection.lock = threading.Lock()
+            collection.load_lock = threading.RLock()
+        # the same goes for the stdio lock of the log files: write to log
+        # files of our own, leaving the old ones alone
+        for owner in (self, self.templar):
+            if owner.logger.logfile is not None:
+                owner.logger = clogger.Logger(owner.logger.logfile.name)
+
+        start = time.time()
+        errors = []
+        for system in systems:
+            try:
+                self.write_all_system_files(system, menu_items)
+            except CX, e:
+                errors.append(e.value)
+            except Exception, e:
+                errors.append("error writing boot loader files for system %s: %s" % (system.name, e))
+        self.logger.info("worker %d: %d systems in %.2fs" % (worker, len(systems), time.time() - start))
+        conn.send(errors)
+        conn.close()
+
     def make_pxe_menu(self):
         self.make_actual_pxe_menu()
 
@@ -622,9 +699,7 @@ class TFTPGen:
         buffer = self.templar.render(template_data, metadata, None)
         if filename is not None:
             self.logger.info("generating: %s" % filename)
-            fd = open(filename, "w")
-            fd.write(buffer)
-            fd.close()
+            utils.atomic_write(filename, buffer)
         return buffer
 
     def build_kernel_options(self, system, profile, distro, image, arch,
@@ -786,13 +861,14 @@ class TFTPGen:
 
         return append_line
 
-    def write_templates(self, obj, write_file=False, path=None):
+    def write_templates(self, obj, write_file=False, path=None, overwrite=False):
         """
         A semi-generic function that will take an object
         with a template_files dict {source:destiation}, and
         generate a rendered file.  The write_file option
         allows for generating of the rendered output without
-        actually creating any files.
+        actually creating any files.  Existing files are
+        only replaced when overwrite is set.
 
         The return value is a dict of the destination file
         names (after variable substitution is done) and the
@@ -881,7 +957,7 @@ class TFTPGen:
             elif write_file and not os.path.isdir(dest_dir):
                 raise CX("template destination (%s) is invalid" % dest_dir)
                 continue
-            elif write_file and os.path.exists(dest):
+            elif write_file and os.path.exists(dest) and not (overwrite and os.path.isfile(dest)):
                 raise CX("template destination (%s) already exists" % dest)
                 continue
             elif write_file and os.path.isdir(dest):
@@ -900,9 +976,7 @@ class TFTPGen:
 
             if write_file:
                 self.logger.info("generating: %s" % dest)
-                fd = open(dest, "w")
-                fd.write(buffer)
-                fd.close()
+                utils.atomic_write(dest, buffer)
 
         return results
 
@@ -31,9 +31,12 @@ import re
 import shlex
 import shutil
 import simplejson
+import stat
 import subprocess
 import string
 import sys
+import tempfile
+import threading
 import traceback
 import urllib2
 import yaml
@@ -91,6 +94,16 @@ def _(foo):
 MODULE_CACHE = {}
 SIGNATURE_CACHE = {}
 
+# consolidated inheritance data for chains of objects above the system
+# level, keyed by the identity and mtime of every node in the chain.
+# see blender() and invalidate_blender_cache()
+# mode of the new files written by atomic_write(), as open() would create them
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+BLENDER_CACHE = {}
+BLENDER_CACHE_LOCK = threading.Lock()
+
 _re_kernel = re.compile(r'(vmlinu[xz]|kernel.img)')
 _re_initrd = re.compile(r'(initrd(.*).img|ramdisk.image.gz)')
 _re_is_mac = re.compile(':'.join(('[0-9A-Fa-f][0-9A-Fa-f]',) * 6) + '$')
@@ -573,9 +586,7 @@ def blender(api_handle, remove_dicts, root_obj):
 
     tree = grab_tree(api_handle, root_obj)
     tree.reverse()  # start with top of tree, override going down
-    results = {}
-    for node in tree:
-        __consolidate(node, results)
+    results = __consolidate_tree(tree)
 
     # make interfaces accessible without Cheetah-voodoo in the templates
     # EXAMPLE:  $ip == $ip0, $ip1, $ip2 and so on.
@@ -638,6 +649,93 @@ def blender(api_handle, remove_dicts, root_obj):
     return results
 
 
+def __blender_cache_key(tree):
+    """
+    Build the cache key for a chain of nodes (top of the tree first) from the
+    settings file mtime and the uid, name and mtime of every object.  Returns
+    None for chains that must not be cached, i.e. chains ending in a system
+    (there are too many of them to keep around) or containing objects that
+    were never saved.
+    """
+    # the settings are always at the top of the tree, see grab_tree()
+    if len(tree) > 1 and tree[-1].COLLECTION_TYPE == "system":
+        return None
+    try:
+        key = [("settings", os.stat("/etc/cobbler/settings").st_mtime)]
+    except OSError:
+        return None
+    for node in tree[1:]:
+        if not node.uid or not node.mtime:
+            return None
+        key.append((node.COLLECTION_TYPE, node.uid, node.name, node.mtime))
+    return tuple(key)
+
+
+def __copy_results(results):
+    """
+    Copy consolidated data the same way __consolidate() copies node data, so
+    callers may modify the top level dicts and lists of what blender() returns.
+    """
+    copied = {}
+    for (key, value) in results.iteritems():
+        if isinstance(value, dict):
+            copied[key] = value.copy()
+        elif isinstance(value, list):
+            copied[key] = value[:]
+        else:
+            copied[key] = value
+    return copied
+
+
+def __consolidate_tree(tree):
+    """
+    Consolidate a chain of nodes (top of the tree first), reusing the cached
+    result for the longest already known chain of ancestors.
+    """
+    key = __blender_cache_key(tree)
+    if key is not None:
+        cached = BLENDER_CACHE.get(key)
+        if cached is not None:
+            return __copy_results(cached)
+
+    if len(tree) > 1:
+        results = __consolidate_tree(tree[:-1])
+    else:
+        results = {}
+    __consolidate(tree[-1], results)
+
+    if key is not None:
+        BLENDER_CACHE_LOCK.acquire()
+        try:
+            BLENDER_CACHE[key] = __copy_results(results)
+        finally:
+            BLENDER_CACHE_LOCK.release()
+    return results
+
+
+def invalidate_blender_cache(obj=None):
+    """
+    Drop cached blender data for every chain the given object is part of,
+    or everything if no object is given.  Called whenever an object is added
+    to or removed from a collection, and whenever it is saved.
+    """
+    BLENDER_CACHE_LOCK.acquire()
+    try:
+        if obj is None:
+            BLENDER_CACHE.clear()
+            return
+        if obj.COLLECTION_TYPE == "system":
+            # chains containing a system are never cached
+            return
+        for key in BLENDER_CACHE.keys():
+            for node in key:
+                if node[0] == obj.COLLECTION_TYPE and (node[1] == obj.uid or node[2] == obj.name):
+                    del BLENDER_CACHE[key]
+                    break
+    finally:
+        BLENDER_CACHE_LOCK.release()
+
+
 def flatten(data):
     # convert certain nested dicts to strings.
     # this is only really done for the ones koan needs as strings
@@ -1209,6 +1307,45 @@ def rmtree(path, logger=None):
         return True
 
 
+def atomic_write(path, data):
+    """
+    Write data to path through a temporary file in the same directory which
+    is renamed into place, so readers (such as TFTP clients) never see a
+    partially written file, nor an empty one after a crash.  A symlink is
+    written through to the file it points to, and the mode and owner of an
+    existing file are kept.
+    """
+    path = os.path.realpath(path)
+    (fd, tmp_path) = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".%s." % os.path.basename(path))
+    try:
+        f = os.fdopen(fd, "w")
+        try:
+            try:
+                st = os.stat(path)
+            except OSError, e:
+                if e.errno != errno.ENOENT:
+                    raise
+                os.fchmod(f.fileno(), 0666 & ~UMASK)
+            else:
+                os.fchmod(f.fileno(), stat.S_IMODE(st.st_mode))
+                if (st.st_uid, st.st_gid) != (os.geteuid(), os.getegid()):
+                    try:
+                        os.fchown(f.fileno(), st.st_uid, st.st_gid)
+                    except OSError, e:
+                        # only root may give files away
+                        if e.errno != errno.EPERM:
+                            raise
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+        os.rename(tmp_path, path)
+    except:
+        os.unlink(tmp_path)
+        raise
+
+
 def mkdir(path, mode=0755, logger=None):
     try:
         if logger is not None:
@@ -1738,17 +1875,23 @@ def from_dict_from_fields(item, item_dict, fields):
                     item.interfaces[interface][int_field[0][1:]] = int_field[1]
 
 
-def to_dict_from_fields(item, fields):
+def to_dict_from_fields(item, fields, only=None):
+    """
+    fields is something like item_distro.FIELDS, only an optional list
+    of field names to limit the result to
+    """
     _dict = {}
     for elem in fields:
         k = elem[0]
         if k.startswith("*"):
             continue
+        if only is not None and k not in only:
+            continue
         data = getattr(item, k)
         _dict[k] = data
     # interfaces on systems require somewhat special handling
     # they are the only exception in Cobbler.
-    if item.COLLECTION_TYPE == "system":
+    if item.COLLECTION_TYPE == "system" and (only is None or "interfaces" in only):
         _dict["interfaces"] = copy.deepcopy(item.interfaces)
         # for interface in _dict["interfaces"].keys():
         #    for k in _dict["interfaces"][interface].keys():
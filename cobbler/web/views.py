@@ -356,7 +356,6 @@ def genlist(request, what, page=None):
     limit = int(request.session.get("%s_limit" % what, 50))
     sort_field = request.session.get("%s_sort_field" % what, "name")
     filters = simplejson.loads(request.session.get("%s_filters" % what, "{}"))
-    pageditems = remote.find_items_paged(what, utils.strip_none(filters), sort_field, page, limit)
 
     # what columns to show for each page?
     # we also setup the batch actions here since they're dependent
@@ -382,7 +381,7 @@ def genlist(request, what, page=None):
     if what == "system":
         # FIXME: also list network, once working
         columns = ["name", "profile", "status", "netboot_enabled"]
-        profiles = sorted(remote.get_profiles())
+        profiles = remote.get_items("profile", ["name"])
         batchactions += [
             ["Power on", "power", "on"],
             ["Power off", "power", "off"],
@@ -408,6 +407,9 @@ def genlist(request, what, page=None):
     if what == "file":
         columns = ["name"]
 
+    # only fetch the columns shown
+    pageditems = remote.find_items_paged(what, utils.strip_none(filters), sort_field, page, limit, request.session['token'], columns)
+
     # render the list
     t = get_template('generic_list.tmpl')
     html = t.render(RequestContext(request, {
@@ -1170,18 +1172,18 @@ def generic_edit(request, what=None, obj_name=None, editmode="new"):
     # populate some select boxes
     if what == "profile":
         if (obj and obj["parent"] not in (None, "")) or child:
-            __tweak_field(fields, "parent", "choices", __names_from_dicts(remote.get_profiles()))
+            __tweak_field(fields, "parent", "choices", __names_from_dicts(remote.get_items("profile", ["name"])))
         else:
-            __tweak_field(fields, "distro", "choices", __names_from_dicts(remote.get_distros()))
+            __tweak_field(fields, "distro", "choices", __names_from_dicts(remote.get_items("distro", ["name"])))
         __tweak_field(fields, "autoinstall", "choices", autoinstall_list)
-        __tweak_field(fields, "repos", "choices", __names_from_dicts(remote.get_repos()))
-        __tweak_field(fields, "mgmt_classes", "choices", __names_from_dicts(remote.get_mgmtclasses(), optional=False))
+        __tweak_field(fields, "repos", "choices", __names_from_dicts(remote.get_items("repo", ["name"])))
+        __tweak_field(fields, "mgmt_classes", "choices", __names_from_dicts(remote.get_items("mgmtclass", ["name"]), optional=False))
 
     elif what == "system":
-        __tweak_field(fields, "profile", "choices", __names_from_dicts(remote.get_profiles()))
-        __tweak_field(fields, "image", "choices", __names_from_dicts(remote.get_images(), optional=True))
+        __tweak_field(fields, "profile", "choices", __names_from_dicts(remote.get_items("profile", ["name"])))
+        __tweak_field(fields, "image", "choices", __names_from_dicts(remote.get_items("image", ["name"]), optional=True))
         __tweak_field(fields, "autoinstall", "choices", autoinstall_list)
-        __tweak_field(fields, "mgmt_classes", "choices", __names_from_dicts(remote.get_mgmtclasses(), optional=False))
+        __tweak_field(fields, "mgmt_classes", "choices", __names_from_dicts(remote.get_items("mgmtclass", ["name"]), optional=False))
 
     elif what == "mgmtclass":
         __tweak_field(fields, "packages", "choices", __names_from_dicts(remote.get_packages()))
@@ -1191,7 +1193,7 @@ def generic_edit(request, what=None, obj_name=None, editmode="new"):
         __tweak_field(fields, "arch", "choices", remote.get_valid_archs())
         __tweak_field(fields, "os_version", "choices", remote.get_valid_os_versions())
         __tweak_field(fields, "breed", "choices", remote.get_valid_breeds())
-        __tweak_field(fields, "mgmt_classes", "choices", __names_from_dicts(remote.get_mgmtclasses(), optional=False))
+        __tweak_field(fields, "mgmt_classes", "choices", __names_from_dicts(remote.get_items("mgmtclass", ["name"]), optional=False))
 
     elif what == "image":
         __tweak_field(fields, "arch", "choices", remote.get_valid_archs())
@@ -0,0 +1,87 @@
+#!/usr/bin/python
+
+"""
+Compare the per-key "@@variable@@" replacement loop Templar.render() used
+to run with the single pass substitute_at_vars(), over the bundled
+automatic installation templates.
+
+    python contrib/benchmarks/templar_substitution.py [--keys N] [--rounds N]
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+02110-1301  USA
+"""
+
+import glob
+import optparse
+import os
+import time
+
+from cobbler.templar import substitute_at_vars
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "autoinstall_templates")
+
+
+def legacy_substitute(data, search_table):
+    for x in search_table.keys():
+        if type(x) == str:
+            data = data.replace("@@%s@@" % str(x), str(search_table[str(x)]))
+    return data
+
+
+def make_search_table(keys):
+    # roughly the size of a blended system
+    search_table = {"server": "cobbler.example.org", "http_server": "cobbler.example.org",
+                    "http_port": "80", "name": "system01"}
+    for i in range(keys - len(search_table)):
+        search_table["variable_%d" % i] = "value %d" % i
+    return search_table
+
+
+def main():
+    p = optparse.OptionParser()
+    p.add_option("--keys", dest="keys", type="int", default=400, help="search table size")
+    p.add_option("--rounds", dest="rounds", type="int", default=20, help="renders per template")
+    (options, args) = p.parse_args()
+
+    search_table = make_search_table(options.keys)
+    templates = []
+    for path in sorted(glob.glob(os.path.join(TEMPLATE_DIR, "*"))):
+        if os.path.isfile(path):
+            fd = open(path)
+            # give the substitution some real work to do as well
+            templates.append(fd.read() + "\n# @@server@@:@@http_port@@ @@name@@ @@unknown@@\n")
+            fd.close()
+
+    for data in templates:
+        if legacy_substitute(data, search_table) != substitute_at_vars(data, search_table):
+            raise SystemExit("output differs")
+
+    results = []
+    for func in (legacy_substitute, substitute_at_vars):
+        start = time.time()
+        for i in range(options.rounds):
+            for data in templates:
+                func(data, search_table)
+        results.append(time.time() - start)
+
+    renders = options.rounds * len(templates)
+    print "%d templates, %d keys, %d renders" % (len(templates), len(search_table), renders)
+    print "per-key replace: %8.2f ms (%.3f ms/render)" % (results[0] * 1000, results[0] * 1000 / renders)
+    print "single pass:     %8.2f ms (%.3f ms/render)" % (results[1] * 1000, results[1] * 1000 / renders)
+    print "speedup:         %8.1fx" % (results[0] / max(results[1], 1e-9))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,596 @@
+#!/usr/bin/python
+
+"""
+Load test bin/tftpd.py: start it against a stand-in for cobblerd serving
+--systems synthetic systems, then boot --clients simulated PXE clients
+at once, each fetching what pxelinux does:
+
+    pxelinux.0
+    pxelinux.cfg/<uuid>             (not found)
+    pxelinux.cfg/01-<mac>           (the rendered pxelinux.cfg)
+    images/<distro>/vmlinuz
+    images/<distro>/initrd.img
+
+and report transfers/sec, MB/s, p50/p99 completion times and the CPU
+tftpd used per transfer.
+
+    python contrib/benchmarks/tftpd_load.py [--clients N] [--windowsize N]
+        [--loss P] [--workers N] [--multicast] ...
+
+Every client has its own address in 127.0.0.0/8, so this only runs on
+Linux.  The clients run in --client-procs processes so they keep up with
+tftpd; check their CPU use (top) if the numbers look client bound.
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+02110-1301  USA
+"""
+
+import glob
+import multiprocessing
+import optparse
+import os
+import pwd
+import random
+import select
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import xmlrpclib
+
+from SimpleXMLRPCServer import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+from SocketServer import ThreadingMixIn
+from struct import pack, unpack
+
+TOP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+TFTPD = os.path.join(TOP_DIR, "bin", "tftpd.py")
+DISTRO = "bench-distro"
+MULTICAST_GROUP = "239.255.0.69"
+MULTICAST_INTERFACE = "127.0.0.1"
+
+OP_RRQ = 1
+OP_DATA = 3
+OP_ACK = 4
+OP_ERROR = 5
+OP_OACK = 6
+
+
+def client_address(index):
+    return "127.1.%d.%d" % (index // 250, index % 250 + 1)
+
+
+def client_mac(index):
+    return "aa:bb:cc:dd:%02x:%02x" % (index >> 8, index & 0xff)
+
+
+# ==========================================================================
+# the stand-in for cobblerd
+
+class FakeCobblerHandler(SimpleXMLRPCRequestHandler):
+    rpc_paths = ("/cobbler_api",)
+
+
+class FakeCobblerServer(ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+
+
+class FakeCobbler:
+    """
+    The parts of the cobblerd XMLRPC API tftpd uses, over synthetic
+    systems.  Counts the calls made to it.
+    """
+
+    def __init__(self, systems, image_dir):
+        self.calls = {}
+        self.distro = {
+            "name": DISTRO,
+            "kernel": os.path.join(image_dir, "vmlinuz"),
+            "initrd": os.path.join(image_dir, "initrd.img"),
+        }
+        self.systems = {}
+        for i in range(systems):
+            name = "bench%05d" % i
+            mac = client_mac(i)
+            ip = client_address(i)
+            self.systems[name] = {
+                "name": name,
+                "uid": name,
+                "mtime": 1.0,
+                "profile_name": "bench-profile",
+                "distro_name": DISTRO,
+                "interfaces": {"eth0": {"mac_address": mac, "ip_address": ip}},
+                "mac_address_eth0": mac,
+                "ip_address_eth0": ip,
+                "fetchable_files": "",
+                "boot_files": "",
+                "kernel": self.distro["kernel"],
+                "initrd": self.distro["initrd"],
+                "pxelinux.cfg": "default linux\nprompt 0\ntimeout 1\nlabel linux\n"
+                                "  kernel /images/%s/vmlinuz\n"
+                                "  append initrd=/images/%s/initrd.img ks=http://127.0.0.1/cblr/svc/op/ks/system/%s\n"
+                                % (DISTRO, DISTRO, name),
+            }
+
+    def _dispatch(self, method, params):
+        if method == "bench_calls":
+            return self.calls
+        self.calls[method] = self.calls.get(method, 0) + 1
+        func = getattr(self, method, None)
+        if func is None or method.startswith("_"):
+            raise Exception("method %s is not supported" % method)
+        return func(*params)
+
+    def last_modified_time(self):
+        return 1.0
+
+    def get_item_names(self, what):
+        if what == "distro":
+            return [DISTRO]
+        return self.systems.keys()
+
+    def get_changes(self, since_seq, limit=0):
+        return {"epoch": "bench", "seq": 0, "changes": [], "reset": False}
+
+    def find_system(self, query):
+        for system in self.systems.values():
+            iface = system["interfaces"]["eth0"]
+            if (query.get("mac_address", "").lower() == iface["mac_address"] or
+                    query.get("ip_address") == iface["ip_address"]):
+                return [system["name"]]
+        return []
+
+    def get_system_as_rendered(self, name):
+        return self.systems.get(name, {})
+
+    def get_distro_as_rendered(self, name):
+        if name == DISTRO:
+            return self.distro
+        return {}
+
+
+def run_fake_cobbler(systems, image_dir, conn):
+    server = FakeCobblerServer(("127.0.0.1", 0), requestHandler=FakeCobblerHandler,
+                               logRequests=False, allow_none=True)
+    server.register_instance(FakeCobbler(systems, image_dir))
+    conn.send(server.server_address[1])
+    server.serve_forever()
+
+
+# ==========================================================================
+# the PXE clients
+
+class BootClient:
+    """
+    One PXE client fetching its boot files one after the other, as a
+    rfc1350/2347/7440 client with the given blksize and windowsize.
+    Incoming DATA packets are dropped with probability loss.
+
+    With --multicast it also asks for the rfc2090 multicast option, and
+    when tftpd grants it, listens to the group and ACKs only while it is
+    the master client.  Block numbers are not unwrapped there, so the
+    files have to stay under 65536 blocks.
+
+    watch(sock, client) is called for every socket it opens, and
+    watch(sock, None) just before it closes one.
+    """
+
+    def __init__(self, index, options, watch):
+        self.index = index
+        self.options = options
+        self.watch = watch
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((client_address(index), 0))
+        self.sock.setblocking(0)
+        self.watch(self.sock, self)
+        self.group_sock = None
+        mac = client_mac(index).replace(":", "-")
+        self.files = [
+            ("pxelinux.0", True),
+            ("pxelinux.cfg/564d%04x-0000-0000-0000-000000000000" % index, False),
+            ("pxelinux.cfg/01-" + mac, True),
+            ("images/%s/vmlinuz" % DISTRO, True),
+            ("images/%s/initrd.img" % DISTRO, True),
+        ]
+        self.results = []
+        self.started = None
+        self.finished = None
+        self.server = None
+        self.old_servers = set()
+
+    def start(self, now):
+        self.started = now
+        self.next_file(now)
+
+    def next_file(self, now):
+        if not self.files:
+            self.finished = now
+            self.watch(self.sock, None)
+            self.sock.close()
+            return
+        (self.filename, self.must_exist) = self.files.pop(0)
+        opts = [("tsize", "0"), ("blksize", str(self.options.blksize))]
+        if self.options.windowsize > 1:
+            opts.append(("windowsize", str(self.options.windowsize)))
+        if self.options.multicast:
+            opts.append(("multicast", ""))
+        self.last_sent = (pack("!H", OP_RRQ) + self.filename + "\0octet\0" +
+                          "".join(["%s\0%s\0" % kv for kv in opts]))
+        self.last_dest = (self.options.host, self.options.port)
+        self.blksize = 512
+        self.window = 1
+        self.expected = 1
+        self.received = 0
+        self.gap_acked = 0
+        self.retries = 0
+        # multicast: the blocks heard so far, the last one of them all
+        # heard in order, and the short block that ends the file
+        self.master = False
+        self.have = set()
+        self.in_order = 0
+        self.last_block = None
+        if self.server is not None:
+            self.old_servers.add(self.server)
+        self.server = None
+        self.transfer_started = now
+        self.send(now)
+
+    def send(self, now):
+        try:
+            self.sock.sendto(self.last_sent, self.last_dest)
+        except socket.error:
+            pass
+        self.deadline = now + self.options.client_timeout
+
+    def ack(self, block, now):
+        self.last_sent = pack("!HH", OP_ACK, block & 0xFFFF)
+        self.last_dest = self.server
+        self.send(now)
+
+    def done(self, ok, now):
+        self.leave_group()
+        self.results.append((self.filename, ok, self.received, now - self.transfer_started))
+        self.next_file(now)
+
+    def join_group(self, group, port):
+        self.group_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # the other clients listen on the same port
+        self.group_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.group_sock.bind((group, port))
+        self.group_sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                                   socket.inet_aton(group) + socket.inet_aton(MULTICAST_INTERFACE))
+        self.group_sock.setblocking(0)
+        self.watch(self.group_sock, self)
+
+    def leave_group(self):
+        if self.group_sock is not None:
+            self.watch(self.group_sock, None)
+            self.group_sock.close()
+            self.group_sock = None
+
+    def handle_multicast_oack(self, negotiated, now):
+        (group, port, master) = negotiated["multicast"].split(",")
+        if self.group_sock is None:
+            self.join_group(group, int(port))
+        self.master = master == "1"
+        if self.master:
+            # take over the stream from the last block heard in order
+            self.ack(self.in_order, now)
+        else:
+            self.deadline = now + self.options.client_timeout
+
+    def handle_multicast_data(self, pkt, now):
+        (block,) = unpack("!H", pkt[2:4])
+        if block not in self.have:
+            self.have.add(block)
+            self.received += len(pkt) - 4
+            if len(pkt) - 4 < self.blksize:
+                self.last_block = block
+            while self.in_order + 1 in self.have:
+                self.in_order += 1
+        self.retries = 0
+        self.deadline = now + self.options.client_timeout
+        if self.in_order == self.last_block:
+            # master or not, ACKing the last block leaves the session
+            self.ack(self.last_block, now)
+            self.done(True, now)
+        elif self.master:
+            self.ack(self.in_order, now)
+
+    def handle_packet(self, pkt, addr, now, group=False):
+        if group:
+            # sent by whichever client's transfer is the master
+            (opcode,) = unpack("!H", pkt[:2])
+            if opcode == OP_DATA and not (self.options.loss and random.random() < self.options.loss):
+                self.handle_multicast_data(pkt, now)
+            return
+        if self.server is None:
+            if addr in self.old_servers:
+                # left over from an earlier transfer
+                return
+            self.server = addr
+        elif addr != self.server:
+            return
+
+        (opcode,) = unpack("!H", pkt[:2])
+        if opcode == OP_OACK:
+            fields = pkt[2:-1].split("\0")
+            negotiated = dict(zip([f.lower() for f in fields[::2]], fields[1::2]))
+            self.blksize = int(negotiated.get("blksize", 512))
+            self.window = int(negotiated.get("windowsize", 1))
+            if "multicast" in negotiated:
+                self.handle_multicast_oack(negotiated, now)
+            else:
+                self.ack(0, now)
+        elif opcode == OP_ERROR:
+            self.done(not self.must_exist, now)
+        elif opcode == OP_DATA:
+            if self.options.loss and random.random() < self.options.loss:
+                return
+            (block,) = unpack("!H", pkt[2:4])
+            if block == self.expected & 0xFFFF:
+                self.received += len(pkt) - 4
+                self.expected += 1
+                self.retries = 0
+                if len(pkt) - 4 < self.blksize:
+                    self.ack(block, now)
+                    self.done(self.must_exist, now)
+                elif (self.expected - 1) % self.window == 0:
+                    self.ack(block, now)
+                else:
+                    self.deadline = now + self.options.client_timeout
+            elif self.window == 1:
+                # a duplicate: ack it again, as lock-step clients do
+                self.ack(self.expected - 1, now)
+            elif self.gap_acked != self.expected:
+                # missed one: ack what we have once, so the sender
+                # restarts the window from there
+                self.gap_acked = self.expected
+                self.ack(self.expected - 1, now)
+
+    def handle_timeout(self, now):
+        self.retries += 1
+        if self.retries > self.options.client_retries:
+            if self.group_sock is not None:
+                # tell tftpd to drop it from the session
+                self.sock.sendto(pack("!HH", OP_ERROR, 0) + "timeout\0", self.server)
+            self.done(False, now)
+        elif self.group_sock is not None and not self.master:
+            # listening, there is nothing to resend
+            self.deadline = now + self.options.client_timeout
+        else:
+            self.send(now)
+
+
+def run_clients(indexes, options, start_at, queue):
+    """Runs the clients with the given indexes in this process, and puts
+       their results on queue."""
+    random.seed(indexes[0])
+    pending = [(start_at + random.random() * options.ramp, i) for i in indexes]
+    pending.sort()
+    # fd -> (client, socket)
+    active = {}
+    clients = []
+    poll = select.poll()
+
+    def watch(sock, client):
+        if client is not None:
+            active[sock.fileno()] = (client, sock)
+            poll.register(sock.fileno(), select.POLLIN)
+        else:
+            poll.unregister(sock.fileno())
+            del active[sock.fileno()]
+
+    while pending or active:
+        now = time.time()
+        while pending and pending[0][0] <= now:
+            client = BootClient(pending.pop(0)[1], options, watch)
+            clients.append(client)
+            client.start(now)
+
+        for (fd, event) in poll.poll(10):
+            (client, sock) = active.get(fd, (None, None))
+            if client is None:
+                continue
+            # until the client closes the socket
+            while sock is client.sock or sock is client.group_sock:
+                try:
+                    (pkt, addr) = sock.recvfrom(65536)
+                except socket.error:
+                    break
+                client.handle_packet(pkt, addr, time.time(), sock is client.group_sock)
+
+        now = time.time()
+        for (client, sock) in active.values():
+            if sock is client.sock and now > client.deadline:
+                client.handle_timeout(now)
+
+    queue.put([(c.started, c.finished, c.results) for c in clients])
+
+
+# ==========================================================================
+
+def process_cpu(pid):
+    """CPU seconds used so far by pid and its children (the workers)."""
+    ticks = 0
+    for path in glob.glob("/proc/[0-9]*/stat"):
+        try:
+            fd = open(path)
+            fields = fd.read().rsplit(")", 1)[1].split()
+            fd.close()
+        except (IOError, IndexError):
+            continue
+        # fields start at the state: ppid is next, then utime and stime
+        # are the 14th and 15th fields of the whole line
+        if int(path.split("/")[2]) == pid or int(fields[1]) == pid:
+            ticks += int(fields[11]) + int(fields[12])
+    return ticks / float(os.sysconf("SC_CLK_TCK"))
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+def make_file(path, size):
+    fd = open(path, "wb")
+    chunk = os.urandom(min(size, 1024 * 1024))
+    while size > 0:
+        fd.write(chunk[:size])
+        size -= len(chunk)
+    fd.close()
+
+
+def wait_for_tftpd(options, timeout=30):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(0.5)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            sock.sendto(pack("!H", OP_RRQ) + "pxelinux.0\0octet\0", (options.host, options.port))
+            (pkt, addr) = sock.recvfrom(65536)
+            # stop the transfer
+            sock.sendto(pack("!HH", OP_ERROR, 0) + "done\0", addr)
+            return True
+        except socket.error:
+            continue
+    return False
+
+
+def main():
+    p = optparse.OptionParser()
+    p.add_option("--clients", type="int", default=200, help="PXE clients booting at once")
+    p.add_option("--client-procs", dest="client_procs", type="int", default=4,
+                 help="processes running the clients")
+    p.add_option("--systems", type="int", default=0, help="systems in cobbler [clients]")
+    p.add_option("--blksize", type="int", default=1428, help="blksize the clients ask for")
+    p.add_option("--windowsize", type="int", default=1, help="windowsize the clients ask for")
+    p.add_option("--loss", type="float", default=0.0, help="share of DATA packets the clients drop")
+    p.add_option("--ramp", type="float", default=0.0, help="seconds over which the clients start")
+    p.add_option("--kernel-size", dest="kernel_size", type="int", default=4096, help="KB")
+    p.add_option("--initrd-size", dest="initrd_size", type="int", default=16384, help="KB")
+    p.add_option("--client-timeout", dest="client_timeout", type="float", default=1.0,
+                 help="seconds before a client resends")
+    p.add_option("--client-retries", dest="client_retries", type="int", default=5)
+    p.add_option("--workers", type="int", default=1, help="tftpd --workers")
+    p.add_option("--port", type="int", default=16969, help="port tftpd listens on")
+    p.add_option("--multicast", action="store_true", default=False,
+                 help="have tftpd multicast (rfc2090) to %s on loopback" % MULTICAST_GROUP)
+    p.add_option("--tftpd-args", dest="tftpd_args", default="", help="more tftpd arguments")
+    (options, args) = p.parse_args()
+    options.host = "127.0.0.1"
+    options.systems = max(options.systems, options.clients)
+
+    workdir = tempfile.mkdtemp(prefix="tftpd-bench-")
+    fake = None
+    tftpd = None
+    try:
+        image_dir = os.path.join(workdir, "images", DISTRO)
+        os.makedirs(image_dir)
+        make_file(os.path.join(workdir, "pxelinux.0"), 26 * 1024)
+        make_file(os.path.join(image_dir, "vmlinuz"), options.kernel_size * 1024)
+        make_file(os.path.join(image_dir, "initrd.img"), options.initrd_size * 1024)
+
+        (conn, child_conn) = multiprocessing.Pipe()
+        fake = multiprocessing.Process(target=run_fake_cobbler, args=(options.systems, image_dir, child_conn))
+        fake.start()
+        url = "http://127.0.0.1:%d/cobbler_api" % conn.recv()
+        cobbler = xmlrpclib.Server(url)
+
+        log = open(os.path.join(workdir, "tftpd.log"), "w")
+        multicast = []
+        if options.multicast:
+            multicast = ["--multicast_group", MULTICAST_GROUP, "--multicast_interface", MULTICAST_INTERFACE]
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join([os.path.abspath(TOP_DIR)] + filter(None, [env.get("PYTHONPATH")]))
+        tftpd = subprocess.Popen(
+            [sys.executable, TFTPD, "--port", str(options.port), "--prefix", workdir,
+             "--user", pwd.getpwuid(os.getuid())[0], "--cobbler_url", url,
+             "--workers", str(options.workers), "--logger", "stream"] + multicast + options.tftpd_args.split(),
+            # a socket on stdin would make it think it runs under xinetd
+            stdin=open(os.devnull), stdout=log, stderr=subprocess.STDOUT, env=env)
+        if not wait_for_tftpd(options):
+            log.close()
+            raise SystemExit("tftpd did not start:\n" + open(log.name).read())
+
+        # let it load the system map
+        deadline = time.time() + 30
+        while ("system_map_interval" not in options.tftpd_args and time.time() < deadline and
+               cobbler.bench_calls().get("get_system_as_rendered", 0) < options.systems * options.workers):
+            time.sleep(0.2)
+        time.sleep(0.5)
+
+        calls_before = cobbler.bench_calls()
+        cpu_before = process_cpu(tftpd.pid)
+        start = time.time() + 0.5
+        queue = multiprocessing.Queue()
+        procs = []
+        for i in range(options.client_procs):
+            indexes = range(i, options.clients, options.client_procs)
+            if indexes:
+                proc = multiprocessing.Process(target=run_clients, args=(indexes, options, start, queue))
+                proc.start()
+                procs.append(proc)
+        clients = []
+        for proc in procs:
+            clients.extend(queue.get())
+        for proc in procs:
+            proc.join()
+        cpu = process_cpu(tftpd.pid) - cpu_before
+        calls_after = cobbler.bench_calls()
+    finally:
+        if tftpd is not None:
+            os.kill(tftpd.pid, signal.SIGTERM)
+            tftpd.wait()
+        if fake is not None:
+            fake.terminate()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    end = max([c[1] for c in clients])
+    wall = end - start
+    transfers = [r for c in clients for r in c[2]]
+    ok = [r for r in transfers if r[1]]
+    data = sum([r[2] for r in ok])
+
+    print "%d clients (%d processes), tftpd --workers %d, blksize %d, windowsize %d, loss %.1f%%" % (
+        options.clients, len(procs), options.workers, options.blksize, options.windowsize, options.loss * 100)
+    print "wall time:          %8.2f s" % wall
+    print "transfers:          %8d (%d failed)" % (len(transfers), len(transfers) - len(ok))
+    print "transfers/sec:      %8.1f" % (len(ok) / wall)
+    print "MB/s:               %8.2f" % (data / wall / (1024 * 1024))
+    print "tftpd CPU:          %8.2f s, %.2f ms per transfer" % (cpu, cpu * 1000 / max(len(ok), 1))
+    print "cobblerd calls:     %8d" % (sum(calls_after.values()) - sum(calls_before.values()))
+    for (method, count) in sorted(calls_after.items()):
+        if count > calls_before.get(method, 0):
+            print "  %-18s%8d" % (method + ":", count - calls_before.get(method, 0))
+    print
+    print "%-22s %8s %10s %10s" % ("completion time", "count", "p50 ms", "p99 ms")
+    kinds = [("pxelinux.0", "pxelinux.0"), ("pxelinux.cfg (uuid)", "pxelinux.cfg/564d"),
+             ("pxelinux.cfg (mac)", "pxelinux.cfg/01-"), ("vmlinuz", "vmlinuz"), ("initrd.img", "initrd.img")]
+    for (label, match) in kinds:
+        times = [r[3] for r in transfers if match in r[0]]
+        print "%-22s %8d %10.1f %10.1f" % (
+            label, len(times), percentile(times, 50) * 1000, percentile(times, 99) * 1000)
+    boots = [c[1] - c[0] for c in clients]
+    print "%-22s %8d %10.1f %10.1f" % (
+        "whole boot", len(boots), percentile(boots, 50) * 1000, percentile(boots, 99) * 1000)
+
+
+if __name__ == "__main__":
+    main()
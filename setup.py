@@ -389,7 +389,7 @@ class test_command(Command):
 
     def run(self):
         testfiles = []
-        testdirs = ["koan"]
+        testdirs = ["koan", "serializer"]
 
         for d in testdirs:
             testdir = os.path.join(os.getcwd(), "tests", d)
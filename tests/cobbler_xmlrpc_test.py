@@ -40,7 +40,6 @@ def tprint(call_name):
 # TODO: test remote.clear_system_logs()
 # TODO: test remote.disable_netboot()
 # TODO: test remote.extended_version()
-# TODO: test remote.find_items_paged()
 # TODO: test remote.find_system_by_dns_name()
 # TODO: test remote.generatescript()
 # TODO: test remote.get_<item>_as_rendered()
@@ -53,7 +52,6 @@ def tprint(call_name):
 # TODO: test remote.get_template_file_for_profile()
 # TODO: test remote.get_template_file_for_system()
 # TODO: test remote.is_kickstart_in_use()
-# TODO: test remote.logout()
 # TODO: test remote.modify_setting()
 # TODO: test remote.read_or_write_kickstart_template()
 # TODO: test remote.read_or_write_snippet()
@@ -452,6 +450,26 @@ class Test_DistroProfileSystem(CobblerXmlRpcTest):
         result = self.remote.find_system({"name":"testsystem0"}, self.token)
         self.assertTrue(result)
 
+    def _find_system_names_by_address(self):
+        """
+        Test: find a system by the MAC or IP address of one of its interfaces
+        """
+
+        system = self.remote.get_system_handle("testsystem0", self.token)
+        self.assertTrue(self.remote.modify_system(system, "modify_interface", {
+            "macaddress-eth0": "AA:BB:CC:DD:EE:FF",
+            "ipaddress-eth0": "192.168.1.2",
+        }, self.token))
+        self.assertTrue(self.remote.save_system(system, self.token))
+
+        tprint("find_system_names_by_address")
+        result = self.remote.find_system_names_by_address("aa:bb:cc:dd:ee:ff", "", self.token)
+        self.assertEqual(result, ["testsystem0"])
+        result = self.remote.find_system_names_by_address("", "192.168.1.2", self.token)
+        self.assertEqual(result, ["testsystem0"])
+        result = self.remote.find_system_names_by_address("00:11:22:33:44:55", "192.168.1.3", self.token)
+        self.assertEqual(result, [])
+
     def _copy_distro(self):
         """
         Test: copy a distro object
@@ -576,6 +594,7 @@ class Test_DistroProfileSystem(CobblerXmlRpcTest):
         self._copy_system()
         self._rename_system()
         self._get_repo_config_for_system()
+        self._find_system_names_by_address()
 
         self._remove_system()
         self._remove_profile()
@@ -1107,6 +1126,88 @@ class Test_Item(CobblerXmlRpcTest):
         new_items_names = self.remote.get_item_names(type)
         self.assertTrue(len(new_items_names) == len(items_names))
 
+    def test_xapi_object_edit_bulk(self):
+
+        type = "mgmtclass"
+
+        tprint("xapi_object_edit_bulk")
+        items_names = self.remote.get_item_names(type)
+
+        results = self.remote.xapi_object_edit_bulk([
+            [type, "testbulk0", "add", {"name": "testbulk0", "comment": "first"}],
+            [type, "testbulk1", "add", {"name": "testbulk1"}],
+            [type, "testbulk0", "add", {"name": "testbulk0"}],
+            [type, "testbulk0", "edit", {"comment": "second"}],
+        ], self.token)
+        self.assertTrue(results[0] is True)
+        self.assertTrue(results[1] is True)
+        # already exists
+        self.assertTrue(results[2] is not True)
+        self.assertTrue(results[3] is True)
+        self.assertTrue(self.remote.get_item(type, "testbulk0")["comment"] == "second")
+
+        new_items_names = self.remote.get_item_names(type)
+        self.assertTrue(len(new_items_names) == len(items_names) + 2)
+
+        results = self.remote.xapi_object_edit_bulk([
+            [type, "testbulk0", "remove", {"name": "testbulk0"}],
+            [type, "testbulk1", "remove", {"name": "testbulk1"}],
+        ], self.token)
+        self.assertTrue(results == [True, True])
+
+        new_items_names = self.remote.get_item_names(type)
+        self.assertTrue(len(new_items_names) == len(items_names))
+
+    def test_get_items_paged(self):
+
+        type = "mgmtclass"
+
+        self.remote.xapi_object_edit_bulk([
+            [type, "testpage%s" % i, "add", {"name": "testpage%s" % i, "comment": "page"}] for i in range(3)
+        ], self.token)
+        names = sorted(self.remote.get_item_names(type))
+        offset = names.index("testpage0")
+
+        tprint("get_items")
+        items = self.remote.get_items(type, ["name", "comment"], offset, 2)
+        self.assertTrue([x["name"] for x in items] == ["testpage0", "testpage1"])
+        self.assertTrue(sorted(items[0].keys()) == ["comment", "name"])
+
+        tprint("get_mgmtclasses")
+        items = self.remote.get_mgmtclasses(1, len(names), self.token, ["name"])
+        self.assertTrue([x["name"] for x in items] == names)
+
+        tprint("find_items_paged")
+        result = self.remote.find_items_paged(type, {"comment": "page"}, "!name", 1, 2, self.token, ["name"])
+        self.assertTrue([x["name"] for x in result["items"]] == ["testpage2", "testpage1"])
+        self.assertTrue(result["pageinfo"]["num_items"] == 3)
+
+        self.remote.xapi_object_edit_bulk([
+            [type, "testpage%s" % i, "remove", {"name": "testpage%s" % i}] for i in range(3)
+        ], self.token)
+
+    def test_get_changes(self):
+
+        type = "mgmtclass"
+
+        tprint("get_changes")
+        feed = self.remote.get_changes(0)
+        seq = feed["seq"]
+
+        self.remote.xapi_object_edit_bulk([
+            [type, "testchanges0", "add", {"name": "testchanges0"}],
+            [type, "testchanges0", "remove", {"name": "testchanges0"}],
+        ], self.token)
+
+        new_feed = self.remote.get_changes(seq)
+        self.assertTrue(new_feed["epoch"] == feed["epoch"])
+        self.assertFalse(new_feed["reset"])
+        changes = [(x["what"], x["name"], x["op"]) for x in new_feed["changes"]]
+        self.assertTrue(changes == [(type, "testchanges0", "save"), (type, "testchanges0", "remove")])
+
+        tprint("wait_for_changes")
+        self.assertTrue(self.remote.wait_for_changes(new_feed["seq"], 0, 1)["changes"] == [])
+
 class Test_NonObjectCalls(CobblerXmlRpcTest):
 
     def _wait_task_end(self, tid):
@@ -1137,6 +1238,30 @@ class Test_NonObjectCalls(CobblerXmlRpcTest):
         tprint("get_user_from_token")
         self.assertTrue(self.remote.get_user_from_token(self.token))
 
+    def test_token_check(self):
+        """
+        Test: a token is valid until logout
+        """
+
+        tprint("token_check")
+        token = self.remote.login("", get_shared_secret())
+        self.assertTrue(self.remote.token_check(token))
+        self.assertTrue(self.remote.logout(token))
+        self.assertFalse(self.remote.token_check(token))
+
+    def test_get_xmlrpc_stats(self):
+        """
+        Test: get the XMLRPC worker lane statistics
+        """
+
+        tprint("get_xmlrpc_stats")
+        stats = self.remote.get_xmlrpc_stats()
+        for lane in ("fast", "slow", "wait"):
+            self.assertTrue(stats[lane]["workers"] > 0)
+            self.assertTrue(stats[lane]["queued"] <= stats[lane]["queue_size"])
+        # this call is being handled on the fast lane
+        self.assertTrue(stats["fast"]["busy"] >= 1)
+
     def test_check(self):
         """
         Test: check Cobbler status
@@ -0,0 +1,90 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from cobbler.modules import serializer_snapshot
+
+
+class FakeItem:
+    def __init__(self, name, **fields):
+        self.name = name
+        self.fields = fields
+
+    def to_dict(self):
+        _dict = {"name": self.name}
+        _dict.update(self.fields)
+        return _dict
+
+
+class FakeCollection:
+    def __init__(self, items):
+        self.items = items
+
+    def collection_type(self):
+        return "system"
+
+    def to_list(self):
+        return [item.to_dict() for item in self.items]
+
+
+class SerializerSnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.old_dir = serializer_snapshot.COLLECTIONS_DIR
+        self.old_min_size = serializer_snapshot.COMPACT_MIN_SIZE
+        serializer_snapshot.COLLECTIONS_DIR = tempfile.mkdtemp()
+        self.journal = os.path.join(serializer_snapshot.COLLECTIONS_DIR, "systems.journal")
+        self.snapshot = os.path.join(serializer_snapshot.COLLECTIONS_DIR, "systems.json")
+
+    def tearDown(self):
+        shutil.rmtree(serializer_snapshot.COLLECTIONS_DIR)
+        serializer_snapshot.COLLECTIONS_DIR = self.old_dir
+        serializer_snapshot.COMPACT_MIN_SIZE = self.old_min_size
+
+    def load(self):
+        items = serializer_snapshot.deserialize_raw("system")
+        return dict([(item["name"], item) for item in items])
+
+    def testRoundTrip(self):
+        collection = FakeCollection([FakeItem("a", profile="p1"), FakeItem("b", profile="p1")])
+        serializer_snapshot.serialize(collection)
+        self.assertFalse(os.path.exists(self.journal))
+
+        serializer_snapshot.serialize_item(collection, FakeItem("a", profile="p2"))
+        serializer_snapshot.serialize_items(collection, [FakeItem("c", profile="p1")])
+        serializer_snapshot.serialize_delete(collection, FakeItem("b"))
+        self.assertTrue(os.path.exists(self.journal))
+
+        loaded = self.load()
+        self.assertEqual(sorted(loaded.keys()), ["a", "c"])
+        self.assertEqual(loaded["a"]["profile"], "p2")
+
+        serializer_snapshot.compact("system")
+        self.assertFalse(os.path.exists(self.journal))
+        self.assertEqual(self.load(), loaded)
+
+    def testTornLastLine(self):
+        collection = FakeCollection([FakeItem("a", profile="p1")])
+        serializer_snapshot.serialize(collection)
+        serializer_snapshot.serialize_item(collection, FakeItem("b", profile="p1"))
+
+        # a crash half way through appending the next change
+        fd = open(self.journal, "a")
+        fd.write('{"op": "save", "name": "c", "item": {"na')
+        fd.close()
+        self.assertEqual(sorted(self.load().keys()), ["a", "b"])
+
+        # the next change is not swallowed by the torn one
+        serializer_snapshot.serialize_item(collection, FakeItem("d", profile="p1"))
+        self.assertEqual(sorted(self.load().keys()), ["a", "b", "d"])
+
+        serializer_snapshot.compact("system")
+        self.assertEqual(sorted(self.load().keys()), ["a", "b", "d"])
+
+    def testCompactsOnceJournalIsLarge(self):
+        serializer_snapshot.COMPACT_MIN_SIZE = 0
+        collection = FakeCollection([FakeItem("a", profile="p1")])
+        serializer_snapshot.serialize(collection)
+        serializer_snapshot.serialize_item(collection, FakeItem("a", profile="p2"))
+        self.assertFalse(os.path.exists(self.journal))
+        self.assertEqual(self.load()["a"]["profile"], "p2")